@@ -1,17 +1,42 @@
 # app.py - 主應用入口
-from flask import Flask, jsonify, request, send_from_directory
+import os
+import json
+import click
+from flask import Flask, Response, abort, jsonify, request, send_from_directory, stream_with_context
+from werkzeug.utils import safe_join
 from flask_cors import CORS
+from sqlalchemy.orm import selectinload
 from database import db, init_database
-from models import Keyword, Author, Article, Analysis, QnaHistory, Setting # *** 1. 匯入 Setting ***
+from models import Keyword, Article, Analysis, QnaHistory, Setting, Job, Lease # *** 1. 匯入 Setting ***
+from jobs import job_queue
 import services
+import figures
+import listing
+import migrations
+import search_index
+import storage
+from embeddings import vector_index, article_chunks, rebuild_index as rebuild_embeddings
+from llm_cache import llm_cache
+from fulltext import fulltext_store
+from llm_scheduler import llm_scheduler
+from response_cache import response_cache, media_cache_headers, article_scope, LIBRARY
+import metrics
+from coordination import process_id
+from logs import get_logger
 import scheduler
 
+log = get_logger(__name__)
+
 # --- Flask 應用設置 ---
 app = Flask(__name__, static_folder='static')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///research_assistant.db'
+# 相对路径位于 instance/ 目录下; 测试等场景可用 DATABASE_URL 指向其他数据库
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", 'sqlite:///research_assistant.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
+job_queue.init_app(app)
+response_cache.init_app(app, db)
+metrics.request_metrics.init_app(app)
 CORS(app)
 
 # --- API 路由 ---
@@ -37,45 +62,36 @@ def manage_settings():
 # *** 3. 將 /api/articles 重命名為 /api/articles/latest 並增加 is_favorited ***
 @app.route('/api/articles/latest')
 def get_latest_articles():
-    articles = Article.query.order_by(Article.published.desc()).all()
-    results = []
-    for article in articles:
-        simple_analysis = Analysis.query.filter_by(article_id=article.id, analysis_type='summary').first()
-        results.append({
-            'id': article.id,
-            'title': article.title,
-            'published': article.published.strftime('%Y-%m-%d'),
-            'authors': [author.name for author in article.authors],
-            'summary_analysis': simple_analysis.content if simple_analysis else None,
-            'is_favorited': article.is_favorited # <-- 新增
-        })
-    return jsonify(results)
+    return _list_articles_response(favorites_only=False)
 
 # *** 4. 新增 /api/articles/favorites 路由 ***
 @app.route('/api/articles/favorites')
 def get_favorite_articles():
-    articles = Article.query.filter_by(is_favorited=True).order_by(Article.published.desc()).all()
-    results = []
-    for article in articles:
-        simple_analysis = Analysis.query.filter_by(article_id=article.id, analysis_type='summary').first()
-        results.append({
-            'id': article.id,
-            'title': article.title,
-            'published': article.published.strftime('%Y-%m-%d'),
-            'authors': [author.name for author in article.authors],
-            'summary_analysis': simple_analysis.content if simple_analysis else None,
-            'is_favorited': article.is_favorited
-        })
-    return jsonify(results)
+    return _list_articles_response(favorites_only=True)
+
+def _list_articles_response(favorites_only):
+    cursor = request.args.get('cursor')
+    limit = listing.parse_limit(request.args.get('limit'))
+    try:
+        return response_cache.respond(
+            ('articles', favorites_only, cursor, limit), (LIBRARY,),
+            lambda: listing.list_articles(favorites_only=favorites_only, cursor=cursor, limit=limit)
+        )
+    except listing.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
 
 @app.route('/api/articles/<int:article_id>')
 def get_article_details(article_id):
+    return response_cache.respond(('article', article_id), (article_scope(article_id),),
+                                  lambda: _article_details(article_id))
+
+def _article_details(article_id):
     article = Article.query.get_or_404(article_id)
     summary = Analysis.query.filter_by(article_id=article.id, analysis_type='summary').first()
     detailed = Analysis.query.filter_by(article_id=article.id, analysis_type='detailed').first()
     qna_history = QnaHistory.query.filter_by(article_id=article.id).order_by(QnaHistory.created_at).all()
     
-    return jsonify({
+    return {
         'id': article.id,
         'title': article.title,
         'published': article.published.strftime('%Y-%m-%d'),
@@ -85,8 +101,10 @@ def get_article_details(article_id):
         'summary_analysis': summary.content if summary else None,
         'detailed_analysis': detailed.content if detailed else None,
         'qna_history': [{'question': q.question, 'answer': q.answer} for q in qna_history],
-        'is_favorited': article.is_favorited # <-- 新增
-    })
+        'is_favorited': article.is_favorited, # <-- 新增
+        'pdf_status': article.pdf_status,
+        'analysis_status': article.analysis_status
+    }
 
 # *** 5. 新增收藏/取消收藏的路由 ***
 @app.route('/api/articles/<int:article_id>/favorite', methods=['POST'])
@@ -104,35 +122,147 @@ def ask_question(article_id):
     if not question:
         return jsonify({'error': 'Question is required'}), 400
     
+    context = _article_qna_context(article, question)
+    answer = services.AnalysisService.ask_question_with_context(question, context)
+    _save_qna(article, question, answer)
+
+    return jsonify({'answer': answer})
+
+@app.route('/api/articles/<int:article_id>/ask/stream', methods=['POST'])
+def ask_question_stream(article_id):
+    """以 Server-Sent Events 逐段返回回答, 流正常结束后再保存问答记录; 上游中途失败时发送 error 事件, 不保存"""
+    article = Article.query.get_or_404(article_id)
+    question = (request.get_json(silent=True) or {}).get('question')
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+    context = _article_qna_context(article, question)
+
+    def generate():
+        parts = []
+        # 客户端断开时生成器在 yield 处收到 GeneratorExit, 上游流随之关闭, 不完整的回答不会保存
+        try:
+            for token in services.AnalysisService.stream_question_with_context(question, context):
+                parts.append(token)
+                yield _sse_event('token', {'token': token})
+        except Exception:
+            yield _sse_event('error', {'error': 'The answer could not be completed.'})
+            return
+        answer = "".join(parts)
+        # 视图返回后原会话已关闭, 这里重新加载文章再写入; 回答期间文章可能已被删除
+        article = db.session.get(Article, article_id)
+        if article is not None:
+            _save_qna(article, question, answer)
+        yield _sse_event('done', {'answer': answer})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _article_qna_context(article, question):
     detailed_analysis = Analysis.query.filter_by(article_id=article.id, analysis_type='detailed').first()
     context = f"Original Abstract: {article.original_summary}\n\nDetailed Analysis: {detailed_analysis.content if detailed_analysis else ''}"
-    
-    answer = services.AnalysisService.ask_question_with_context(question, context)
+    # 只附上全文中与问题相关的片段, 长论文的 prompt 大小也有上限。
+    # 请求中只使用已缓存的全文; 全文分析开启时, 尚未提取的论文在后台提取, 之后的提问即可使用
+    excerpts = services.relevant_excerpts(article, question)
+    if excerpts is None and services.ANALYSIS_SOURCE == 'fulltext':
+        job_queue.submit('extract_fulltext', {'article_id': article.id})
+    if excerpts:
+        context += f"\n\nRelevant Excerpts from the Full Text:\n{excerpts}"
+    return context
 
+def _save_qna(article, question, answer):
     # 保存問答記錄到資料庫
     new_qna = QnaHistory(article_id=article.id, question=question, answer=answer)
     db.session.add(new_qna)
+    search_index.index_article(article)
     db.session.commit()
 
-    return jsonify({'answer': answer})
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/articles/<int:article_id>/related')
+def get_related_articles(article_id):
+    article = Article.query.get_or_404(article_id)
+    k = max(1, min(request.args.get('k', 10, type=int), 50))
+    related = vector_index.related_articles(article.id, k=k)
+    articles = {a.id: a for a in Article.query.options(
+        selectinload(Article.authors), selectinload(Article.summary_analysis)
+    ).filter(Article.id.in_([related_id for related_id, _ in related]))}
+    results = []
+    for related_id, score in related:
+        if related_id in articles:
+            card = listing.serialize_article_card(articles[related_id])
+            card['score'] = round(score, 4)
+            results.append(card)
+    return jsonify(results)
+
+@app.route('/api/library/ask', methods=['POST'])
+def ask_library_question():
+    """跨文库问答: 先用向量索引取回最相关的 k 个片段作为上下文, 再调用 LLM"""
+    payload = request.get_json(silent=True) or {}
+    question = payload.get('question')
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+    try:
+        k = max(1, min(int(payload.get('k', 6)), 20))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k must be an integer'}), 400
+
+    hits = vector_index.search_chunks(question, k=k)
+    articles = {a.id: a for a in Article.query.filter(Article.id.in_({article_id for article_id, _, _ in hits}))}
+    chunk_texts = {}
+    context_parts = []
+    sources = []
+    for article_id, kind, score in hits:
+        article = articles.get(article_id)
+        if article is None:
+            continue
+        if article_id not in chunk_texts:
+            chunk_texts[article_id] = dict(article_chunks(article))
+        context_parts.append(services.LIBRARY_QNA_CONTEXT_TEMPLATE.format(
+            index=len(context_parts) + 1,
+            title=article.title,
+            published=article.published.strftime('%Y-%m-%d'),
+            text=chunk_texts[article_id].get(kind, '')
+        ))
+        sources.append({'id': article.id, 'title': article.title, 'chunk': kind, 'score': round(score, 4)})
+
+    answer = services.AnalysisService.ask_question_with_context(question, "\n".join(context_parts))
+    return jsonify({'answer': answer, 'sources': sources})
 
 @app.route('/api/articles/<int:article_id>', methods=['DELETE'])
 def delete_article(article_id):
     article = Article.query.get_or_404(article_id)
+    search_index.remove_article(article.id)
+    fulltext_store.remove(services.ArxivService.article_pdf_path(article))
+    local_path, entry_id = article.local_path, article.entry_id
     db.session.delete(article)
     db.session.commit()
+    vector_index.remove_article(article_id)
+    # PDF 与插图目录由后台任务回收, 删除大目录不阻塞请求
+    if local_path:
+        job_queue.submit('storage_gc', {'local_path': local_path, 'entry_id': entry_id})
     return jsonify({'status': 'success', 'message': 'Article deleted.'})
 
+@app.route('/api/articles/<int:article_id>/storage')
+def get_article_storage(article_id):
+    article = Article.query.get_or_404(article_id)
+    usage = storage.folder_usage(article.local_path)
+    if usage is None:
+        return jsonify({'error': 'Article folder not found'}), 404
+    return jsonify(usage)
+
 @app.route('/api/articles/<int:article_id>/regenerate', methods=['POST'])
 def regenerate_analysis(article_id):
     article = Article.query.get_or_404(article_id)
-    services.regenerate_analysis_for_article(article)
-    return jsonify({'status': 'success', 'message': 'Analysis regeneration started.'})
+    # force=true 时跳过 LLM 缓存
+    force = bool((request.get_json(silent=True) or {}).get('force')) or request.args.get('force') in ('1', 'true')
+    job = job_queue.submit('regenerate', {'article_id': article.id, 'force': force})
+    return jsonify({'status': 'success', 'message': 'Analysis regeneration started.', 'job_id': job.id}), 202
 
 @app.route('/api/articles/fetch', methods=['POST'])
 def fetch_new_articles():
-    services.run_fetch_and_process_job()
-    return jsonify({'status': 'success', 'message': 'New articles fetch job started.'})
+    job = job_queue.submit('fetch')
+    return jsonify({'status': 'success', 'message': 'New articles fetch job started.', 'job_id': job.id}), 202
 
 @app.route('/api/articles/search', methods=['GET'])
 def search_articles():
@@ -143,14 +273,104 @@ def search_articles():
     search_results = services.ArxivService.search_raw(query)
     return jsonify(search_results)
 
+@app.route('/api/library/search', methods=['GET'])
+def search_library():
+    """在已导入的文章中全文检索, 按相关度排序并返回高亮片段"""
+    query = request.args.get('query', '').strip()
+    if not query:
+        return jsonify({'error': 'Query parameter is required'}), 400
+    limit = listing.parse_limit(request.args.get('limit', 20))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    hits, has_more = search_index.search(query, limit=limit, offset=offset)
+    articles = {a.id: a for a in Article.query.options(
+        selectinload(Article.authors), selectinload(Article.summary_analysis)
+    ).filter(Article.id.in_([hit[0] for hit in hits]))}
+    results = []
+    for article_id, score, title_highlight, snippet in hits:
+        if article_id not in articles:
+            continue
+        card = listing.serialize_article_card(articles[article_id])
+        card.update({'score': round(score, 6), 'title_highlight': title_highlight, 'snippet': snippet})
+        results.append(card)
+    return jsonify({'results': results, 'next_offset': offset + limit if has_more else None})
+
 @app.route('/api/articles/batch-import', methods=['POST'])
 def batch_import_articles():
     entry_ids = request.json.get('entry_ids')
     if not entry_ids:
         return jsonify({'error': 'entry_ids list is required'}), 400
     
-    services.batch_import_and_process(entry_ids)
-    return jsonify({'status': 'success', 'message': 'Batch import job started.'})
+    job = job_queue.submit('batch_import', {'entry_ids': sorted(set(entry_ids))})
+    return jsonify({'status': 'success', 'message': 'Batch import job started.', 'job_id': job.id}), 202
+
+# --- PDF 下载 ---
+@app.route('/api/downloads')
+def get_download_stats():
+    return jsonify(services.download_stats())
+
+@app.route('/api/downloads/retry', methods=['POST'])
+def retry_downloads():
+    job = job_queue.submit('retry_downloads')
+    return jsonify({'status': 'success', 'message': 'PDF download retry started.', 'job_id': job.id}), 202
+
+# --- LLM 调用 ---
+@app.route('/api/llm/stats')
+def get_llm_stats():
+    return jsonify({'scheduler': llm_scheduler.stats(), 'analyses': services.analysis_stats()})
+
+@app.route('/api/analyses/retry', methods=['POST'])
+def retry_analyses():
+    job = job_queue.submit('retry_analyses')
+    return jsonify({'status': 'success', 'message': 'Analysis retry started.', 'job_id': job.id}), 202
+
+# --- 监控 ---
+@app.route('/api/metrics')
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# --- 后台任务 ---
+@app.route('/api/jobs')
+def list_jobs():
+    jobs = Job.query.order_by(Job.id.desc()).limit(50).all()
+    return jsonify([job.to_dict() for job in jobs])
+
+@app.route('/api/jobs/<int:job_id>')
+def get_job_status(job_id):
+    status = job_queue.get_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/scheduler')
+def get_scheduler_status():
+    """多进程部署时由哪个进程负责定时任务; 响应本请求的进程未必是领导者"""
+    lease = db.session.get(Lease, scheduler.leader.name)
+    return jsonify({
+        'process': process_id(),
+        'is_leader': scheduler.leader.is_leader,
+        'leader': lease.holder if lease else None,
+        'lease_expires_at': lease.expires_at.isoformat() if lease else None
+    })
+
+@app.route('/api/storage')
+def get_storage_usage():
+    """最近一次文库扫描的结果; limit 为列出的占用最大的文章数"""
+    return jsonify(storage.usage_report(limit=request.args.get('limit', 20, type=int)))
+
+@app.route('/api/storage/scan', methods=['POST'])
+def scan_storage():
+    data = request.get_json(silent=True) or {}
+    params = {key: data[key] for key in ('limit', 'dry_run', 'dedupe', 'collect_orphans') if key in data}
+    job = job_queue.submit('storage_scan', params)
+    return jsonify({'status': 'success', 'message': 'Storage scan started.', 'job_id': job.id}), 202
 
 @app.route('/api/keywords', methods=['GET', 'POST'])
 def manage_keywords():
@@ -172,11 +392,31 @@ def delete_keyword(keyword_text):
         db.session.commit()
     return jsonify({'success': True})
 
+@app.route('/api/cache/llm', methods=['GET', 'DELETE'])
+def manage_llm_cache():
+    if request.method == 'DELETE':
+        llm_cache.clear()
+    return jsonify(llm_cache.stats())
+
 # *** 新增路由 ***: 用於提供媒體檔案 (圖片)
 @app.route('/media/<path:subpath>')
 def serve_media(subpath):
     # 從 services 配置中獲取儲存路徑
-    return send_from_directory(services.SAVE_PATH, subpath)
+    return media_cache_headers(send_from_directory(services.SAVE_PATH, subpath), subpath)
+
+# 插图缩略图: 导入时已生成, 旧文章的图片在首次访问时生成并缓存
+@app.route('/media/thumbs/<path:subpath>')
+def serve_thumbnail(subpath):
+    image_path = safe_join(os.path.join(app.root_path, services.SAVE_PATH), subpath)
+    if image_path is None or not os.path.isfile(image_path):
+        abort(404)
+    try:
+        figures.thumbnail_pool.submit(figures.make_thumbnail, image_path).result()
+    except Exception as e:
+        log.warning("Failed to create thumbnail", path=subpath, error=str(e))
+        return media_cache_headers(send_from_directory(services.SAVE_PATH, subpath), subpath)
+    thumb_subpath = figures.thumbnail_path_for(subpath)
+    return media_cache_headers(send_from_directory(services.SAVE_PATH, thumb_subpath), thumb_subpath)
 
 @app.route('/')
 def index():
@@ -184,8 +424,48 @@ def index():
 
 
 
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """为已有数据库重建本地全文索引: flask --app app rebuild-search-index"""
+    count = search_index.rebuild_index()
+    print(f"Search index rebuilt for {count} articles.")
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """执行未应用的数据库迁移: flask --app app migrate-db"""
+    db.create_all()
+    applied = migrations.run_migrations()
+    with db.engine.connect() as conn:
+        version = migrations.current_version(conn)
+    print(f"Applied migrations: {applied or 'none'}. Schema version: {version}.")
+
+@app.cli.command('rebuild-embeddings')
+def rebuild_embeddings_command():
+    """重新计算所有文章的向量: flask --app app rebuild-embeddings"""
+    count = rebuild_embeddings(vector_index)
+    print(f"Embeddings rebuilt for {count} articles.")
+
+@app.cli.command('storage-scan')
+@click.option('--dry-run', is_flag=True, help='只统计, 不删除或链接任何文件')
+@click.option('--limit', type=int, default=None, help='本次最多重新遍历的目录数')
+@click.option('--no-dedupe', is_flag=True, help='跳过按内容去重')
+@click.option('--collect-orphans', is_flag=True, default=storage.STORAGE_ORPHAN_GC,
+              help='删除超过宽限期的孤立目录 (默认见 STORAGE_ORPHAN_GC)')
+def storage_scan_command(dry_run, limit, no_dedupe, collect_orphans):
+    """对账文库目录, 回收孤立目录并去重: flask --app app storage-scan"""
+    report = storage.StorageScanner(dry_run=dry_run, collect_orphans=collect_orphans).run(limit=limit,
+                                                                                        dedupe=not no_dedupe)
+    print(json.dumps(report, indent=2))
+
+
+def start_background_services():
+    """启动任务队列的工作线程与定时调度; 开发服务器在下方启动, gunicorn 由 gunicorn.conf.py 在每个 worker 中启动"""
+    job_queue.start()
+    scheduler.start_scheduler(app)
+
+
 if __name__ == '__main__':
     with app.app_context():
         init_database()
-    scheduler.start_scheduler(app)
+    start_background_services()
     app.run(host='0.0.0.0', port=5006)
\ No newline at end of file
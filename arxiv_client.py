@@ -0,0 +1,137 @@
+# arxiv_client.py - 全进程共享的 arXiv 访问层: 连接池、跨线程的全局限速与退避重试
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+import arxiv
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# 可指向 fake_arxiv.py 启动的本地服务, 用于开发与测试
+ARXIV_API_URL = os.getenv("ARXIV_API_URL", "https://export.arxiv.org/api/query")
+# arXiv API 使用条款要求连续请求间隔不少于 3 秒; 所有线程 (抓取任务、搜索接口) 共用同一个间隔
+ARXIV_API_DELAY = float(os.getenv("ARXIV_API_DELAY", "3.0"))
+# PDF 与源码包从 arxiv.org 下载 (与 API 不是同一主机), 并行导入的所有下载线程同样共用一个间隔
+ARXIV_DOWNLOAD_HOST = "arxiv.org"
+ARXIV_DOWNLOAD_DELAY = float(os.getenv("ARXIV_DOWNLOAD_DELAY", "3.0"))
+ARXIV_PAGE_SIZE = int(os.getenv("ARXIV_PAGE_SIZE", "100"))
+HTTP_POOL_SIZE = int(os.getenv("ARXIV_HTTP_POOL_SIZE", "16"))
+MAX_RETRIES = int(os.getenv("ARXIV_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = (10, 60) # (连接, 读取) 秒
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = "PaperDevour/1.0 (research assistant; arxiv.py)"
+
+
+class RateLimiter:
+    """按固定间隔为每个请求预留发送时刻; 持锁只用于分配时刻, 等待在锁外进行"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def penalize(self, seconds):
+        """服务端要求放慢 (429/503) 时, 推迟之后所有线程的请求"""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def _backoff(attempt):
+    # 指数退避加随机抖动, 避免多个线程同时重试
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _retry_after(response):
+    try:
+        return min(BACKOFF_MAX, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+class ArxivSession(requests.Session):
+    """带连接池的会话; 对配置了限速的主机排队发送, 连接错误、超时和 429/5xx 自动退避重试"""
+
+    def __init__(self, rate_limits=None, pool_size=HTTP_POOL_SIZE, max_retries=MAX_RETRIES):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers['User-Agent'] = USER_AGENT
+        self.rate_limits = rate_limits or {}
+        self.max_retries = max_retries
+
+    def request(self, method, url, **kwargs):
+        if url.startswith(ARXIV_API_URL):
+            # 包括排队等待限速的时间; PDF 与源码下载由调用方按阶段计时
+            with metrics.timed('arxiv_query'):
+                return self._request(method, url, **kwargs)
+        return self._request(method, url, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        limiter = self.rate_limits.get(urlsplit(url).hostname)
+        attempt = 0
+        while True:
+            if limiter:
+                limiter.wait()
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _backoff(attempt)
+                log.warning("arXiv request failed, retrying", error=e.__class__.__name__, delay=round(delay, 1), url=url)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = _retry_after(response) or _backoff(attempt)
+                response.close()
+                log.warning("arXiv request rejected, retrying", status=response.status_code, delay=round(delay, 1),
+                            url=url)
+            if limiter:
+                limiter.penalize(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+
+def make_client(session, api_url=ARXIV_API_URL, page_size=ARXIV_PAGE_SIZE):
+    """
+    arxiv.Client 自带的限速只对单个实例有效且不是线程安全的, 因此关闭它 (delay_seconds=0),
+    并替换其内部会话, 由 ArxivSession 负责全局限速与重试。
+    Client 只在生成器内部保存分页状态, 多个线程可以共用同一个实例。
+    """
+    client = arxiv.Client(page_size=page_size, delay_seconds=0, num_retries=3)
+    # 依赖 arxiv 4.0 的内部属性 (requirements.txt 固定了版本); 属性改名后立即报错, 而不是悄悄绕过共享的限速会话
+    if not hasattr(client, '_session') or not hasattr(client, 'query_url_format'):
+        raise RuntimeError(f"Unsupported arxiv version {getattr(arxiv, '__version__', '?')}: cannot share the session")
+    client._session = session
+    client.query_url_format = api_url + "?{}"
+    return client
+
+
+def default_rate_limits():
+    limits = {ARXIV_DOWNLOAD_HOST: RateLimiter(ARXIV_DOWNLOAD_DELAY)}
+    # API 指向本地替身时两者可能是同一主机, 此时以 API 的间隔为准
+    limits[urlsplit(ARXIV_API_URL).hostname] = RateLimiter(ARXIV_API_DELAY)
+    return limits
+
+
+session = ArxivSession(rate_limits=default_rate_limits())
+client = make_client(session)
@@ -0,0 +1,147 @@
+# benchmarks/corpus.py - 按 models.py 的表结构生成合成文库: 文章、作者、分析、问答历史、关键词与插图文件
+#
+# 用法: python benchmarks/corpus.py --articles 10000 --db /tmp/paperdevour-corpus.db [--media /tmp/paperdevour-media]
+#
+# 数据库用 create_all 建表并执行全部迁移, 与应用启动后的结构一致; 数据用 sqlite3 批量写入, 十万篇约需十几秒。
+# 同样的参数与种子生成同样的数据, 基准结果可以在不同的提交之间比较。
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from PIL import Image  # noqa: E402
+from models import db  # noqa: E402 从 models 导入以注册所有表
+import migrations  # noqa: E402
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+TOPICS = ("diffusion model", "graph neural network", "reinforcement learning", "speech recognition",
+          "protein folding", "federated learning", "retrieval augmented generation", "quantum error correction")
+IMAGE_SIZE = (800, 600)
+IMAGES_PER_ARTICLE = 2
+
+
+def _remove_database(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _create_schema(path):
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        migrations.upgrade(conn)
+    engine.dispose()
+
+
+def _write_images(media_dir, folder, index, rng):
+    """为一篇文章写入若干张内容不同的 PNG, 返回相对 media_dir 的路径列表 (与 figures.py 的布局相同)"""
+    images_dir = os.path.join(media_dir, folder, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    paths = []
+    for n in range(IMAGES_PER_ARTICLE):
+        image = Image.new("RGB", IMAGE_SIZE, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        # 画几条色带, 让图片有一定的压缩后体积
+        for band in range(0, IMAGE_SIZE[1], 40):
+            image.paste((rng.randrange(256), index % 256, n * 60), (0, band, IMAGE_SIZE[0], band + 8))
+        filename = f"{index:08x}{n:08x}.png"
+        image.save(os.path.join(images_dir, filename))
+        paths.append(f"{folder}/images/{filename}")
+    return paths
+
+
+def generate(path, articles, media_dir=None, media_articles=200, authors_per_article=3, keywords=(),
+             favorite_rate=0.05, qna_rate=0.2, seed=42):
+    """生成合成文库, 返回各表的行数与耗时; media_dir 为 None 时不写插图文件"""
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    _remove_database(path)
+    _create_schema(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    author_count = max(1, articles * authors_per_article // 4)
+    conn.executemany("INSERT INTO author (id, name) VALUES (?, ?)",
+                     ((i, f"Author {i}") for i in range(1, author_count + 1)))
+
+    start = datetime(2020, 1, 1)
+    image_count = 0
+    rows = []
+    for i in range(1, articles + 1):
+        topic = TOPICS[i % len(TOPICS)]
+        # 导入顺序与发布时间不一致, 与真实的批量导入相同
+        published = start + timedelta(minutes=rng.randrange(6 * 365 * 24 * 60))
+        title = f"On {topic}: synthetic paper {i}"
+        folder = f"{published:%Y-%m-%d} - {title.replace(':', '')}"
+        image_paths = []
+        if media_dir and i <= media_articles:
+            image_paths = _write_images(media_dir, folder, i, rng)
+            image_count += len(image_paths)
+        rows.append((
+            i, f"http://arxiv.org/abs/2001.{i:05d}v1", title, published.strftime(DATE_FORMAT),
+            f"http://arxiv.org/pdf/2001.{i:05d}v1", f"We study {topic} in synthetic setting {i}. " * 8,
+            os.path.join(media_dir, folder) if media_dir else None, json.dumps(image_paths),
+            1 if rng.random() < favorite_rate else 0, 'ok', rng.randrange(200_000, 3_000_000), 1, 'ok', 1
+        ))
+    conn.executemany(
+        "INSERT INTO article (id, entry_id, title, published, pdf_url, original_summary, local_path, image_paths, "
+        "is_favorited, pdf_status, pdf_bytes, pdf_attempts, analysis_status, analysis_attempts) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO article_author_association (article_id, author_id) VALUES (?, ?)",
+        ((i, rng.randrange(1, author_count + 1)) for i in range(1, articles + 1) for _ in range(authors_per_article))
+    )
+
+    created = start.strftime(DATE_FORMAT)
+    detailed = json.dumps({"background": "背景" * 50, "methodology": "方法" * 50, "key_innovations": ["创新点一", "创新点二"],
+                           "potential_impact": "影响" * 30}, ensure_ascii=False)
+
+    def analyses():
+        for i in range(1, articles + 1):
+            summary = {"simplified_summary_zh": f"合成摘要 {i} " + "内容" * 40,
+                       "keywords_en": [TOPICS[i % len(TOPICS)], "synthetic"], "innovation_rating": i % 5 + 1}
+            yield i, "summary", json.dumps(summary, ensure_ascii=False), created
+            yield i, "detailed", detailed, created
+
+    conn.executemany("INSERT INTO analysis (article_id, analysis_type, content, created_at) VALUES (?, ?, ?, ?)",
+                     analyses())
+    qna_count = int(articles * qna_rate)
+    conn.executemany(
+        "INSERT INTO qna_history (article_id, question, answer, created_at) VALUES (?, ?, ?, ?)",
+        ((rng.randrange(1, articles + 1), "这篇论文的主要贡献是什么?", "回答。" * 40,
+          (start + timedelta(seconds=i)).strftime(DATE_FORMAT)) for i in range(qna_count))
+    )
+    conn.executemany("INSERT INTO keyword (keyword) VALUES (?)", ((keyword,) for keyword in keywords))
+    conn.commit()
+    conn.close()
+    return {
+        'articles': articles, 'authors': author_count, 'analyses': articles * 2, 'qna': qna_count,
+        'images': image_count, 'keywords': len(keywords), 'seconds': round(time.perf_counter() - started, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成的 PaperDevour 数据库")
+    parser.add_argument('--articles', type=int, default=10000)
+    parser.add_argument('--db', default=os.path.join("/tmp", "paperdevour-corpus.db"))
+    parser.add_argument('--media', default=None, help="插图目录 (即 services.SAVE_PATH); 不指定则不写图片")
+    parser.add_argument('--media-articles', type=int, default=200, help="带插图的文章数")
+    parser.add_argument('--keyword', action='append', default=[], help="写入的关键词, 可重复")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    result = generate(args.db, args.articles, media_dir=args.media, media_articles=args.media_articles,
+                      keywords=args.keyword, seed=args.seed)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# benchmarks/db_indexes.py - 在生成的大数据库上对比迁移前后的查询计划与延迟
+#
+# 用法: python benchmarks/db_indexes.py [--articles 100000] [--db /tmp/paperdevour-bench.db] [--json]
+#
+# 1. 用当前模型建表, 再删掉迁移新增的索引并切回默认 journal 模式, 模拟迁移前的数据库;
+# 2. 写入合成数据 (包含少量重复的分析记录), 测量各路由使用的查询;
+# 3. 执行 migrations.upgrade 并设置 database.SQLITE_PRAGMAS, 再次测量;
+# 4. 在后台写入的同时测量读取延迟, 对比默认 journal 与 WAL。
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import threading
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from database import SQLITE_PRAGMAS  # noqa: E402
+from models import db  # noqa: E402 从 models 导入以注册所有表
+import migrations  # noqa: E402
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+PAGE_SIZE = 50
+MIGRATION_INDEXES = ("ix_analysis_article_type", "ix_article_published_id", "ix_article_favorited_published_id",
+                     "ix_qna_history_article_created", "ix_article_author_author_id")
+
+
+def build_database(path, articles, seed=42):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    for name in MIGRATION_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.execute("PRAGMA user_version = 0")
+
+    start = datetime(2020, 1, 1)
+    author_count = max(1, articles // 3)
+    conn.executemany("INSERT INTO author (id, name) VALUES (?, ?)",
+                     ((i, f"Author {i}") for i in range(1, author_count + 1)))
+    # 导入顺序与发布时间不一致, 与真实的批量导入相同
+    conn.executemany(
+        "INSERT INTO article (id, entry_id, title, published, pdf_url, original_summary, local_path, image_paths, "
+        "is_favorited, pdf_attempts, analysis_attempts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0)",
+        ((i, f"http://arxiv.org/abs/{i:07d}", f"Synthetic paper {i}",
+          (start + timedelta(minutes=rng.randrange(6 * 365 * 24 * 60))).strftime(DATE_FORMAT),
+          f"http://arxiv.org/pdf/{i:07d}", f"Abstract of synthetic paper {i}. " * 8, None, "[]",
+          1 if rng.random() < 0.05 else 0)
+         for i in range(1, articles + 1))
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO article_author_association (article_id, author_id) VALUES (?, ?)",
+        ((i, rng.randrange(1, author_count + 1)) for i in range(1, articles + 1) for _ in range(3))
+    )
+    summary = json.dumps({"simplified_summary_zh": "合成摘要" * 20, "keywords_en": ["a", "b"], "innovation_rating": 3},
+                         ensure_ascii=False)
+    detailed = json.dumps({"background": "背景" * 50, "methodology": "方法" * 50, "key_innovations": ["x"],
+                           "potential_impact": "影响" * 30}, ensure_ascii=False)
+    created = start.strftime(DATE_FORMAT)
+    conn.executemany(
+        "INSERT INTO analysis (article_id, analysis_type, content, created_at) VALUES (?, ?, ?, ?)",
+        ((i, kind, content, created) for i in range(1, articles + 1)
+         for kind, content in (("summary", summary), ("detailed", detailed)))
+    )
+    # 旧版本重新生成分析时可能留下的重复记录
+    conn.executemany(
+        "INSERT INTO analysis (article_id, analysis_type, content, created_at) VALUES (?, 'summary', ?, ?)",
+        ((rng.randrange(1, articles + 1), summary, created) for _ in range(articles // 100))
+    )
+    conn.executemany(
+        "INSERT INTO qna_history (article_id, question, answer, created_at) VALUES (?, ?, ?, ?)",
+        ((rng.randrange(1, articles + 1), "问题?", "回答。" * 40,
+          (start + timedelta(seconds=i)).strftime(DATE_FORMAT)) for i in range(articles // 5))
+    )
+    conn.commit()
+    conn.close()
+
+
+def workload(conn, articles, rng):
+    """与路由实际执行的 SQL 形状相同的查询; 迁移前的深翻页使用旧的 OR 条件"""
+    deep = conn.execute("SELECT published, id FROM article ORDER BY published DESC, id DESC LIMIT 1 OFFSET ?",
+                        (articles * 9 // 10,)).fetchone()
+    page_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM article ORDER BY published DESC, id DESC LIMIT ?", (PAGE_SIZE,))]
+    in_clause = ", ".join("?" * len(page_ids))
+    return {
+        'latest_first_page': (
+            "SELECT id FROM article ORDER BY published DESC, id DESC LIMIT ?", lambda: (PAGE_SIZE + 1,)),
+        'latest_deep_page_or': (
+            "SELECT id FROM article WHERE published < ? OR (published = ? AND id < ?) "
+            "ORDER BY published DESC, id DESC LIMIT ?", lambda: (deep[0], deep[0], deep[1], PAGE_SIZE + 1)),
+        'latest_deep_page_row_value': (
+            "SELECT id FROM article WHERE (published, id) < (?, ?) "
+            "ORDER BY published DESC, id DESC LIMIT ?", lambda: (deep[0], deep[1], PAGE_SIZE + 1)),
+        'favorites_first_page': (
+            "SELECT id FROM article WHERE is_favorited = 1 ORDER BY published DESC, id DESC LIMIT ?",
+            lambda: (PAGE_SIZE + 1,)),
+        'page_summaries_selectin': (
+            f"SELECT article_id, content FROM analysis WHERE article_id IN ({in_clause}) AND analysis_type = 'summary'",
+            lambda: tuple(page_ids)),
+        'page_authors_selectin': (
+            f"SELECT a.article_id, author.name FROM article_author_association a "
+            f"JOIN author ON author.id = a.author_id WHERE a.article_id IN ({in_clause})",
+            lambda: tuple(page_ids)),
+        'detail_analysis': (
+            "SELECT content FROM analysis WHERE article_id = ? AND analysis_type = ? LIMIT 1",
+            lambda: (rng.randrange(1, articles + 1), rng.choice(("summary", "detailed")))),
+        'detail_qna_history': (
+            "SELECT question, answer FROM qna_history WHERE article_id = ? ORDER BY created_at",
+            lambda: (rng.randrange(1, articles + 1),)),
+        'author_articles': (
+            "SELECT article_id FROM article_author_association WHERE author_id = ?",
+            lambda: (rng.randrange(1, articles // 3 + 1),)),
+    }
+
+
+def measure(conn, queries, repeat):
+    results = {}
+    for name, (sql, params) in queries.items():
+        plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params())]
+        timings = []
+        for _ in range(repeat):
+            args = params()
+            started = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            'plan': plan,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3)
+        }
+    return results
+
+
+def apply_pragmas(conn):
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def contended_reads(path, wal, duration=3.0):
+    """后台线程持续以事务批量写入 (模拟抓取任务), 同时测量列表查询的延迟"""
+    stop = threading.Event()
+
+    def writer():
+        conn = sqlite3.connect(path, timeout=30)
+        if wal:
+            apply_pragmas(conn)
+        next_id = conn.execute("SELECT MAX(id) FROM article").fetchone()[0] + 1
+        while not stop.is_set():
+            with conn:
+                for _ in range(200):
+                    conn.execute("INSERT INTO article (id, entry_id, title, published, is_favorited) VALUES (?, ?, ?, ?, 0)",
+                                 (next_id, f"bench-{next_id}", "w" * 200, datetime.utcnow().strftime(DATE_FORMAT)))
+                    next_id += 1
+                time.sleep(0.02)
+        conn.close()
+
+    reader = sqlite3.connect(path, timeout=30)
+    if wal:
+        apply_pragmas(reader)
+    else:
+        reader.execute("PRAGMA journal_mode = DELETE")
+    thread = threading.Thread(target=writer)
+    thread.start()
+    timings = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        reader.execute("SELECT id FROM article ORDER BY published DESC, id DESC LIMIT 51").fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    stop.set()
+    thread.join()
+    reader.close()
+    timings.sort()
+    return {'reads': len(timings), 'p50_ms': round(statistics.median(timings), 3),
+            'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3), 'max_ms': round(timings[-1], 3)}
+
+
+def print_report(report):
+    print(f"\n{'query':<30}{'before p50':>12}{'after p50':>12}{'before p95':>12}{'after p95':>12}")
+    for name, before in report['before'].items():
+        after = report['after'][name]
+        print(f"{name:<30}{before['p50_ms']:>12}{after['p50_ms']:>12}{before['p95_ms']:>12}{after['p95_ms']:>12}")
+    print("\nQuery plans (before -> after):")
+    for name, before in report['before'].items():
+        print(f"  {name}")
+        print(f"    before: {' | '.join(before['plan'])}")
+        print(f"    after:  {' | '.join(report['after'][name]['plan'])}")
+    print(f"\nMigration: {report['migration']['seconds']}s, "
+          f"versions {report['migration']['applied']}, duplicates removed {report['migration']['duplicates_removed']}")
+    print("\nList query latency while a writer commits batches (ms):")
+    for mode, stats in report['contention'].items():
+        print(f"  {mode:<8} reads={stats['reads']:<7} p50={stats['p50_ms']:<8} p99={stats['p99_ms']:<8} max={stats['max_ms']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 索引与 PRAGMA 迁移前后的查询基准")
+    parser.add_argument('--articles', type=int, default=100000)
+    parser.add_argument('--db', default=os.path.join("/tmp", "paperdevour-bench.db"))
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    build_database(args.db, args.articles)
+    print(f"Generated {args.articles} articles in {time.perf_counter() - started:.1f}s at {args.db}", file=sys.stderr)
+
+    report = {'articles': args.articles}
+    conn = sqlite3.connect(args.db)
+    queries = workload(conn, args.articles, random.Random(1))
+    report['before'] = measure(conn, queries, args.repeat)
+    analysis_rows = conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+    conn.close()
+
+    engine = create_engine(f"sqlite:///{args.db}")
+    started = time.perf_counter()
+    with engine.begin() as migration_conn:
+        applied = migrations.upgrade(migration_conn)
+    engine.dispose()
+    report['migration'] = {'applied': applied, 'seconds': round(time.perf_counter() - started, 3)}
+
+    conn = sqlite3.connect(args.db)
+    apply_pragmas(conn)
+    report['migration']['duplicates_removed'] = analysis_rows - conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+    report['after'] = measure(conn, queries, args.repeat)
+    conn.close()
+
+    report['contention'] = {'default': contended_reads(args.db, wal=False), 'wal': contended_reads(args.db, wal=True)}
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
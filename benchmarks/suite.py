@@ -0,0 +1,349 @@
+# benchmarks/suite.py - 端到端性能基准: 合成文库 + 本地 arXiv 与 LLM 替身, 覆盖主要路由、搜索与导入流程
+#
+# 用法: python benchmarks/suite.py [--articles 5000] [--scenarios list_latest,detail] [--quick]
+#                                  [--arxiv-latency 0.05] [--llm-latency 0.2]
+#                                  [--baseline benchmarks/baseline.json] [--save-baseline] [--tolerance 0.25]
+#                                  [--output report.json]
+#
+# 1. corpus.generate 生成 --articles 篇文章的数据库与插图, 应用通过 DATABASE_URL 使用它;
+# 2. 启动 fake_arxiv.FakeArxiv (API、PDF 与源码包) 和 mock_llm.MockOpenAIServer, 各自带可配置的延迟,
+#    应用使用真实的 arxiv / openai 客户端访问它们;
+# 3. 每个场景先预热, 再计时运行若干次, 报告吞吐、p50/p99 延迟, 并在开启 tracemalloc 的单独一轮中测峰值内存;
+# 4. 结果以 JSON 输出, 与 --baseline 对比, 有场景变慢超过 --tolerance 时退出码为 1。
+#    仓库中的 benchmarks/baseline.json 以 --quick 录制, 对比时请使用相同的参数 (python benchmarks/suite.py --quick)。
+#
+# 列表与详情场景每次请求前清空响应缓存, 测的是查询与序列化本身; *_cached 场景测缓存命中的路径。
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+FETCH_KEYWORD = "benchmark topic"
+# 两次运行之间的差异小于该值 (毫秒) 时不算回归, 避免亚毫秒级场景的抖动被放大
+MIN_DELTA_MS = 0.5
+# 越大越好的指标; 其余指标越小越好
+HIGHER_IS_BETTER = ('ops_per_s', 'items_per_s')
+COMPARED_METRICS = ('p50_ms', 'p99_ms', 'ops_per_s', 'peak_mem_mb')
+# 未显式指定时的规模; --quick 只改变未在命令行给出的参数
+FULL_SIZE = {'articles': 5000, 'media_articles': 100, 'iterations': 200}
+QUICK_SIZE = {'articles': 1000, 'media_articles': 20, 'iterations': 40}
+SEARCH_QUERIES = ('all:"diffusion model"', 'all:"graph neural network"', 'all:"reinforcement learning"',
+                  'all:"speech recognition"')
+
+
+class Scenario:
+    """op() 执行一次操作并返回处理的条目数 (例如导入的论文篇数), 普通请求返回 1"""
+
+    def __init__(self, name, op, iterations, warmup=2, memory_iterations=3):
+        self.name = name
+        self.op = op
+        self.iterations = iterations
+        self.warmup = warmup
+        self.memory_iterations = memory_iterations
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * fraction)) - 1))]
+
+
+def run_scenario(scenario):
+    for _ in range(scenario.warmup):
+        scenario.op()
+    gc.collect()
+    timings = []
+    items = 0
+    started = time.perf_counter()
+    for _ in range(scenario.iterations):
+        op_started = time.perf_counter()
+        items += scenario.op()
+        timings.append((time.perf_counter() - op_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc 会明显拖慢执行, 峰值内存在单独的一轮中测量
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in range(scenario.memory_iterations):
+            scenario.op()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'iterations': scenario.iterations,
+        'seconds': round(elapsed, 3),
+        'ops_per_s': round(scenario.iterations / elapsed, 2),
+        'items_per_s': round(items / elapsed, 2),
+        'p50_ms': round(_percentile(timings, 0.50), 3),
+        'p99_ms': round(_percentile(timings, 0.99), 3),
+        'max_ms': round(timings[-1], 3),
+        'peak_mem_mb': round(peak / 1024 / 1024, 2)
+    }
+
+
+def _configure_environment(args, workdir, fake, llm):
+    """应用的模块在导入时读取环境变量, 必须在导入 app 之前设置"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['ARXIV_API_URL'] = fake.api_url
+    os.environ['ARXIV_API_DELAY'] = "0"
+    os.environ['LLM_BACKEND'] = "deepseek"
+    os.environ['LLM_BASE_URL'] = llm.base_url
+    os.environ['DEEPSEEK_API_KEY'] = "benchmark"
+    os.environ['LLM_CACHE_PATH'] = os.path.join(workdir, "llm_cache.db")
+    os.environ['EMBEDDINGS_DIR'] = os.path.join(workdir, "embeddings")
+    os.environ['FULLTEXT_DIR'] = os.path.join(workdir, "fulltext_cache")
+    os.environ['ANALYSIS_SOURCE'] = args.analysis_source
+    # 替身服务没有配额, 默认不让调度器的限速成为瓶颈; 需要时可在环境变量中覆盖
+    os.environ.setdefault('LLM_RPM', "100000")
+    os.environ.setdefault('LLM_TPM', "100000000")
+
+
+def build_scenarios(args, app, fake, media_paths, article_count):
+    import services
+    from database import db
+    from models import Keyword
+    from response_cache import response_cache
+
+    client = app.test_client()
+    rng = random.Random(7)
+
+    def get(url, clear_cache=True):
+        if clear_cache:
+            response_cache.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        response.close()
+        return 1
+
+    # 预先取得前若干页的游标, 列表场景随机访问这些页
+    cursors = [None]
+    for _ in range(19):
+        data = client.get(f"/api/articles/latest?cursor={cursors[-1] or ''}").get_json()
+        if not data.get('next_cursor'):
+            break
+        cursors.append(data['next_cursor'])
+
+    def page_url(base):
+        cursor = rng.choice(cursors)
+        return f"{base}?cursor={cursor}" if cursor else base
+
+    imported = {'next': 1}
+
+    def batch_import():
+        start = imported['next']
+        imported['next'] += args.batch_size
+        with app.app_context():
+            services.batch_import_and_process(
+                [f"http://arxiv.org/abs/2401.{number:05d}v1" for number in range(start, start + args.batch_size)])
+        return args.batch_size
+
+    def fetch_job():
+        fake.add_papers(args.batch_size, keyword=FETCH_KEYWORD)
+        with app.app_context():
+            services.run_fetch_and_process_job()
+        return args.batch_size
+
+    def search_raw():
+        with app.app_context():
+            services.ArxivService.search_raw(rng.choice(SEARCH_QUERIES))
+        return 1
+
+    with app.app_context():
+        if not Keyword.query.filter_by(keyword=FETCH_KEYWORD).first():
+            db.session.add(Keyword(keyword=FETCH_KEYWORD))
+            db.session.commit()
+
+    n = args.iterations
+    pipeline_iterations = max(1, n // 20)
+    scenarios = [
+        Scenario('list_latest', lambda: get(page_url("/api/articles/latest")), n),
+        Scenario('list_latest_cached', lambda: get("/api/articles/latest", clear_cache=False), n),
+        Scenario('list_favorites', lambda: get(page_url("/api/articles/favorites")), n),
+        Scenario('detail', lambda: get(f"/api/articles/{rng.randrange(1, article_count + 1)}"), n),
+        Scenario('search_raw', search_raw, max(1, n // 5)),
+        Scenario('batch_import', batch_import, pipeline_iterations, warmup=1, memory_iterations=1),
+        Scenario('fetch_job', fetch_job, pipeline_iterations, warmup=1, memory_iterations=1),
+    ]
+    if media_paths:
+        scenarios += [
+            Scenario('media', lambda: get(f"/media/{rng.choice(media_paths)}", clear_cache=False), n),
+            Scenario('media_thumbnail', lambda: get(f"/media/thumbs/{rng.choice(media_paths)}", clear_cache=False), n),
+        ]
+    return scenarios
+
+
+def compare(report, baseline, tolerance):
+    """返回相对基线变差超过 tolerance 的指标列表"""
+    regressions = []
+    for name, result in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if metric.endswith('_ms') and abs(new - old) < MIN_DELTA_MS:
+                continue
+            if worse > tolerance:
+                regressions.append({'scenario': name, 'metric': metric, 'baseline': old, 'current': new,
+                                    'change_pct': round(change * 100, 1)})
+    return regressions
+
+
+def print_table(report, stream):
+    print(f"\n{'scenario':<22}{'ops/s':>10}{'items/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}", file=stream)
+    for name, r in report['scenarios'].items():
+        print(f"{name:<22}{r['ops_per_s']:>10}{r['items_per_s']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['peak_mem_mb']:>10}", file=stream)
+    if report.get('regressions'):
+        print("\nRegressions against baseline:", file=stream)
+        for item in report['regressions']:
+            print(f"  {item['scenario']}.{item['metric']}: {item['baseline']} -> {item['current']} "
+                  f"({item['change_pct']:+}%)", file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PaperDevour 端到端性能基准")
+    parser.add_argument('--articles', type=int, default=None, help="合成文库的文章数, 默认 5000")
+    parser.add_argument('--media-articles', type=int, default=None, help="带插图的文章数, 默认 100")
+    parser.add_argument('--iterations', type=int, default=None,
+                        help="请求类场景的计时次数, 默认 200; 导入类场景为其 1/20")
+    parser.add_argument('--batch-size', type=int, default=10, help="导入类场景每次处理的论文数")
+    parser.add_argument('--scenarios', default=None, help="逗号分隔的场景名, 默认全部")
+    parser.add_argument('--quick', action='store_true',
+                        help="小规模快速运行 (1000 篇, 40 次); 显式给出的 --articles 等参数优先")
+    parser.add_argument('--arxiv-latency', type=float, default=0.02, help="arXiv 替身每个请求的延迟 (秒)")
+    parser.add_argument('--llm-latency', type=float, default=0.1, help="LLM 替身每个请求的延迟 (秒)")
+    parser.add_argument('--analysis-source', default="abstract", choices=("fulltext", "abstract"))
+    parser.add_argument('--workdir', default=None, help="数据库与文件的目录, 默认使用临时目录并在结束后删除")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果写为基线")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="允许的相对变差, 默认 25%%")
+    parser.add_argument('--output', default=None, help="JSON 报告的输出文件, 默认输出到标准输出")
+    args = parser.parse_args()
+    for name, value in (QUICK_SIZE if args.quick else FULL_SIZE).items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="paperdevour-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    media_dir = os.path.join(workdir, "media")
+
+    # 日志写到标准错误, 标准输出只留给 JSON 报告; 在导入应用模块之前配置, logs.configure 不会再添加处理器
+    import logging
+    import logs
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logs.TextFormatter())
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(os.getenv('LOG_LEVEL', "WARNING"))
+
+    import corpus
+    from fake_arxiv import FakeArxiv
+    from mock_llm import MockOpenAIServer
+
+    print(f"Generating {args.articles} articles in {workdir} ...", file=sys.stderr)
+    corpus_stats = corpus.generate(os.path.join(workdir, "bench.db"), args.articles, media_dir=media_dir,
+                                   media_articles=args.media_articles)
+
+    # 导入场景每次消耗 batch_size 篇不同的论文 (预热、计时与内存三轮)
+    import_papers = (max(1, args.iterations // 20) + 2) * args.batch_size + args.batch_size
+    fake = FakeArxiv(papers=import_papers, start=datetime.utcnow() - timedelta(days=2),
+                     interval=timedelta(seconds=10), latency=args.arxiv_latency)
+    fake.start()
+    llm = MockOpenAIServer(latency=args.llm_latency)
+    llm.start()
+    _configure_environment(args, workdir, fake, llm)
+
+    from app import app
+    from database import init_database
+    import services
+    services.SAVE_PATH = media_dir
+    with app.app_context():
+        init_database()
+
+    media_paths = []
+    for folder in sorted(os.listdir(media_dir)) if os.path.isdir(media_dir) else []:
+        images_dir = os.path.join(media_dir, folder, "images")
+        if os.path.isdir(images_dir):
+            media_paths += [f"{folder}/images/{name}" for name in sorted(os.listdir(images_dir))]
+
+    scenarios = build_scenarios(args, app, fake, media_paths, args.articles)
+    if args.scenarios:
+        wanted = set(args.scenarios.split(","))
+        unknown = wanted - {s.name for s in scenarios}
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [s for s in scenarios if s.name in wanted]
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'config': {'articles': args.articles, 'iterations': args.iterations, 'batch_size': args.batch_size,
+                   'arxiv_latency': args.arxiv_latency, 'llm_latency': args.llm_latency,
+                   'analysis_source': args.analysis_source},
+        'corpus': corpus_stats,
+        'scenarios': {}
+    }
+    try:
+        for scenario in scenarios:
+            print(f"Running {scenario.name} ...", file=sys.stderr)
+            report['scenarios'][scenario.name] = run_scenario(scenario)
+    finally:
+        fake.stop()
+        llm.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    import resource
+    # Linux 上 ru_maxrss 的单位为 KiB
+    report['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    report['llm_requests'] = len(llm.requests)
+    report['arxiv_api_requests'] = len(fake.api_requests)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print("Warning: baseline was recorded with a different configuration.", file=sys.stderr)
+        report['baseline'] = {'path': args.baseline, 'created_at': baseline.get('created_at')}
+        report['regressions'] = compare(report, baseline, args.tolerance)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    print_table(report, sys.stderr)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(output + "\n")
+        print(f"\nBaseline saved to {args.baseline}", file=sys.stderr)
+    elif baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one.", file=sys.stderr)
+    sys.exit(1 if report.get('regressions') else 0)
+
+
+if __name__ == '__main__':
+    main()
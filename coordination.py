@@ -0,0 +1,164 @@
+# coordination.py - 多进程部署 (gunicorn 多个 worker) 下的协调: 进程标识、调度器领导者租约与论文认领
+# 状态都保存在共享的数据库中, 依靠单条 UPSERT 语句的原子性实现互斥, 不需要额外的锁服务。
+import os
+import time
+import uuid
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Lease, PaperClaim
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# 领导者租约的有效期 (秒); 持有者每隔三分之一的有效期续约一次, 进程退出后最多这么久由其他进程接管
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", "30"))
+# 论文认领的有效期 (秒), 流水线运行期间定期续期; 只在认领进程异常退出时才会等到过期
+PAPER_CLAIM_SECONDS = int(os.getenv("PAPER_CLAIM_SECONDS", "600"))
+IN_QUERY_CHUNK_SIZE = 500
+
+_identity = (None, None)
+
+
+def process_id():
+    """主机名:pid:随机后缀; gunicorn 在 master 中导入应用后才 fork 出 worker, 因此按 pid 惰性生成"""
+    global _identity
+    pid = os.getpid()
+    if _identity[0] != pid:
+        _identity = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:6]}")
+    return _identity[1]
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# --- 租约 ---
+def acquire_lease(name, holder, seconds):
+    """获取或续约租约: 租约不存在、已过期或本来就由 holder 持有时成功; 返回 holder 是否持有租约"""
+    now = datetime.utcnow()
+    statement = sqlite_insert(Lease).values(name=name, holder=holder, expires_at=now + timedelta(seconds=seconds))
+    statement = statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'holder': statement.excluded.holder, 'expires_at': statement.excluded.expires_at},
+        where=or_(Lease.holder == holder, Lease.expires_at < now)
+    )
+    acquired = db.session.execute(statement).rowcount == 1
+    db.session.commit()
+    return acquired
+
+
+def release_lease(name, holder):
+    Lease.query.filter_by(name=name, holder=holder).delete()
+    db.session.commit()
+
+
+class LeaderElection:
+    """
+    同一时刻只有一个进程持有名为 name 的租约。renew() 需定期在 app context 中调用 (见 scheduler.py);
+    本地记录的有效期从发起续约时算起, 续约线程卡住时本进程会在租约可能被接管之前停止以领导者身份行事。
+    """
+
+    def __init__(self, name, lease_seconds=LEADER_LEASE_SECONDS):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self._valid_until = 0.0
+
+    @property
+    def renew_seconds(self):
+        return max(1, self.lease_seconds // 3)
+
+    @property
+    def is_leader(self):
+        return time.monotonic() < self._valid_until
+
+    def renew(self):
+        started = time.monotonic()
+        was_leader = self.is_leader
+        try:
+            held = acquire_lease(self.name, process_id(), self.lease_seconds)
+        except Exception as e:
+            # 数据库暂时不可用时不放弃已有的租约, 由本地有效期决定何时停止
+            db.session.rollback()
+            log.warning("Lease renewal failed", lease=self.name, error=str(e))
+            return self.is_leader
+        self._valid_until = started + self.lease_seconds if held else 0.0
+        if held and not was_leader:
+            log.info("Acquired leadership", lease=self.name, holder=process_id())
+        elif was_leader and not held:
+            log.warning("Lost leadership", lease=self.name, holder=process_id())
+        return held
+
+    def release(self):
+        """进程正常退出时释放, 让其他进程在下一次续约时立即接管"""
+        if not self.is_leader:
+            return
+        self._valid_until = 0.0
+        release_lease(self.name, process_id())
+        log.info("Released leadership", lease=self.name)
+
+
+# --- 论文认领 ---
+class PaperClaims:
+    """
+    一次流水线运行持有的论文认领。同一进程中的不同任务使用不同的持有者标识, 因此同样互斥。
+    认领与入库之间没有事务关联: 论文入库后才释放认领, 后来者认领成功后会在已导入检查中跳过它。
+    """
+
+    def __init__(self, seconds=PAPER_CLAIM_SECONDS):
+        self.holder = f"{process_id()}:{uuid.uuid4().hex[:6]}"
+        self.seconds = seconds
+        self._renewed = time.monotonic()
+
+    def claim(self, entry_ids):
+        """返回认领成功的 entry_id 集合; 正由其他流水线处理 (认领未过期) 的论文不在其中"""
+        entry_ids = list(dict.fromkeys(entry_ids))
+        if not entry_ids:
+            return set()
+        now = datetime.utcnow()
+        statement = sqlite_insert(PaperClaim)
+        statement = statement.on_conflict_do_update(
+            index_elements=['entry_id'],
+            set_={'holder': statement.excluded.holder, 'expires_at': statement.excluded.expires_at},
+            where=or_(PaperClaim.holder == self.holder, PaperClaim.expires_at < now)
+        )
+        expires_at = now + timedelta(seconds=self.seconds)
+        db.session.execute(statement, [{'entry_id': entry_id, 'holder': self.holder, 'expires_at': expires_at}
+                                       for entry_id in entry_ids])
+        claimed = set()
+        for chunk in _chunks(entry_ids, IN_QUERY_CHUNK_SIZE):
+            claimed.update(row[0] for row in db.session.query(PaperClaim.entry_id).filter(
+                PaperClaim.entry_id.in_(chunk), PaperClaim.holder == self.holder))
+        db.session.commit()
+        return claimed
+
+    def release(self, entry_ids):
+        entry_ids = list(entry_ids)
+        for chunk in _chunks(entry_ids, IN_QUERY_CHUNK_SIZE):
+            PaperClaim.query.filter(PaperClaim.entry_id.in_(chunk), PaperClaim.holder == self.holder).delete()
+        if entry_ids:
+            db.session.commit()
+
+    def release_all(self):
+        PaperClaim.query.filter_by(holder=self.holder).delete()
+        db.session.commit()
+
+    def renew(self):
+        """延长本次运行持有的全部认领, 最多每三分之一有效期执行一次"""
+        if time.monotonic() - self._renewed < self.seconds / 3:
+            return
+        self._renewed = time.monotonic()
+        PaperClaim.query.filter_by(holder=self.holder).update(
+            {'expires_at': datetime.utcnow() + timedelta(seconds=self.seconds)})
+        db.session.commit()
+
+
+def prune_expired():
+    """删除过期的租约与认领 (已过期的记录不影响正确性, 只是占用空间)"""
+    now = datetime.utcnow()
+    leases = Lease.query.filter(Lease.expires_at < now).delete()
+    claims = PaperClaim.query.filter(PaperClaim.expires_at < now).delete()
+    db.session.commit()
+    return {'leases': leases, 'claims': claims}
@@ -1,10 +1,39 @@
 # database.py
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from logs import get_logger
+
+log = get_logger(__name__)
 
 db = SQLAlchemy()
 
+# 每个新连接都会设置; WAL 让调度器的写入不再阻塞网页的读取
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"), # WAL 模式下 NORMAL 不会损坏数据库, 断电时最多丢失最近提交的事务
+    ("busy_timeout", "5000"), # 写锁被占用时等待而不是立即报 database is locked
+    ("cache_size", "-65536"), # 单位 KiB, 即 64MB 页缓存
+    ("mmap_size", "268435456"), # 256MB 内存映射读取
+    ("temp_store", "MEMORY"),
+)
+
+@event.listens_for(Engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
 def init_database():
-    # 這裡導入模型是為了確保它們在創建表之前被 SQLAlchemy 知道
-    from models import Keyword, Author, Article, Analysis, QnaHistory
-    db.create_all()
-    print("Database tables created.")
\ No newline at end of file
+    # 這裡導入模型是為了確保它們在創建表之前被 SQLAlchemy 知道; models.db 就是本模塊的 db
+    import models
+    from search_index import ensure_search_schema
+    from migrations import run_migrations
+    models.db.create_all()
+    run_migrations()
+    ensure_search_schema()
+    log.info("Database tables created")
\ No newline at end of file
@@ -0,0 +1,119 @@
+# downloads.py - PDF 下载: 断点续传、先写临时文件再原子改名、大小与文件头校验
+import os
+import time
+import threading
+import requests
+import arxiv_client
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# 单次下载中传输中断时, 从已写入的位置续传的次数
+PDF_RESUME_ATTEMPTS = int(os.getenv("PDF_RESUME_ATTEMPTS", "3"))
+MIN_PDF_BYTES = 1024
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(200 * 1024 * 1024)))
+PDF_TIMEOUT = (10, 120) # (连接, 读取) 秒
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = ".part"
+
+_PDF_MAGIC = b'%PDF-'
+_PDF_EOF = b'%%EOF'
+_TAIL_BYTES = 2048 # %%EOF 之后可能还有换行或少量垃圾数据
+_LOCK_STRIPES = 64
+
+
+class InvalidPdf(Exception):
+    pass
+
+
+def _validate(path, expected_size=None):
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        raise InvalidPdf(f"expected {expected_size} bytes, got {size}")
+    if size < MIN_PDF_BYTES:
+        raise InvalidPdf(f"file too small ({size} bytes)")
+    with open(path, 'rb') as f:
+        head = f.read(len(_PDF_MAGIC))
+        f.seek(max(0, size - _TAIL_BYTES))
+        tail = f.read()
+    if head != _PDF_MAGIC:
+        raise InvalidPdf("missing %PDF- header (probably an HTML error page)")
+    if _PDF_EOF not in tail:
+        raise InvalidPdf("missing %%EOF marker (truncated download)")
+    return size
+
+
+class PdfDownloader:
+    """
+    下载过程中只写 <目标>.part, 校验通过后 os.replace 为正式文件, 文库目录中不会出现半个 PDF。
+    .part 文件名固定, 进程崩溃或连接中断后下次用 Range 请求从断点继续。
+    同一目标路径同时只有一个线程在下载。
+    """
+
+    def __init__(self, session=None):
+        self.session = session or arxiv_client.session
+        # 按路径哈希分段加锁, 锁的数量固定, 不随下载过的文件增长
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def _lock_for(self, path):
+        return self._locks[hash(os.path.abspath(path)) % _LOCK_STRIPES]
+
+    def download(self, url, path):
+        """下载到 path, 返回 {'bytes', 'seconds', 'resumed_from'}; 失败时抛出异常, 保留 .part 以便续传"""
+        started = time.monotonic()
+        with self._lock_for(path):
+            if os.path.exists(path):
+                try:
+                    return {'bytes': _validate(path), 'seconds': 0.0, 'resumed_from': None}
+                except InvalidPdf as e:
+                    log.warning("Replacing invalid PDF", path=path, error=str(e))
+                    os.remove(path)
+            partial_path = path + PARTIAL_SUFFIX
+            resumed_from = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            attempt = 0
+            try:
+                while True:
+                    try:
+                        expected_size = self._fetch(url, partial_path)
+                        break
+                    except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                        # 建立连接的错误已由会话重试过, 这里处理的是传输途中断开; 已写入的部分保留用于续传
+                        if attempt >= PDF_RESUME_ATTEMPTS:
+                            raise
+                        attempt += 1
+                        log.warning("PDF transfer interrupted, resuming", error=e.__class__.__name__, url=url)
+                size = _validate(partial_path, expected_size)
+            except InvalidPdf:
+                # 内容本身有问题, 续传没有意义
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                raise
+            os.replace(partial_path, path)
+        return {'bytes': size, 'seconds': round(time.monotonic() - started, 3), 'resumed_from': resumed_from or None}
+
+    def _fetch(self, url, partial_path):
+        """把响应追加写入 .part, 返回期望的完整大小 (服务器未给出长度时为 None)"""
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=PDF_TIMEOUT) as response:
+            if response.status_code == 416:
+                # .part 已是完整文件 (例如改名前崩溃), 交给校验决定
+                return None
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                offset = 0 # 服务器忽略了 Range, 从头写
+            length = response.headers.get('Content-Length')
+            expected_size = offset + int(length) if length and length.isdigit() else None
+            if expected_size and expected_size > MAX_PDF_BYTES:
+                raise InvalidPdf(f"PDF too large ({expected_size} bytes)")
+            written = offset
+            with open(partial_path, 'ab' if offset else 'wb') as target:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > MAX_PDF_BYTES:
+                        raise InvalidPdf(f"PDF exceeds {MAX_PDF_BYTES} bytes")
+                    target.write(chunk)
+        return expected_size
+
+
+pdf_downloader = PdfDownloader()
@@ -0,0 +1,302 @@
+# embeddings.py - 文章向量索引: 相关论文推荐与全库检索问答
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy.orm import selectinload
+from models import Article, Analysis
+from logs import get_logger
+
+try:
+    import fcntl
+except ImportError: # Windows: 只有单进程部署, 线程锁已足够
+    fcntl = None
+
+log = get_logger(__name__)
+
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "embeddings")
+# hashing: 内置的确定性特征哈希; sentence-transformers:<模型名>: 需要另行安装 sentence-transformers
+EMBEDDER = os.getenv("EMBEDDER", "hashing")
+HASHING_DIM = 384
+REBUILD_BATCH_SIZE = 500
+# 被删除的行超过该比例时压缩文件
+COMPACT_RATIO = 0.25
+
+CHUNK_KINDS = ('abstract', 'analysis')
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+|[㐀-䶿一-鿿]+')
+
+
+class HashingEmbedder:
+    """确定性的特征哈希向量: 英文按词, 中文按相邻两字, 无需模型文件, 也用作测试替身"""
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        for token in _TOKEN_RE.findall((text or '').lower()):
+            if token[0].isascii():
+                yield token
+            elif len(token) == 1:
+                yield token
+            else:
+                for i in range(len(token) - 1):
+                    yield token[i:i + 2]
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], 'little') % self.dim
+                matrix[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        # 次线性词频, 避免高频词主导
+        return _normalize(np.sign(matrix) * np.log1p(np.abs(matrix)))
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer # 可选依赖, 延遲導入
+        self._model = SentenceTransformer(model_name)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers-{model_name}"
+
+    def embed(self, texts):
+        return _normalize(np.asarray(self._model.encode(list(texts)), dtype=np.float32))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def get_embedder(spec=EMBEDDER):
+    if spec.startswith('sentence-transformers:'):
+        return SentenceTransformerEmbedder(spec.split(':', 1)[1])
+    return HashingEmbedder()
+
+
+def article_chunks(article, analyses=None):
+    """每篇文章切成两个检索单元: 标题+摘要, 以及 AI 分析"""
+    if analyses is None:
+        analyses = {a.analysis_type: a.content or {} for a in Analysis.query.filter_by(article_id=article.id)}
+    summary = analyses.get('summary') or {}
+    detailed = analyses.get('detailed') or {}
+    analysis_text = "\n".join(filter(None, [
+        summary.get('simplified_summary_zh'),
+        " ".join(summary.get('keywords_en') or []),
+        detailed.get('background'),
+        detailed.get('methodology'),
+        "\n".join(detailed.get('key_innovations') or []),
+        detailed.get('potential_impact')
+    ]))
+    chunks = [('abstract', f"{article.title}\n{article.original_summary or ''}")]
+    if analysis_text:
+        chunks.append(('analysis', analysis_text))
+    return chunks
+
+
+class VectorIndex:
+    """
+    向量保存在只追加的 float32 文件中, 通过 np.memmap 读取, 行元数据 (article_id, 片段类型) 另存为 int64 文件。
+    删除只把 article_id 置为 -1, 超过 COMPACT_RATIO 后重写文件。
+    多个进程共享同一目录: 写入时持有目录中的文件锁, 读取时按 (inode, 大小) 判断文件是否被追加或重写。
+    """
+
+    def __init__(self, directory=EMBEDDINGS_DIR, embedder=None):
+        self.directory = directory
+        self._embedder = embedder
+        self._lock = threading.RLock()
+        self._vectors = None
+        self._rows = None
+        self._loaded_stat = None
+        self._lock_depth = 0
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的写锁: 向量与行元数据分两个文件追加, 须保证其他进程的写入不会插在中间"""
+        with self._lock:
+            # remove_article 会在持有锁时调用 compact; 同一进程对同一文件再次 flock 会阻塞, 因此按深度重入
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, "index.lock"), 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.directory, "vectors.f32")
+
+    @property
+    def _rows_path(self):
+        return os.path.join(self.directory, "rows.i64")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _ensure_files(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {'embedder': self.embedder.name, 'dim': self.embedder.dim}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                if json.load(f) == meta:
+                    return
+            log.warning("Embedder changed, resetting vector index. Run 'flask --app app rebuild-embeddings'.",
+                        embedder=self.embedder.name)
+        for path in (self._vectors_path, self._rows_path):
+            open(path, 'wb').close()
+        with open(self._meta_path, 'w') as f:
+            json.dump(meta, f)
+        self._loaded_stat = None
+
+    def _load(self):
+        """文件被追加或被其他进程压缩重写 (inode 变化) 时重新映射"""
+        self._ensure_files()
+        stat = os.stat(self._rows_path)
+        loaded = (stat.st_ino, stat.st_size)
+        if loaded == self._loaded_stat:
+            return
+        count = stat.st_size // 16
+        if count == 0:
+            self._vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+            self._rows = np.zeros((0, 2), dtype=np.int64)
+        else:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(count, self.embedder.dim))
+            self._rows = np.memmap(self._rows_path, dtype=np.int64, mode='r+', shape=(count, 2))
+        self._loaded_stat = loaded
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return int((self._rows[:, 0] >= 0).sum())
+
+    def add_article(self, article, analyses=None):
+        chunks = article_chunks(article, analyses)
+        vectors = self.embedder.embed([text for _, text in chunks])
+        rows = np.array([(article.id, CHUNK_KINDS.index(kind)) for kind, _ in chunks], dtype=np.int64)
+        with self._file_lock():
+            self._remove(article.id)
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            with open(self._rows_path, 'ab') as f:
+                f.write(rows.tobytes())
+
+    def remove_article(self, article_id):
+        with self._file_lock():
+            self._remove(article_id)
+            deleted = int((self._rows[:, 0] < 0).sum())
+            if len(self._rows) and deleted / len(self._rows) > COMPACT_RATIO:
+                self.compact()
+
+    def _remove(self, article_id):
+        self._load()
+        mask = self._rows[:, 0] == article_id
+        if mask.any():
+            self._rows[mask, 0] = -1
+            self._rows.flush()
+
+    def compact(self):
+        with self._file_lock():
+            self._load()
+            keep = self._rows[:, 0] >= 0
+            vectors = np.array(self._vectors[keep], dtype=np.float32)
+            rows = np.array(self._rows[keep], dtype=np.int64)
+            self._vectors = self._rows = None
+            for path, data in ((self._vectors_path, vectors), (self._rows_path, rows)):
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data.tobytes())
+                os.replace(tmp_path, path)
+            self._loaded_stat = None
+
+    def reset(self):
+        with self._file_lock():
+            self._ensure_files()
+            self._vectors = self._rows = None
+            for path in (self._vectors_path, self._rows_path):
+                open(path, 'wb').close()
+            self._loaded_stat = None
+
+    def _scores(self, query_vector):
+        self._load()
+        if len(self._rows) == 0:
+            return np.zeros(0, dtype=np.float32)
+        scores = self._vectors @ query_vector
+        scores[self._rows[:, 0] < 0] = -np.inf
+        return scores
+
+    def _top_rows(self, scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top[np.isfinite(scores[top])]
+
+    def search_chunks(self, text, k=8):
+        """返回与文本最相似的 k 个片段: [(article_id, kind, score)]"""
+        query = self.embedder.embed([text])[0]
+        with self._lock:
+            scores = self._scores(query)
+            top = self._top_rows(scores, k)
+            return [(int(self._rows[i, 0]), CHUNK_KINDS[self._rows[i, 1]], float(scores[i])) for i in top]
+
+    def related_articles(self, article_id, k=10):
+        """以文章自身各片段的平均向量作为查询, 每篇候选文章取最高片段得分"""
+        with self._lock:
+            self._load()
+            own = self._rows[:, 0] == article_id
+            if not own.any():
+                return []
+            query = _normalize(np.asarray(self._vectors[own]).mean(axis=0, keepdims=True))[0]
+            scores = self._scores(query)
+            scores[own] = -np.inf
+            # 多取一些片段, 合并到文章级别后再截断
+            top = self._top_rows(scores, k * len(CHUNK_KINDS))
+            best = {}
+            for i in top:
+                best.setdefault(int(self._rows[i, 0]), float(scores[i]))
+            return sorted(best.items(), key=lambda item: -item[1])[:k]
+
+
+def rebuild_index(index):
+    """从数据库重新计算所有文章的向量"""
+    index.reset()
+    total = 0
+    last_id = 0
+    while True:
+        batch = (Article.query.options(selectinload(Article.analyses))
+                 .filter(Article.id > last_id).order_by(Article.id).limit(REBUILD_BATCH_SIZE).all())
+        if not batch:
+            break
+        for article in batch:
+            index.add_article(article, {a.analysis_type: a.content or {} for a in article.analyses})
+        total += len(batch)
+        last_id = batch[-1].id
+    return total
+
+
+vector_index = VectorIndex()
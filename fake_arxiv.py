@@ -0,0 +1,325 @@
+# fake_arxiv.py - 离线的 arXiv 替身: Atom 查询接口、PDF 与源码包下载, 用于开发与测试
+#
+# 用法: python fake_arxiv.py --port 8081 --papers 500
+# 然后以 ARXIV_API_URL=http://127.0.0.1:8081/api/query ARXIV_API_DELAY=0 启动应用。
+# 也可在测试代码中直接使用 FakeArxiv(...).start(), 返回的地址同上。
+import io
+import re
+import time
+import zlib
+import struct
+import random
+import tarfile
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+
+KEYWORDS = ("large language model", "diffusion model", "reinforcement learning", "graph neural network",
+            "quantum computing")
+LARGE_COLLABORATION_EVERY = 25 # 每隔若干篇生成一篇上千作者的论文
+_DATE_RANGE_RE = re.compile(r'submittedDate:\[(\d{12}) TO (\d{12})\]')
+_PHRASE_RE = re.compile(r'(?:all|ti|abs):(?:"([^"]+)"|(\S+))')
+
+
+def _png(width, height, rgb):
+    raw = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def _paragraph(opening, sentences):
+    words = ("accuracy", "baseline", "dataset", "latency", "memory", "scaling", "ablation", "robustness")
+    return [f"{opening} measure {words[i % len(words)]} on benchmark {i} and observe a gain of {i % 7}.{i % 10} points."
+            for i in range(sentences)]
+
+
+def _pdf_document(lines, lines_per_page=45):
+    """最小的合法 PDF: 每页一个文本内容流, 使用内置的 Helvetica 字体"""
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_lines in pages:
+        text = "".join(f"({line.replace(chr(92), '').replace('(', '[').replace(')', ']')}) Tj T* " for line in page_lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text}ET".encode('latin-1', 'replace')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeArxiv:
+    """
+    内存中的论文库, 按 arXiv API 的语义实现本项目用到的查询:
+    all:"短语" (以 AND / OR 连接)、submittedDate:[起 TO 止]、id_list、排序与 start/max_results 分页。
+    failure_rate 随机返回 503; min_interval 模拟 arXiv 的限速, 请求过快时返回 429。
+    PDF 支持 Range 请求; interrupt_pdf_after 让每篇 PDF 的第一次完整下载在若干字节后断开,
+    broken_pdfs 中的论文返回 HTML 错误页而不是 PDF。
+    """
+
+    def __init__(self, papers=200, start=datetime(2024, 1, 1), interval=timedelta(hours=1),
+                 failure_rate=0.0, min_interval=0.0, latency=0.0, seed=0, interrupt_pdf_after=None):
+        self.interval = interval
+        self.failure_rate = failure_rate
+        self.min_interval = min_interval
+        self.latency = latency
+        self.interrupt_pdf_after = interrupt_pdf_after
+        self.broken_pdfs = set()
+        self._interrupted = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._papers = []
+        self._next_published = start
+        self.api_requests = [] # 每次 API 请求的 time.monotonic()
+        self.downloads = []
+        self.rejected = 0
+        self._server = None
+        self.base_url = None
+        self.add_papers(papers)
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/api/query"
+
+    def add_papers(self, count, keyword=None):
+        """追加按时间递增提交的论文, 用于模拟两次抓取之间出现的新论文"""
+        with self._lock:
+            for _ in range(count):
+                number = len(self._papers) + 1
+                topic = keyword or KEYWORDS[number % len(KEYWORDS)]
+                authors = 1000 if number % LARGE_COLLABORATION_EVERY == 0 else 3
+                self._papers.append({
+                    'id': f"2401.{number:05d}",
+                    'published': self._next_published,
+                    'title': f"On {topic}: synthetic study {number}",
+                    'summary': f"We study {topic} in synthetic setting {number}. " * 6,
+                    'authors': [f"Author {(number * 7 + i) % 5000}" for i in range(authors)],
+                })
+                self._next_published += self.interval
+
+    def query(self, search_query='', id_list='', start=0, max_results=10, sort_by='relevance', sort_order='descending'):
+        with self._lock:
+            papers = list(self._papers)
+        if id_list:
+            wanted = [i.split('v')[0] if re.match(r'\d{4}\.\d+v\d+$', i) else i for i in id_list.split(',')]
+            by_id = {paper['id']: paper for paper in papers}
+            matches = [by_id[i] for i in wanted if i in by_id]
+        else:
+            matches = [paper for paper in papers if self._matches(paper, search_query)]
+            reverse = sort_order != 'ascending'
+            matches.sort(key=lambda paper: (paper['published'], paper['id']), reverse=reverse)
+        return len(matches), matches[start:start + max_results]
+
+    @staticmethod
+    def _matches(paper, search_query):
+        date_range = _DATE_RANGE_RE.search(search_query)
+        if date_range:
+            low, high = (datetime.strptime(value, '%Y%m%d%H%M') for value in date_range.groups())
+            if not low <= paper['published'] <= high + timedelta(seconds=59):
+                return False
+            search_query = _DATE_RANGE_RE.sub('', search_query)
+        phrases = [(quoted or bare).lower() for quoted, bare in _PHRASE_RE.findall(search_query)]
+        if not phrases:
+            # 不带字段前缀的自由文本: 任一词出现即可
+            phrases = [word.lower() for word in re.findall(r'\w+', search_query) if word not in ('AND', 'OR')]
+            combine = any
+        else:
+            combine = any if ' OR ' in search_query else all
+        if not phrases:
+            return True
+        text = f"{paper['title']} {paper['summary']}".lower()
+        return combine(phrase in text for phrase in phrases)
+
+    def feed(self, params):
+        start = int(params.get('start', 0))
+        max_results = int(params.get('max_results', 10))
+        total, papers = self.query(params.get('search_query', ''), params.get('id_list', ''), start, max_results,
+                                   params.get('sortBy', 'relevance'), params.get('sortOrder', 'descending'))
+        entries = "".join(self._entry(paper) for paper in papers)
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" '
+            'xmlns:arxiv="http://arxiv.org/schemas/atom">'
+            f'<title>Fake arXiv query results</title><updated>{_timestamp(datetime.now(timezone.utc))}</updated>'
+            f'<opensearch:totalResults>{total}</opensearch:totalResults>'
+            f'<opensearch:startIndex>{start}</opensearch:startIndex>'
+            f'<opensearch:itemsPerPage>{max_results}</opensearch:itemsPerPage>'
+            f'{entries}</feed>'
+        ).encode('utf-8')
+
+    def _entry(self, paper):
+        versioned = f"{paper['id']}v1"
+        authors = "".join(f"<author><name>{escape(name)}</name></author>" for name in paper['authors'])
+        return (
+            f"<entry><id>http://arxiv.org/abs/{versioned}</id>"
+            f"<updated>{_timestamp(paper['published'])}</updated><published>{_timestamp(paper['published'])}</published>"
+            f"<title>{escape(paper['title'])}</title><summary>{escape(paper['summary'])}</summary>{authors}"
+            f'<link href="http://arxiv.org/abs/{versioned}" rel="alternate" type="text/html"/>'
+            f'<link title="pdf" href="{self.base_url}/pdf/{versioned}" rel="related" type="application/pdf"/>'
+            f'<arxiv:primary_category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>'
+            f'<category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/></entry>'
+        )
+
+    def pdf(self, paper_id):
+        """按章节生成的多页 PDF, 可被 pypdf 提取出文本"""
+        with self._lock:
+            paper = next((p for p in self._papers if p['id'] == paper_id.split('v')[0]), None)
+        title = paper['title'] if paper else f"Paper {paper_id}"
+        topic = title.split(':')[0].replace('On ', '')
+        lines = [title, "", "Abstract"] + _paragraph(f"We study {topic} and report results", 4)
+        for number, section in enumerate(("Introduction", "Method", "Experiments", "Conclusion"), 1):
+            lines += ["", f"{number} {section}"] + _paragraph(f"In this {section.lower()} section on {topic} we", 30)
+        lines += ["", "References"] + [f"[{i}] A. Author. An earlier study of {topic}. 2020." for i in range(1, 20)]
+        return _pdf_document(lines)
+
+    @staticmethod
+    def source(paper_id):
+        buffer = io.BytesIO()
+        seed = sum(paper_id.encode())
+        files = [('main.tex', f"\\documentclass{{article}}\\title{{{paper_id}}}".encode()),
+                 ('figures/overview.png', _png(64, 48, (seed % 256, 80, 160))),
+                 ('figures/results.png', _png(32, 32, (20, seed % 256, 90)))]
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            for name, data in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def _admit(self, is_api):
+        """返回需要模拟的错误状态码, 没有则返回 None"""
+        with self._lock:
+            now = time.monotonic()
+            if is_api:
+                too_fast = bool(self.api_requests) and now - self.api_requests[-1] < self.min_interval
+                self.api_requests.append(now)
+                if too_fast:
+                    self.rejected += 1
+                    return 429
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.rejected += 1
+                return 503
+        return None
+
+    def start(self, host='127.0.0.1', port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status = fake._admit(url.path == '/api/query')
+                if status:
+                    self.send_response(status)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if url.path == '/api/query':
+                    params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    self._send(fake.feed(params), 'application/atom+xml')
+                elif url.path.startswith('/pdf/'):
+                    fake.downloads.append((url.path, self.headers.get('Range')))
+                    self._send_pdf(url.path[5:])
+                elif url.path.startswith('/src/'):
+                    fake.downloads.append((url.path, None))
+                    self._send(fake.source(url.path[5:]), 'application/gzip')
+                else:
+                    self.send_error(404)
+
+            def _send_pdf(self, paper_id):
+                if paper_id.split('v')[0] in fake.broken_pdfs:
+                    self._send(b"<html><body>Service unavailable</body></html>", 'text/html')
+                    return
+                body = fake.pdf(paper_id)
+                byte_range = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+                if byte_range:
+                    offset = int(byte_range.group(1))
+                    if offset >= len(body):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f"bytes */{len(body)}")
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {offset}-{len(body) - 1}/{len(body)}")
+                    self._send(body[offset:], 'application/pdf', status=None)
+                    return
+                with fake._lock:
+                    interrupt = fake.interrupt_pdf_after and paper_id not in fake._interrupted
+                    if interrupt:
+                        fake._interrupted.add(paper_id)
+                if interrupt:
+                    # 声明完整长度但只发送一部分就断开连接
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/pdf')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body[:fake.interrupt_pdf_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self._send(body, 'application/pdf')
+
+            def _send(self, body, content_type, status=200):
+                if status:
+                    self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地 arXiv API 替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--papers', type=int, default=500)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--min-interval', type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeArxiv(papers=args.papers, start=datetime.utcnow() - timedelta(hours=args.papers),
+                     failure_rate=args.failure_rate, min_interval=args.min_interval)
+    print(f"Fake arXiv API listening at {fake.start(args.host, args.port)}/api/query")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,190 @@
+# figures.py - 从 arXiv 源码包中流式提取插图并生成缩略图
+import io
+import os
+import gzip
+import uuid
+import hashlib
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+import arxiv_client
+import metrics
+from logs import get_logger
+
+log = get_logger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+THUMBNAIL_SIZE = (480, 480)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+MAX_IMAGE_BYTES = 50 * 1024 * 1024 # 单张图片上限, 超过则跳过
+SOURCE_TIMEOUT = 60
+CHUNK_SIZE = 64 * 1024
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_IMAGE_MAGICS = {b'\x89PNG': '.png', b'\xff\xd8\xff': '.jpg', b'GIF8': '.gif'}
+
+thumbnail_pool = ThreadPoolExecutor(THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+
+
+class _ReplayStream(io.RawIOBase):
+    """先返回已读出的文件头, 再继续读取底层流; 用于在不可回退的流上嗅探格式"""
+
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._head:
+            size = min(len(buffer), len(self._head))
+            buffer[:size] = self._head[:size]
+            self._head = self._head[size:]
+            return size
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _peek(stream, size):
+    head = b''
+    while len(head) < size:
+        data = stream.read(size - len(head))
+        if not data:
+            break
+        head += data
+    return head, io.BufferedReader(_ReplayStream(head, stream), CHUNK_SIZE)
+
+
+def _is_tar(head):
+    return len(head) > 262 and head[257:262] == b'ustar'
+
+
+def _image_extension(head):
+    for magic, extension in _IMAGE_MAGICS.items():
+        if head.startswith(magic):
+            return extension
+    return None
+
+
+def thumbnail_path_for(image_path):
+    folder, filename = os.path.split(image_path)
+    return os.path.join(folder, "thumbs", os.path.splitext(filename)[0] + ".jpg")
+
+
+def make_thumbnail(image_path):
+    """生成 JPEG 缩略图并缓存在 images/thumbs 下, 已存在时直接返回路径"""
+    from PIL import Image # 延遲導入
+    thumb_path = thumbnail_path_for(image_path)
+    if os.path.exists(thumb_path):
+        return thumb_path
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    with Image.open(image_path) as image:
+        image.draft('RGB', THUMBNAIL_SIZE) # JPEG 直接按缩小的尺寸解码, 减少内存占用
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            converted = image.convert('RGBA')
+            background.paste(converted, mask=converted.split()[-1])
+            image = background
+        tmp_path = f"{thumb_path}.{uuid.uuid4().hex}.tmp"
+        image.save(tmp_path, 'JPEG', quality=80, optimize=True)
+    os.replace(tmp_path, thumb_path)
+    return thumb_path
+
+
+class FigureExtractor:
+    """
+    逐个成员地读取源码包 (tarfile 流模式, 不构建完整索引), 图片按内容哈希命名:
+    不同子目录下的同名图片不会互相覆盖, 内容相同的图片只保存一份。
+    """
+
+    def __init__(self, paper_folder_path):
+        self.paper_folder_path = paper_folder_path
+        self.images_dir = os.path.join(paper_folder_path, "images")
+        self.image_paths = []
+        self._thumbnails = []
+
+    def extract_from_url(self, url):
+        with arxiv_client.session.get(url, stream=True, timeout=SOURCE_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = False
+            return self.extract_from_stream(response.raw)
+
+    def extract_from_file(self, source_path):
+        with open(source_path, 'rb') as f:
+            return self.extract_from_stream(f)
+
+    def extract_from_stream(self, stream):
+        head, stream = _peek(stream, 512)
+        if head.startswith(_GZIP_MAGIC):
+            # arXiv 的源码可能是 tar.gz, 也可能是单个 gzip 压缩的 .tex 文件
+            head, stream = _peek(gzip.GzipFile(fileobj=stream), 512)
+        if _is_tar(head):
+            self._extract_tar(stream)
+        elif _image_extension(head):
+            self._save_image(stream, _image_extension(head))
+        # 其他情况 (单个 .tex, PDF 等) 不含可提取的图片
+        self._wait_for_thumbnails()
+        return self.image_paths
+
+    def _extract_tar(self, stream):
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if member.size > MAX_IMAGE_BYTES:
+                    log.info("Skipping oversized image", member=member.name, bytes=member.size)
+                    continue
+                source = tar.extractfile(member)
+                if source is not None:
+                    with source:
+                        self._save_image(source, os.path.splitext(member.name)[1].lower())
+
+    def _save_image(self, source, extension):
+        os.makedirs(self.images_dir, exist_ok=True)
+        tmp_path = os.path.join(self.images_dir, f".{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        with open(tmp_path, 'wb') as target:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    break
+                digest.update(chunk)
+                target.write(chunk)
+        if size > MAX_IMAGE_BYTES:
+            os.remove(tmp_path)
+            return
+
+        filename = f"{digest.hexdigest()[:16]}{extension}"
+        target_path = os.path.join(self.images_dir, filename)
+        if os.path.exists(target_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, target_path)
+        relative_path = f"{os.path.basename(self.paper_folder_path)}/images/{filename}"
+        if relative_path not in self.image_paths:
+            self.image_paths.append(relative_path)
+            self._thumbnails.append(thumbnail_pool.submit(make_thumbnail, target_path))
+
+    def _wait_for_thumbnails(self):
+        for future in self._thumbnails:
+            try:
+                future.result()
+            except Exception as e:
+                log.warning("Failed to create thumbnail", error=str(e))
+        self._thumbnails = []
+
+
+def extract_paper_figures(paper, paper_folder_path):
+    """下载并提取单篇论文的插图, 返回相对 SAVE_PATH 的路径列表"""
+    try:
+        with metrics.timed('source_extraction'):
+            return FigureExtractor(paper_folder_path).extract_from_url(paper.source_url())
+    except Exception as e:
+        log.warning("Could not download or extract source for images", entry_id=paper.entry_id, error=str(e))
+        return []
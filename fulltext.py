@@ -0,0 +1,343 @@
+# fulltext.py - PDF 全文提取与按章节切分, 结果缓存在磁盘上
+# 解析 PDF 是 CPU 密集的工作, 在独立的进程池中进行, 不占用 Web 进程的 GIL。
+# 本模块会在子进程中被重新导入 (spawn), 因此只依赖标准库 (及同样只依赖标准库的 logs), pypdf 在子进程中延遲導入。
+# spawn 还会在子进程中重新导入主模块: gunicorn 下是 gunicorn 本身, 以 python app.py 启动时则会执行 app.py 的顶层代码
+# (导入各模块、创建 Flask 应用; 后台服务在 __main__ 块中启动, 不会在子进程中运行), 子进程启动较慢, 但行为不受影响。
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from logs import get_logger
+
+log = get_logger(__name__)
+
+FULLTEXT_DIR = os.getenv("FULLTEXT_DIR", "fulltext_cache")
+FULLTEXT_WORKERS = int(os.getenv("FULLTEXT_WORKERS", "2"))
+CHUNK_TOKENS = int(os.getenv("FULLTEXT_CHUNK_TOKENS", "800"))
+EXTRACT_TIMEOUT = 120
+MEMORY_ENTRIES = 32 # 内存中保留最近使用的若干篇论文的片段 (及其向量)
+# 切分规则变化时递增, 旧的缓存随之失效
+CHUNKER_VERSION = 1
+# 中断的缓存写入留下的临时文件的保留时间 (秒)
+TEMP_FILE_MAX_AGE = 3600
+# 缓存文件以 {"stamp": ..., "pdf_path": ...} 开头, 清理时只读开头一段即可找到对应的 PDF
+_PDF_PATH_RE = re.compile(r'"pdf_path":\s*("(?:[^"\\]|\\.)*")')
+_CACHE_HEAD_BYTES = 4096
+
+_SECTION_NAMES = (r"abstract|introduction|related work|background|preliminaries|methods?|methodology|approach|"
+                  r"experiments?|experimental setup|evaluation|results|discussion|limitations|conclusions?|"
+                  r"references|bibliography|acknowledge?ments|appendix(?: [a-z])?")
+_HEADING_RE = re.compile(
+    rf"^(?:(?:\d{{1,2}}(?:\.\d{{1,2}}){{0,2}}\.?|[IVX]{{1,5}}\.|[A-H]\.)\s+(?P<numbered>[A-Z][^.!?]{{1,70}})|(?P<named>{_SECTION_NAMES}))\s*$",
+    re.I
+)
+_SKIP_SECTIONS = re.compile(r"^(references|bibliography|acknowledge?ments)$", re.I)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+# 分析预算不足时优先保留的章节, 数字越小越优先
+_SECTION_PRIORITY = (("abstract", 0), ("introduction", 1), ("conclusion", 1), ("method", 2), ("approach", 2),
+                     ("result", 2), ("experiment", 3), ("evaluation", 3), ("discussion", 3), ("appendix", 6))
+
+
+def estimate_tokens(text):
+    """粗略估计 token 数: 英文约 4 个字符一个, 中文约一个字一个"""
+    cjk = len(re.findall(r"[㐀-䶿一-鿿]", text))
+    return max(1, cjk + (len(text) - cjk + 3) // 4)
+
+
+def _heading(line):
+    if len(line) > 80 or len(line.split()) > 12:
+        return None
+    match = _HEADING_RE.match(line)
+    if not match:
+        return None
+    return (match.group('numbered') or match.group('named')).strip()
+
+
+def split_sections(text):
+    """按章节标题切分, 返回 [(标题, 正文)]; 参考文献与致谢被丢弃, 附录保留"""
+    text = re.sub(r"(\w)-\n(\w)", r"\1\2", text) # 合并行尾连字符断开的单词
+    sections = []
+    title, lines, skipping = "Front matter", [], False
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        heading = _heading(line)
+        if heading:
+            if lines and not skipping:
+                sections.append((title, " ".join(lines)))
+            title, lines = heading, []
+            skipping = bool(_SKIP_SECTIONS.match(heading))
+            continue
+        lines.append(line)
+    if lines and not skipping:
+        sections.append((title, " ".join(lines)))
+    return sections
+
+
+def chunk_text(text, chunk_tokens=CHUNK_TOKENS):
+    """章节内按句子装箱, 片段不跨章节; 返回 [{'index', 'section', 'text', 'tokens'}]"""
+    chunks = []
+
+    def emit(section, sentences):
+        body = " ".join(sentences)
+        chunks.append({'index': len(chunks), 'section': section, 'text': body, 'tokens': estimate_tokens(body)})
+
+    for section, body in split_sections(text):
+        current, current_tokens = [], 0
+        for sentence in _SENTENCE_RE.split(body):
+            tokens = estimate_tokens(sentence)
+            if current and current_tokens + tokens > chunk_tokens:
+                emit(section, current)
+                current, current_tokens = [], 0
+            # 超长的"句子" (表格、公式) 按字符截断
+            while tokens > chunk_tokens:
+                cut = chunk_tokens * 4
+                emit(section, [sentence[:cut]])
+                sentence = sentence[cut:]
+                tokens = estimate_tokens(sentence)
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            emit(section, current)
+    return chunks
+
+
+def extract_chunks(pdf_path, chunk_tokens=CHUNK_TOKENS):
+    """在工作进程中运行: 提取 PDF 文本并切分, 返回 (页数, 片段列表)"""
+    from pypdf import PdfReader # 延遲導入
+    reader = PdfReader(pdf_path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    return len(pages), chunk_text("\n".join(pages), chunk_tokens)
+
+
+def _section_rank(section):
+    name = section.lower()
+    for keyword, rank in _SECTION_PRIORITY:
+        if keyword in name:
+            return rank
+    return 4
+
+
+def select_within_budget(chunks, budget_tokens):
+    """按章节优先级挑选片段直到用完预算, 返回按原文顺序排列的片段"""
+    selected, used = [], 0
+    for chunk in sorted(chunks, key=lambda c: (_section_rank(c['section']), c['index'])):
+        if used + chunk['tokens'] > budget_tokens:
+            continue
+        selected.append(chunk)
+        used += chunk['tokens']
+    return sorted(selected, key=lambda c: c['index'])
+
+
+def group_by_tokens(chunks, group_tokens):
+    """把连续的片段合并为若干组, 每组不超过 group_tokens (单个片段超出时单独成组)"""
+    groups, current, used = [], [], 0
+    for chunk in chunks:
+        if current and used + chunk['tokens'] > group_tokens:
+            groups.append(current)
+            current, used = [], 0
+        current.append(chunk)
+        used += chunk['tokens']
+    if current:
+        groups.append(current)
+    return groups
+
+
+def format_chunks(chunks):
+    return "\n\n".join(f"[{chunk['section']}]\n{chunk['text']}" for chunk in chunks)
+
+
+class FullTextStore:
+    """
+    以 PDF 路径为键缓存切分结果: 磁盘上每篇一个 JSON 文件, 并记录 PDF 的大小与修改时间,
+    PDF 被替换后自动重新提取。最近使用的若干篇同时保存在内存中。
+    """
+
+    def __init__(self, directory=FULLTEXT_DIR, workers=FULLTEXT_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Web 进程中有多个线程, fork 出的子进程可能继承被持有的锁, 因此使用 spawn
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            self._pool = None
+
+    def cache_path(self, pdf_path):
+        digest = hashlib.sha1(os.path.abspath(pdf_path).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.directory, f"{digest}.json")
+
+    @staticmethod
+    def _stamp(pdf_path):
+        stat = os.stat(pdf_path)
+        return [stat.st_size, stat.st_mtime_ns, CHUNKER_VERSION]
+
+    def _remember(self, pdf_path, entry):
+        with self._lock:
+            self._memory[pdf_path] = entry
+            self._memory.move_to_end(pdf_path)
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def _cached_entry(self, pdf_path, stamp):
+        with self._lock:
+            entry = self._memory.get(pdf_path)
+            if entry is not None and entry['stamp'] == stamp:
+                self._memory.move_to_end(pdf_path)
+                return entry
+        try:
+            with open(self.cache_path(pdf_path), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('stamp') != stamp:
+            return None
+        entry = {'stamp': stamp, 'chunks': data['chunks'], 'vectors': {}}
+        self._remember(pdf_path, entry)
+        return entry
+
+    def _write_cache(self, pdf_path, stamp, pages, chunks):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.cache_path(pdf_path)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stamp': stamp, 'pdf_path': pdf_path, 'pages': pages, 'chunks': chunks}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _entry(self, pdf_path, timeout, extract=True):
+        if not pdf_path or not os.path.exists(pdf_path):
+            return None
+        stamp = self._stamp(pdf_path)
+        entry = self._cached_entry(pdf_path, stamp)
+        if entry is not None or not extract:
+            return entry
+        try:
+            future = self._executor().submit(extract_chunks, pdf_path)
+        except BrokenProcessPool:
+            self._reset_pool()
+            future = self._executor().submit(extract_chunks, pdf_path)
+        import metrics # 延遲導入: 工作进程只需要 extract_chunks, 不必加载 SQLAlchemy
+        try:
+            with metrics.timed('fulltext_extraction'):
+                future.result(timeout=timeout)
+        except TimeoutError:
+            # 提取仍在进行, 完成后再写入缓存; 本次调用先不使用全文
+            log.warning("Full-text extraction still running, continuing without it", pdf_path=pdf_path)
+            future.add_done_callback(lambda f: self._store_result(pdf_path, stamp, f))
+            return None
+        except Exception:
+            pass
+        return self._store_result(pdf_path, stamp, future)
+
+    def _store_result(self, pdf_path, stamp, future):
+        try:
+            pages, chunks = future.result()
+        except BrokenProcessPool as e:
+            # 工作进程异常退出 (例如内存不足), 下次调用时重建进程池
+            self._reset_pool()
+            log.error("Full-text extraction crashed", pdf_path=pdf_path, error=str(e))
+            return None
+        except Exception as e:
+            # 无法解析的 PDF 缓存为空结果, 避免每次提问都重新解析
+            log.warning("Failed to extract text from PDF", pdf_path=pdf_path, error=str(e))
+            pages, chunks = 0, []
+        self._write_cache(pdf_path, stamp, pages, chunks)
+        entry = {'stamp': stamp, 'chunks': chunks, 'vectors': {}}
+        self._remember(pdf_path, entry)
+        return entry
+
+    def chunks(self, pdf_path, timeout=EXTRACT_TIMEOUT):
+        """返回 PDF 的片段列表; 未缓存时在进程池中提取并等待结果, PDF 不存在或无法解析时返回 []"""
+        entry = self._entry(pdf_path, timeout)
+        return entry['chunks'] if entry else []
+
+    def select_relevant(self, pdf_path, query, budget_tokens, embedder, timeout=EXTRACT_TIMEOUT, extract=True):
+        """
+        按与 query 的向量相似度挑选片段直到用完预算, 返回按原文顺序排列的片段; 片段向量缓存在内存中。
+        extract=False 时只使用已缓存的切分结果, PDF 存在但尚未提取时返回 None。
+        """
+        entry = self._entry(pdf_path, timeout, extract=extract)
+        if entry is None and not extract and pdf_path and os.path.exists(pdf_path):
+            return None
+        if not entry or not entry['chunks']:
+            return []
+        chunks = entry['chunks']
+        vectors = entry['vectors'].get(embedder.name)
+        if vectors is None:
+            vectors = embedder.embed([chunk['text'] for chunk in chunks])
+            entry['vectors'][embedder.name] = vectors
+        scores = vectors @ embedder.embed([query])[0]
+        selected, used = [], 0
+        for i in sorted(range(len(chunks)), key=lambda i: -scores[i]):
+            if used + chunks[i]['tokens'] > budget_tokens:
+                continue
+            selected.append(chunks[i])
+            used += chunks[i]['tokens']
+        return sorted(selected, key=lambda c: c['index'])
+
+    def remove(self, pdf_path):
+        if not pdf_path:
+            return
+        with self._lock:
+            self._memory.pop(pdf_path, None)
+        try:
+            os.remove(self.cache_path(pdf_path))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _cached_pdf_path(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                match = _PDF_PATH_RE.search(f.read(_CACHE_HEAD_BYTES))
+        except (OSError, UnicodeDecodeError):
+            return None
+        return json.loads(match.group(1)) if match else None
+
+    def prune(self, dry_run=False):
+        """删除对应 PDF 已不存在的缓存文件与过期的临时文件, 返回删除的文件数; 逐个读取目录项, 不构建完整列表"""
+        removed = 0
+        try:
+            entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return 0
+        with entries:
+            for entry in entries:
+                if entry.name.endswith('.tmp'):
+                    try:
+                        stale = time.time() - entry.stat().st_mtime > TEMP_FILE_MAX_AGE
+                    except FileNotFoundError: # 写入刚刚完成, 已被改名
+                        continue
+                elif entry.name.endswith('.json'):
+                    pdf_path = self._cached_pdf_path(entry.path)
+                    stale = pdf_path is not None and not os.path.exists(pdf_path)
+                else:
+                    continue
+                if not stale:
+                    continue
+                removed += 1
+                if not dry_run:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+        return removed
+
+
+fulltext_store = FullTextStore()
@@ -0,0 +1,29 @@
+# gunicorn.conf.py - 生产环境的 gunicorn 配置, gunicorn 启动时自动读取当前目录下的本文件
+# 多个 worker 共享同一个 SQLite 数据库: 定时任务只由持有租约的 worker 提交 (scheduler.py),
+# 后台任务由任意 worker 的空闲线程认领 (jobs.py), 响应缓存通过数据库中的失效记录同步 (response_cache.py)。
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5006")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# 写回环境变量: worker 继承后, llm_scheduler.py 据此把 LLM_RPM / LLM_TPM 平分到各 worker
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# 使用 gthread 工作模式, 流式问答 (SSE) 长连接只占用一个线程而不是整个 worker
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+# 流式问答可能持续较长时间
+timeout = 120
+
+
+def on_starting(server):
+    # 在 master 中建表与迁移, 避免多个 worker 同时执行迁移; 随后关闭连接, 不让 fork 出的 worker 继承
+    from app import app
+    from database import db, init_database
+    with app.app_context():
+        init_database()
+        db.engine.dispose()
+
+
+def post_worker_init(worker):
+    # 线程不会跨 fork 保留, 任务队列与调度器须在每个 worker 中启动
+    from app import start_background_services
+    start_background_services()
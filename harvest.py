@@ -0,0 +1,70 @@
+# harvest.py - 按关键词增量抓取: 每个关键词记录已处理到的最新论文, 下次只翻阅此后提交的论文
+import os
+from datetime import datetime, timedelta
+import arxiv
+import arxiv_client
+from models import db, Keyword
+
+# 新关键词第一次抓取时回溯的天数
+HARVEST_INITIAL_DAYS = int(os.getenv("HARVEST_INITIAL_DAYS", "7"))
+# arXiv 按公告时间而不是提交时间公开论文, 早提交的论文可能晚于高水位才出现;
+# 因此查询窗口从高水位往前多取一段, 重叠部分由流水线的批量存在性检查跳过
+HARVEST_OVERLAP_HOURS = int(os.getenv("HARVEST_OVERLAP_HOURS", "48"))
+_ARXIV_DATE_FORMAT = '%Y%m%d%H%M'
+
+
+class KeywordHarvest:
+    """
+    一个关键词的一次增量抓取。papers() 按提交时间倒序逐页读取高水位之后的论文 (不设数量上限),
+    并记录看到的每一篇 (提交时间, entry_id); 整批处理完成后调用 save_mark() 推进高水位。
+    高水位只推进到入库失败的论文之前, 失败的论文在之后的抓取中仍在查询窗口内, 会被重新处理。
+    """
+
+    def __init__(self, keyword):
+        self.keyword_id = keyword.id
+        self.keyword = keyword.keyword
+        if keyword.last_submitted:
+            self.since = keyword.last_submitted - timedelta(hours=HARVEST_OVERLAP_HOURS)
+            self._initial_mark = (keyword.last_submitted, keyword.last_entry_id or '')
+        else:
+            self.since = datetime.utcnow() - timedelta(days=HARVEST_INITIAL_DAYS)
+            self._initial_mark = None
+        self._seen = []
+        self.fetched = 0
+        self.unstored = 0
+
+    def search(self):
+        start = self.since.strftime(_ARXIV_DATE_FORMAT)
+        end = (datetime.utcnow() + timedelta(days=1)).strftime(_ARXIV_DATE_FORMAT)
+        phrase = self.keyword.replace('"', '')
+        return arxiv.Search(
+            query=f'all:"{phrase}" AND submittedDate:[{start} TO {end}]',
+            max_results=None,
+            sort_by=arxiv.SortCriterion.SubmittedDate,
+            sort_order=arxiv.SortOrder.Descending
+        )
+
+    def papers(self, client=None):
+        for paper in (client or arxiv_client.client).results(self.search()):
+            self._seen.append((paper.published.replace(tzinfo=None), paper.entry_id))
+            self.fetched += 1
+            yield paper
+
+    @property
+    def entry_ids(self):
+        return [entry_id for _, entry_id in self._seen]
+
+    def save_mark(self, stored):
+        """
+        stored 为已在数据库中的 entry_id 集合; 高水位推进到最早一篇未入库论文之前最新的已入库论文,
+        不会后退。随调用方的事务一起提交。
+        """
+        unstored = [key for key in self._seen if key[1] not in stored]
+        self.unstored = len(unstored)
+        limit = min(unstored, default=None)
+        newest = max((key for key in self._seen if key[1] in stored and (limit is None or key < limit)), default=None)
+        if newest is None or (self._initial_mark is not None and newest <= self._initial_mark):
+            return
+        keyword = db.session.get(Keyword, self.keyword_id)
+        if keyword is not None:
+            keyword.last_submitted, keyword.last_entry_id = newest
@@ -0,0 +1,326 @@
+# jobs.py - 持久化的任务队列, 多个进程共享同一张 Job 表
+import os
+import json
+import queue
+import hashlib
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import db, Article, Job
+import services
+import storage
+import metrics
+from coordination import process_id
+from logs import get_logger, bind
+
+log = get_logger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# 运行中的任务每隔 JOB_HEARTBEAT_SECONDS 记录一次心跳与进度;
+# 超过 JOB_STALE_SECONDS 没有心跳的任务视为所在进程已退出, 重新排队
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+# 空闲的工作线程每隔多少秒检查一次其他进程提交或重新排队的任务
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """运行中任务的内存状态: 逐篇论文的进度与取消标记, 由工作线程和流水线共享"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._lock = threading.Lock()
+        self._papers = {}
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} was cancelled.")
+
+    def paper_update(self, entry_id, state=None, title=None, error=None, timing=None):
+        with self._lock:
+            paper = self._papers.setdefault(entry_id, {'state': 'pending', 'timings': {}})
+            if state:
+                paper['state'] = state
+            if title:
+                paper['title'] = title
+            if error:
+                paper['error'] = str(error)
+            if timing:
+                paper['timings'].update(timing)
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._papers))
+
+
+def make_dedupe_key(job_type, params):
+    canonical = json.dumps({'type': job_type, 'params': params}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class JobQueue:
+    """
+    任务记录保存在 Job 表中, 由若干工作线程在 app context 内执行。
+    相同类型和参数的任务在排队或运行时只会存在一个 (跨进程由部分唯一索引保证)。
+    多进程部署时任何进程的空闲线程都可以认领排队的任务; 认领是一条原子 UPDATE, 同一任务只会运行一次。
+    取消请求写入数据库, 由运行该任务的进程在下一次心跳时生效。
+    """
+
+    def __init__(self, app=None, workers=None):
+        self.app = None
+        self.workers = workers or JOB_WORKERS
+        self._handlers = {}
+        self._queue = queue.Queue()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._started = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+
+    def register(self, job_type, handler):
+        self._handlers[job_type] = handler
+
+    def start(self):
+        """启动工作线程与心跳线程, 并把已退出进程留下的未完成任务重新排队"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        with self.app.app_context():
+            self._requeue_stale()
+            for job in Job.query.filter_by(status='queued').order_by(Job.id).all():
+                self._queue.put(job.id)
+
+        for i in range(self.workers):
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+        log.info("Job queue started", workers=self.workers, owner=process_id())
+
+    def submit(self, job_type, params=None):
+        """提交任务; 如果已有相同的任务在排队或运行, 直接返回那一个"""
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        params = params or {}
+        dedupe_key = make_dedupe_key(job_type, params)
+        with self._lock:
+            while True:
+                existing = Job.query.filter(Job.dedupe_key == dedupe_key, Job.status.in_(ACTIVE_STATUSES)).first()
+                if existing:
+                    return existing
+                job = Job(job_type=job_type, params=params, dedupe_key=dedupe_key, status='queued', progress={})
+                db.session.add(job)
+                try:
+                    db.session.commit()
+                    break
+                except IntegrityError:
+                    # 另一个进程刚刚提交了相同的任务, 重新查询并返回那一个
+                    db.session.rollback()
+        self.start()
+        self._queue.put(job.id)
+        return job
+
+    def cancel(self, job_id):
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return None
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+        if job.status == 'running':
+            job.cancel_requested = True
+            context = self._active.get(job_id)
+            if context:
+                context.cancel()
+        db.session.commit()
+        return job
+
+    def get_status(self, job_id):
+        """本进程运行的任务返回实时进度, 其他进程运行的任务返回最近一次心跳写入的进度"""
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return None
+        result = job.to_dict()
+        context = self._active.get(job_id)
+        if context:
+            result['progress'] = context.snapshot()
+        return result
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job_id = self._queue.get(timeout=JOB_POLL_SECONDS)
+                local = True
+            except queue.Empty:
+                job_id, local = None, False
+            try:
+                with self.app.app_context():
+                    if job_id is None:
+                        job_id = self._next_queued()
+                    if job_id is not None:
+                        self._run(job_id)
+            except Exception:
+                log.exception("Job worker error", job_id=job_id)
+            finally:
+                if local:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _next_queued():
+        row = db.session.query(Job.id).filter_by(status='queued').order_by(Job.id).first()
+        return row[0] if row else None
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                with self.app.app_context():
+                    self._heartbeat()
+                    self._requeue_stale()
+            except Exception:
+                log.exception("Job heartbeat failed")
+
+    def _heartbeat(self):
+        """为本进程运行中的任务记录心跳与进度, 并接收其他进程写入的取消请求"""
+        active = dict(self._active)
+        if not active:
+            return
+        now = datetime.utcnow()
+        for job in Job.query.filter(Job.id.in_(list(active)), Job.owner == process_id()):
+            job.heartbeat_at = now
+            job.progress = active[job.id].snapshot()
+            if job.cancel_requested:
+                active[job.id].cancel()
+        db.session.commit()
+
+    @staticmethod
+    def _requeue_stale():
+        """把心跳过期的运行中任务 (所在进程已退出或卡住) 重新排队; 升级前留下的任务没有心跳, 同样重新排队"""
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        requeued = Job.query.filter(
+            Job.status == 'running', or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < cutoff)
+        ).update({'status': 'queued', 'started_at': None, 'owner': None, 'heartbeat_at': None})
+        db.session.commit()
+        if requeued:
+            log.warning("Requeued stale jobs", count=requeued)
+
+    def _run(self, job_id):
+        # 只有仍处于 queued 的任务才会被认领, 已取消或已被其他线程、进程认领的任务直接跳过
+        now = datetime.utcnow()
+        claimed = Job.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'started_at': now, 'owner': process_id(), 'heartbeat_at': now}
+        )
+        db.session.commit()
+        if not claimed:
+            return
+
+        job = db.session.get(Job, job_id)
+        job_type = job.job_type
+        context = JobContext(job_id)
+        self._active[job_id] = context
+        status, error = 'succeeded', None
+        started = time.monotonic()
+        with bind(job_id=job_id, job_type=job_type):
+            log.info("Job started")
+            try:
+                self._handlers[job_type](job.params or {}, context)
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as e:
+                db.session.rollback()
+                status, error = 'failed', f"{type(e).__name__}: {e}"
+                log.exception("Job failed", error=error)
+            finally:
+                self._active.pop(job_id, None)
+            if status == 'succeeded' and context.cancelled:
+                status = 'cancelled'
+            elapsed = time.monotonic() - started
+            metrics.JOB_SECONDS.observe(elapsed, job_type=job_type, status=status)
+            log.info("Job finished", status=status, seconds=round(elapsed, 3))
+
+        # 心跳中断期间任务可能已被其他进程重新认领, 此时不覆盖它的状态
+        finished = Job.query.filter_by(id=job_id, owner=process_id()).update({
+            'status': status, 'error': error, 'progress': context.snapshot(), 'finished_at': datetime.utcnow()
+        })
+        db.session.commit()
+        if not finished:
+            log.warning("Job was taken over by another process", job_id=job_id)
+
+
+def _run_fetch(params, context):
+    services.run_fetch_and_process_job(progress=context)
+
+
+def _run_batch_import(params, context):
+    services.batch_import_and_process(params['entry_ids'], progress=context)
+
+
+def _run_regenerate(params, context):
+    article = db.session.get(Article, params['article_id'])
+    if article is None:
+        raise ValueError(f"Article {params['article_id']} no longer exists.")
+    context.paper_update(article.entry_id, state='processing', title=article.title)
+    services.regenerate_analysis_for_article(article, force=params.get('force', False))
+    context.paper_update(article.entry_id, state='saved')
+
+
+def _run_extract_fulltext(params, context):
+    article = db.session.get(Article, params['article_id'])
+    if article is None:
+        raise ValueError(f"Article {params['article_id']} no longer exists.")
+    context.paper_update(article.entry_id, state='processing', title=article.title)
+    services.extract_fulltext(article)
+    context.paper_update(article.entry_id, state='saved')
+
+
+def _run_retry_downloads(params, context):
+    services.retry_failed_downloads(progress=context, limit=params.get('limit'))
+
+
+def _run_retry_analyses(params, context):
+    services.retry_failed_analyses(progress=context, limit=params.get('limit'))
+
+
+def _run_storage_scan(params, context):
+    scanner = storage.StorageScanner(dry_run=params.get('dry_run', False),
+                                     collect_orphans=params.get('collect_orphans', storage.STORAGE_ORPHAN_GC),
+                                     progress=context)
+    report = scanner.run(limit=params.get('limit'), dedupe=params.get('dedupe', True))
+    log.info("Storage scan finished", **report)
+
+
+def _run_storage_gc(params, context):
+    storage.remove_article_files(params['local_path'], entry_id=params.get('entry_id'))
+
+
+job_queue = JobQueue()
+job_queue.register('fetch', _run_fetch)
+job_queue.register('batch_import', _run_batch_import)
+job_queue.register('regenerate', _run_regenerate)
+job_queue.register('extract_fulltext', _run_extract_fulltext)
+job_queue.register('retry_downloads', _run_retry_downloads)
+job_queue.register('retry_analyses', _run_retry_analyses)
+job_queue.register('storage_scan', _run_storage_scan)
+job_queue.register('storage_gc', _run_storage_gc)
+metrics.registry.gauge('jobs_running', 'Background jobs currently running in this process.',
+                       collect=lambda: {(): len(job_queue._active)})
+metrics.registry.gauge('jobs_queued', 'Background jobs waiting for a worker in this process.',
+                       collect=lambda: {(): job_queue._queue.qsize()})
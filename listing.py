@@ -0,0 +1,75 @@
+# listing.py - 文章列表的共享查询层
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+from models import Article
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(article):
+    """把最后一篇文章的 (published, id) 编码成不透明的游标"""
+    raw = f"{article.published.isoformat()}|{article.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        published_str, id_str = raw.rsplit('|', 1)
+        return datetime.fromisoformat(published_str), int(id_str)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def serialize_article_card(article):
+    return {
+        'id': article.id,
+        'title': article.title,
+        'published': article.published.strftime('%Y-%m-%d'),
+        'authors': [author.name for author in article.authors],
+        'summary_analysis': article.summary_analysis.content if article.summary_analysis else None,
+        'is_favorited': article.is_favorited
+    }
+
+
+def list_articles(favorites_only=False, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    按 published/id 倒序的键集分页列表。
+    作者和简易分析通过 selectinload 批量加载, 每页固定 3 次查询, 与表大小无关。
+    """
+    query = Article.query.options(
+        selectinload(Article.authors),
+        selectinload(Article.summary_analysis)
+    )
+    if favorites_only:
+        query = query.filter(Article.is_favorited.is_(True))
+    if cursor:
+        published, last_id = decode_cursor(cursor)
+        # 行值比较可直接在 (published, id) 索引上定位起点, 深翻页也不需要逐行跳过
+        query = query.filter(tuple_(Article.published, Article.id) < (published, last_id))
+
+    # 多取一条用于判断是否还有下一页
+    rows = query.order_by(Article.published.desc(), Article.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > limit else None
+    return {
+        'articles': [serialize_article_card(a) for a in page],
+        'next_cursor': next_cursor
+    }
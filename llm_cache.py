@@ -0,0 +1,117 @@
+# llm_cache.py - 以内容哈希为键的 LLM 响应持久缓存
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30"))
+# 每写入多少条执行一次淘汰
+EVICT_EVERY = 200
+
+
+class LLMCache:
+    """
+    键为 sha256(model + prompt 模板 + 输入文本), 值为 JSON 序列化后的响应。
+    使用独立的 sqlite 文件而不是 Flask-SQLAlchemy, 因为分析调用运行在没有 app context 的流水线线程中。
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, max_age_days=LLM_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, model TEXT, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_accessed ON llm_cache (last_accessed)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(model, prompt_template, input_text):
+        digest = hashlib.sha256()
+        for part in (model, prompt_template, input_text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, model=None):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, value, created_at, last_accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            conn.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(conn, now)
+
+    def evict(self):
+        with self._lock:
+            return self._evict(self._connection(), time.time())
+
+    def _evict(self, conn, now):
+        """先删除过期条目, 再按最近访问时间淘汰超出上限的部分"""
+        removed = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.max_age_seconds,)).rowcount
+        overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            removed += conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_accessed LIMIT ?)",
+                (overflow,)
+            ).rowcount
+        conn.commit()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'max_entries': self.max_entries,
+                'max_age_days': self.max_age_seconds / 86400
+            }
+
+
+llm_cache = LLMCache()
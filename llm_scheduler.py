@@ -0,0 +1,293 @@
+# llm_scheduler.py - 所有 LLM 请求的调度: 每分钟请求数与 token 数预算、并发上限、优先级、退避重试与用量统计
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import defaultdict, deque
+import openai
+from fulltext import estimate_tokens
+import metrics
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# LLM_RPM / LLM_TPM 是整个部署共用的预算; 每个 gunicorn worker 各有一个调度器, 按 worker 数 (WEB_CONCURRENCY) 平分
+LLM_RPM = int(os.getenv("LLM_RPM", "60"))
+LLM_TPM = int(os.getenv("LLM_TPM", "200000"))
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+WORKER_RPM = max(1, LLM_RPM // WORKER_COUNT)
+WORKER_TPM = max(1, LLM_TPM // WORKER_COUNT)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+WINDOW_SECONDS = 60.0
+# 预约 token 预算时对输出长度的估计, 请求完成后按实际用量修正
+EXPECTED_OUTPUT_TOKENS = 1000
+LATENCY_SAMPLES = 500
+
+# 数值越小越先调度: 用户正在等待的问答优先于后台分析
+INTERACTIVE = 0
+BACKGROUND = 1
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """重试次数用完或遇到不可重试的错误"""
+
+
+def _retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRY_STATUSES
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return min(BACKOFF_MAX, float(headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 1)
+
+
+class _Ticket:
+    __slots__ = ('priority', 'seq', 'tokens', 'window_entry')
+
+    def __init__(self, priority, seq, tokens):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.window_entry = None
+
+
+class LLMScheduler:
+    """
+    请求按 (优先级, 到达顺序) 排队, 只有队首的请求在以下条件都满足时才会发出:
+    进行中的请求数小于 concurrency, 最近 60 秒的请求数小于 rpm, 且已预约的 token 数加上本次估计不超过 tpm。
+    可重试的错误 (连接错误、超时、429、5xx) 以带抖动的指数退避重新排队; 服务端给出 Retry-After 时暂停所有请求。
+    """
+
+    def __init__(self, rpm=WORKER_RPM, tpm=WORKER_TPM, concurrency=LLM_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 timeout=LLM_TIMEOUT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._window = deque() # [发送时刻, token 数]
+        self._active = 0
+        self._paused_until = 0.0
+        self._seq = itertools.count()
+        self._stats = defaultdict(lambda: {
+            'calls': 0, 'errors': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+            'latency_ms': deque(maxlen=LATENCY_SAMPLES), 'queue_ms': deque(maxlen=LATENCY_SAMPLES)
+        })
+
+    # --- 准入 ---
+    def _window_tokens(self):
+        return sum(entry[1] for entry in self._window)
+
+    def _admit_delay(self, ticket, now):
+        """可以立即发送时返回 0, 否则返回需要等待的秒数 (None 表示等待其他请求结束)"""
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            self._window.popleft()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._active >= self.concurrency:
+            return None
+        if len(self._window) >= self.rpm:
+            return self._window[0][0] + WINDOW_SECONDS - now
+        used = self._window_tokens()
+        if used and used + ticket.tokens > self.tpm:
+            # 等到足够多的旧请求移出窗口; 单个请求超过 tpm 时等窗口清空后单独发送
+            for sent_at, tokens in self._window:
+                used -= tokens
+                if not used or used + ticket.tokens <= self.tpm:
+                    return sent_at + WINDOW_SECONDS - now
+        return 0
+
+    def _acquire(self, ticket):
+        with self._cond:
+            heapq.heappush(self._waiting, (ticket.priority, ticket.seq, ticket))
+            while True:
+                now = time.monotonic()
+                delay = self._admit_delay(ticket, now) if self._waiting[0][2] is ticket else None
+                if delay == 0:
+                    heapq.heappop(self._waiting)
+                    self._active += 1
+                    ticket.window_entry = [now, ticket.tokens]
+                    self._window.append(ticket.window_entry)
+                    # 队首变化, 唤醒下一个请求重新检查
+                    self._cond.notify_all()
+                    return
+                self._cond.wait(timeout=max(0.01, delay) if delay else 1.0)
+
+    def _release(self, ticket, actual_tokens=None):
+        with self._cond:
+            self._active -= 1
+            if actual_tokens is not None and ticket.window_entry is not None:
+                ticket.window_entry[1] = actual_tokens
+            self._cond.notify_all()
+
+    def _pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    # --- 统计 ---
+    def _record(self, kind, queued_at, started, usage=None, prompt=None, completion=None, error=False, retries=0):
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) or estimate_tokens(prompt or "")
+        completion_tokens = getattr(usage, 'completion_tokens', None) or (estimate_tokens(completion) if completion else 0)
+        latency = time.monotonic() - started
+        metrics.LLM_REQUEST_SECONDS.observe(latency, kind=kind, outcome='error' if error else 'ok')
+        metrics.LLM_QUEUE_SECONDS.observe(started - queued_at, kind=kind)
+        metrics.add_span('llm', latency)
+        if retries:
+            metrics.LLM_RETRIES.inc(retries, kind=kind)
+        if not error:
+            metrics.LLM_TOKENS.inc(prompt_tokens, kind=kind, type='prompt')
+            metrics.LLM_TOKENS.inc(completion_tokens, kind=kind, type='completion')
+        with self._cond:
+            stats = self._stats[kind]
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['retries'] += retries
+            if not error:
+                stats['prompt_tokens'] += prompt_tokens
+                stats['completion_tokens'] += completion_tokens
+                stats['latency_ms'].append(latency * 1000)
+            stats['queue_ms'].append((started - queued_at) * 1000)
+        return prompt_tokens + completion_tokens
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            window = [entry for entry in self._window if entry[0] > now - WINDOW_SECONDS]
+            kinds = {kind: {
+                'calls': s['calls'], 'errors': s['errors'], 'retries': s['retries'],
+                'prompt_tokens': s['prompt_tokens'], 'completion_tokens': s['completion_tokens'],
+                'latency_ms_p50': _percentile(s['latency_ms'], 0.5), 'latency_ms_p95': _percentile(s['latency_ms'], 0.95),
+                'queue_ms_p50': _percentile(s['queue_ms'], 0.5), 'queue_ms_p95': _percentile(s['queue_ms'], 0.95)
+            } for kind, s in self._stats.items()}
+            return {
+                'limits': {'rpm': self.rpm, 'tpm': self.tpm, 'concurrency': self.concurrency},
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'last_minute': {'requests': len(window), 'tokens': sum(entry[1] for entry in window)},
+                'by_kind': kinds
+            }
+
+    # --- 请求 ---
+    @staticmethod
+    def _prompt_text(messages):
+        return "".join(message.get('content') or "" for message in messages)
+
+    def _retry_or_raise(self, kind, error, attempt, queued_at, started, stream):
+        """请求失败后调用: 不可重试或重试次数用完时抛出 LLMUnavailable, 否则等待退避 (或 Retry-After) 后返回"""
+        if not _retryable(error) or attempt >= self.max_retries:
+            self._record(kind, queued_at, started, error=True, retries=attempt)
+            log.warning("LLM request failed", kind=kind, stream=stream, error=error.__class__.__name__,
+                        attempts=attempt + 1)
+            raise LLMUnavailable(f"{kind} request failed after {attempt + 1} attempts: {error}") from error
+        delay = _retry_after(error)
+        log.warning("LLM request failed, retrying", kind=kind, stream=stream, error=error.__class__.__name__,
+                    attempt=attempt + 1, retry_after=delay)
+        if delay:
+            self._pause(delay)
+        else:
+            time.sleep(_backoff(attempt))
+
+    def chat(self, client, kind, messages, priority=BACKGROUND, **kwargs):
+        """调度一次 chat.completions.create 并返回响应; 失败时抛出 LLMUnavailable"""
+        prompt = self._prompt_text(messages)
+        ticket = _Ticket(priority, next(self._seq), estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS)
+        queued_at = time.monotonic()
+        attempt = 0
+        while True:
+            self._acquire(ticket)
+            started = time.monotonic()
+            try:
+                response = client.chat.completions.create(messages=messages, timeout=self.timeout, **kwargs)
+            except Exception as e:
+                self._release(ticket, 0)
+                self._retry_or_raise(kind, e, attempt, queued_at, started, stream=False)
+                attempt += 1
+                ticket = _Ticket(priority, ticket.seq, ticket.tokens) # 保持原来的排队顺序
+                continue
+            content = response.choices[0].message.content if response.choices else None
+            tokens = self._record(kind, queued_at, started, usage=getattr(response, 'usage', None),
+                                  prompt=prompt, completion=content, retries=attempt)
+            self._release(ticket, tokens)
+            return response
+
+    def stream_chat(self, client, kind, messages, priority=INTERACTIVE, **kwargs):
+        """
+        调度一次流式请求, 逐个产出响应块。只在收到第一个块之前重试, 之后的错误直接抛出;
+        占用的并发名额在流结束或调用方关闭生成器时释放。
+        """
+        prompt = self._prompt_text(messages)
+        ticket = _Ticket(priority, next(self._seq), estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS)
+        queued_at = time.monotonic()
+        attempt = 0
+        while True:
+            self._acquire(ticket)
+            started = time.monotonic()
+            try:
+                stream = client.chat.completions.create(messages=messages, timeout=self.timeout, stream=True, **kwargs)
+                iterator = iter(stream)
+                first = next(iterator, None)
+                break
+            except Exception as e:
+                self._release(ticket, 0)
+                self._retry_or_raise(kind, e, attempt, queued_at, started, stream=True)
+                attempt += 1
+                ticket = _Ticket(priority, ticket.seq, ticket.tokens) # 保持原来的排队顺序
+
+        usage, parts, failed = None, [], True
+        try:
+            chunk = first
+            while chunk is not None:
+                usage = getattr(chunk, 'usage', None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+                chunk = next(iterator, None)
+            failed = False
+        except GeneratorExit:
+            failed = False # 调用方提前关闭 (例如客户端断开), 不算作错误
+            raise
+        except Exception as e:
+            # 已经产出了部分内容, 不能重试
+            log.warning("LLM stream failed after the first chunk", kind=kind, error=e.__class__.__name__,
+                        chunks=len(parts))
+            raise
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+            tokens = self._record(kind, queued_at, started, usage=usage, prompt=prompt, completion="".join(parts),
+                                  error=failed, retries=attempt)
+            self._release(ticket, tokens)
+
+
+llm_scheduler = LLMScheduler()
+metrics.registry.gauge('llm_requests_in_flight', 'LLM requests currently being sent.',
+                       collect=lambda: {(): llm_scheduler._active})
+metrics.registry.gauge('llm_requests_waiting', 'LLM requests queued for budget.',
+                       collect=lambda: {(): len(llm_scheduler._waiting)})
@@ -0,0 +1,116 @@
+# logs.py - 结构化日志: 每条日志由事件描述和若干字段组成
+# LOG_FORMAT=json 时每行输出一个 JSON 对象, 便于日志系统检索; 默认输出 "事件 key=value" 形式的文本。
+# 本模块只依赖标准库, 可以在 fulltext 的工作进程中导入。
+import os
+import sys
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# 当前请求或任务的上下文字段 (request_id, job_id), 自动附加到该线程输出的每条日志上
+_context = ContextVar('log_context', default={})
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def _fields(record):
+    return {**_context.get(), **getattr(record, 'fields', {})}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+            **_fields(record)
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S')
+        fields = " ".join(f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+                          for key, value in _fields(record).items())
+        line = f"{timestamp} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += f" {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure():
+    """在根日志器上安装处理器 (只执行一次); 应用已自行配置了日志时不做改动"""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+        root = logging.getLogger()
+        if root.handlers:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+
+
+class StructuredLogger:
+    """log.info("Saved article", entry_id=..., seconds=...): 第一个参数是事件描述, 其余关键字参数作为字段输出"""
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={'fields': fields}, exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name):
+    configure()
+    return StructuredLogger(name)
+
+
+def set_context(**fields):
+    """替换当前线程的上下文字段, 不带参数时清空; 用于请求开始与结束"""
+    _context.set(fields)
+
+
+@contextmanager
+def bind(**fields):
+    """在 with 块内为当前线程输出的日志附加字段"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def error_text(error):
+    return f"{type(error).__name__}: {error}"
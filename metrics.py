@@ -0,0 +1,292 @@
+# metrics.py - 进程内指标 (计数器、直方图、仪表) 与 Prometheus 文本格式导出, 以及按请求的耗时剖析
+# 不依赖 prometheus_client; 指标保存在当前进程中, 多进程部署时每个进程各自导出。
+import os
+import time
+import uuid
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from logs import get_logger, set_context
+
+log = get_logger(__name__)
+
+# 设为 1 后, 客户端在请求头中带上 X-Profile: 1 时, 响应的 Server-Timing 头给出耗时分解;
+# 默认关闭, 以免在生产环境向任意客户端暴露内部耗时
+PROFILE_HEADER_ENABLED = os.getenv("PROFILE_HEADER_ENABLED", "0") == "1"
+# 单个请求的 SQL 语句数超过该值时记录警告, 用于发现 N+1 查询
+SQL_QUERY_WARN_THRESHOLD = int(os.getenv("SQL_QUERY_WARN_THRESHOLD", "50"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """collect 可选: 导出时调用, 返回 {标签值元组: 数值}, 用于读取其他模块的实时状态"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.collect is None:
+            return super()._samples()
+        try:
+            values = self.collect()
+        except Exception as e:
+            log.warning("Gauge collection failed", metric=self.name, error=str(e))
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, {'counts': list(s['counts']), 'sum': s['sum'], 'count': s['count']})
+                           for key, s in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, (('le', _format_value(float(bound))),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, (('le', '+Inf'),))
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency until the response headers are sent.',
+    ('method', 'route', 'status'))
+HTTP_SQL_QUERIES = registry.histogram(
+    'http_request_sql_queries', 'SQL statements executed per HTTP request.', ('route',), COUNT_BUCKETS)
+HTTP_SQL_SECONDS = registry.histogram(
+    'http_request_sql_duration_seconds', 'Time spent in SQL per HTTP request.', ('route',))
+SQL_QUERIES = registry.counter('sql_queries_total', 'SQL statements executed by this process.')
+SQL_SECONDS = registry.counter('sql_duration_seconds_total', 'Time spent executing SQL statements.')
+STAGE_SECONDS = registry.histogram(
+    'ingest_stage_duration_seconds',
+    'Duration of ingestion stages (arxiv_query, pdf_download, source_extraction, fulltext_extraction, db_commit).',
+    ('stage',))
+LLM_REQUEST_SECONDS = registry.histogram(
+    'llm_request_duration_seconds', 'LLM request latency, excluding time spent queued.', ('kind', 'outcome'))
+LLM_QUEUE_SECONDS = registry.histogram(
+    'llm_queue_duration_seconds', 'Time LLM requests waited for rate, token or concurrency budget.', ('kind',))
+LLM_TOKENS = registry.counter('llm_tokens_total', 'LLM tokens used.', ('kind', 'type'))
+LLM_RETRIES = registry.counter('llm_retries_total', 'LLM request retries.', ('kind',))
+JOB_SECONDS = registry.histogram(
+    'job_duration_seconds', 'Background job run time.', ('job_type', 'status'))
+
+
+# --- 按请求的耗时剖析 ---
+class Profile:
+    """一个请求内各部分的累计耗时 (秒) 与 SQL 语句数"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.spans = defaultdict(float)
+
+    def server_timing(self):
+        total = (time.perf_counter() - self.started) * 1000
+        entries = [f"total;dur={total:.1f}", f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_queries} queries"']
+        entries += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()]
+        return ", ".join(entries)
+
+
+_profile = ContextVar('profile', default=None)
+
+
+def add_span(name, seconds):
+    profile = _profile.get()
+    if profile is not None:
+        profile.spans[name] += seconds
+
+
+@contextmanager
+def timed(stage, histogram=STAGE_SECONDS):
+    """记录一个阶段的耗时到直方图; 在请求内调用时同时计入该请求的耗时分解"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, stage=stage)
+        add_span(stage, elapsed)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    SQL_QUERIES.inc()
+    SQL_SECONDS.inc(elapsed)
+    profile = _profile.get()
+    if profile is not None:
+        profile.sql_queries += 1
+        profile.sql_seconds += elapsed
+
+
+class RequestMetrics:
+    """为每个请求记录延迟与 SQL 用量; 请求头带 X-Profile: 1 时在 Server-Timing 响应头中返回耗时分解"""
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def _before_request():
+        from flask import request
+        _profile.set(Profile())
+        set_context(request_id=request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12])
+
+    @staticmethod
+    def _after_request(response):
+        from flask import request
+        profile = _profile.get()
+        if profile is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        elapsed = time.perf_counter() - profile.started
+        HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        HTTP_SQL_QUERIES.observe(profile.sql_queries, route=route)
+        HTTP_SQL_SECONDS.observe(profile.sql_seconds, route=route)
+        if profile.sql_queries > SQL_QUERY_WARN_THRESHOLD:
+            log.warning("Request executed many SQL statements", route=route, queries=profile.sql_queries,
+                        sql_ms=round(profile.sql_seconds * 1000, 1))
+        if PROFILE_HEADER_ENABLED and request.headers.get('X-Profile') == '1':
+            response.headers['Server-Timing'] = profile.server_timing()
+        return response
+
+    @staticmethod
+    def _teardown_request(error=None):
+        # 开发服务器与 gunicorn 的线程会被复用, 请求结束时清除本线程的剖析与日志上下文
+        _profile.set(None)
+        set_context()
+
+
+request_metrics = RequestMetrics()
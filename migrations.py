@@ -0,0 +1,143 @@
+# migrations.py - 基于 PRAGMA user_version 的版本化数据库迁移
+# db.create_all() 只会创建缺失的表, 不会为已有的表补建新声明的索引; 已有数据库的结构变更在这里按版本号依次执行。
+# 新增迁移时版本号递增, 语句需可重复执行 (IF NOT EXISTS), 因为新建的数据库已由 create_all 建好同名索引。
+from sqlalchemy import text
+from database import db
+from logs import get_logger
+
+log = get_logger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+@migration(1, "analysis: 去除重复记录, 唯一索引 (article_id, analysis_type)")
+def _unique_analysis_per_type(conn):
+    # 保留每篇文章每种分析中最新的一条
+    removed = conn.execute(text(
+        "DELETE FROM analysis WHERE id NOT IN (SELECT MAX(id) FROM analysis GROUP BY article_id, analysis_type)"
+    )).rowcount
+    if removed:
+        log.info("Removed duplicate analysis rows", rows=removed)
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_analysis_article_type ON analysis (article_id, analysis_type)"
+    ))
+
+
+@migration(2, "article: 列表与收藏页的排序索引")
+def _article_listing_indexes(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_article_published_id ON article (published, id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_article_favorited_published_id ON article (is_favorited, published, id)"
+    ))
+
+
+@migration(3, "qna_history 与 article_author_association 的外键索引")
+def _foreign_key_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_qna_history_article_created ON qna_history (article_id, created_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_article_author_author_id ON article_author_association (author_id)"
+    ))
+
+
+@migration(4, "keyword: 增量抓取的高水位列")
+def _keyword_high_water_mark(conn):
+    _add_column(conn, 'keyword', 'last_submitted', 'DATETIME')
+    _add_column(conn, 'keyword', 'last_entry_id', 'VARCHAR(100)')
+
+
+@migration(5, "article: PDF 下载状态")
+def _article_pdf_download_state(conn):
+    _add_column(conn, 'article', 'pdf_status', 'VARCHAR(20)')
+    _add_column(conn, 'article', 'pdf_bytes', 'INTEGER')
+    _add_column(conn, 'article', 'pdf_seconds', 'FLOAT')
+    _add_column(conn, 'article', 'pdf_attempts', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'article', 'pdf_error', 'TEXT')
+
+
+@migration(6, "article: LLM 分析状态")
+def _article_analysis_state(conn):
+    _add_column(conn, 'article', 'analysis_status', 'VARCHAR(20)')
+    _add_column(conn, 'article', 'analysis_attempts', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'article', 'analysis_error', 'TEXT')
+
+
+@migration(7, "job: 所属进程与心跳列, 活动任务按 dedupe_key 唯一")
+def _job_ownership(conn):
+    _add_column(conn, 'job', 'owner', 'VARCHAR(100)')
+    _add_column(conn, 'job', 'heartbeat_at', 'DATETIME')
+    # 旧版本在并发提交时可能留下重复的活动任务, 只保留最早的一个
+    cancelled = conn.execute(text(
+        "UPDATE job SET status = 'cancelled' WHERE status IN ('queued', 'running') AND id NOT IN "
+        "(SELECT MIN(id) FROM job WHERE status IN ('queued', 'running') GROUP BY dedupe_key)"
+    )).rowcount
+    if cancelled:
+        log.info("Cancelled duplicate active jobs", rows=cancelled)
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_job_active_dedupe ON job (dedupe_key) "
+        "WHERE status IN ('queued', 'running')"
+    ))
+
+
+@migration(8, "article_fts: 2/3 字符前缀索引")
+def _search_prefix_indexes(conn):
+    # FTS5 表创建后不能修改选项: 建一张带前缀索引的新表, 复制已分词的内容后替换旧表。
+    # 新数据库在此时还没有该表, 由 search_index.ensure_search_schema 直接按新选项创建
+    from search_index import FTS_TABLE, FTS_COLUMNS, create_table_sql
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = :name"), {'name': FTS_TABLE}).scalar()
+    if sql is None or 'prefix=' in sql:
+        return
+    columns = ", ".join(FTS_COLUMNS)
+    conn.execute(text(create_table_sql(f"{FTS_TABLE}_new")))
+    copied = conn.execute(text(
+        f"INSERT INTO {FTS_TABLE}_new (rowid, {columns}) SELECT rowid, {columns} FROM {FTS_TABLE}"
+    )).rowcount
+    conn.execute(text(f"DROP TABLE {FTS_TABLE}"))
+    conn.execute(text(f"ALTER TABLE {FTS_TABLE}_new RENAME TO {FTS_TABLE}"))
+    log.info("Rebuilt search index with prefix indexes", rows=copied)
+
+
+def _add_column(conn, table, column, column_type):
+    # SQLite 的 ADD COLUMN 不支持 IF NOT EXISTS
+    columns = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def upgrade(conn):
+    """在给定连接上执行所有未应用的迁移, 返回已应用的版本号列表"""
+    applied = []
+    version = current_version(conn)
+    for target, description, func in MIGRATIONS:
+        if target <= version:
+            continue
+        log.info("Applying migration", version=target, description=description)
+        func(conn)
+        conn.execute(text(f"PRAGMA user_version = {int(target)}"))
+        applied.append(target)
+    if applied:
+        # 让查询规划器获得新索引的统计信息
+        conn.execute(text("PRAGMA optimize"))
+    return applied
+
+
+def run_migrations():
+    with db.engine.begin() as conn:
+        return upgrade(conn)
@@ -0,0 +1,242 @@
+# mock_llm.py - 离线的 OpenAI 兼容客户端替身, 用于开发与测试 (LLM_BACKEND=mock)
+# MockOpenAIServer 是同样行为的 HTTP 服务, 可以注入限流与服务端错误, 用于测试真实客户端与 llm_scheduler:
+#   python mock_llm.py --port 8766 --failure-rate 0.2 --rpm 30
+#   LLM_BASE_URL=http://127.0.0.1:8766/v1 DEEPSEEK_API_KEY=test python app.py
+import json
+import re
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+MOCK_SUMMARY = {
+    "simplified_summary_zh": "这是一个用于本地开发的模拟摘要。",
+    "keywords_en": ["mock", "testing", "offline"],
+    "innovation_rating": 3
+}
+MOCK_DETAILED = {
+    "background": "模拟的研究背景。",
+    "methodology": "模拟的研究方法。",
+    "key_innovations": ["模拟创新点一", "模拟创新点二"],
+    "potential_impact": "模拟的潜在影响。"
+}
+
+
+def _message(content):
+    return SimpleNamespace(content=content, role="assistant")
+
+
+class _MockCompletions:
+    def __init__(self, latency, token_delay):
+        self.latency = latency
+        self.token_delay = token_delay
+
+    def create(self, model, messages, response_format=None, stream=False, **kwargs):
+        time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        content = self.content(prompt, response_format)
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4,
+                                total_tokens=(len(prompt) + len(content)) // 4)
+        if stream:
+            return self._stream(content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=_message(content), finish_reason="stop")], usage=usage, model=model)
+
+    @classmethod
+    def content(cls, prompt, response_format=None):
+        if response_format and response_format.get("type") == "json_object":
+            return json.dumps(cls._json_response(prompt), ensure_ascii=False)
+        return f"这是针对问题的模拟回答 (prompt {len(prompt)} chars)。"
+
+    @staticmethod
+    def _json_response(prompt):
+        # 根据 prompt 中要求的结构返回对应的 JSON
+        if '"papers"' in prompt:
+            ids = re.findall(r'\[ID: ([^\]]+)\]', prompt)
+            return {"papers": [{"id": i, "summary": MOCK_SUMMARY, "detailed": MOCK_DETAILED} for i in ids]}
+        if '"notes"' in prompt:
+            return {"notes": ["模拟的全文要点一", "模拟的全文要点二"]}
+        if '"summary"' in prompt and '"detailed"' in prompt:
+            return {"summary": MOCK_SUMMARY, "detailed": MOCK_DETAILED}
+        if "simplified_summary_zh" in prompt:
+            return MOCK_SUMMARY
+        return MOCK_DETAILED
+
+    def _stream(self, content):
+        for token in re.findall(r'.{1,4}', content, re.S):
+            time.sleep(self.token_delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")])
+
+
+class MockLLMClient:
+    """只实现本项目用到的 client.chat.completions.create, 支持 json_object 与 stream=True"""
+
+    def __init__(self, latency=0.0, token_delay=0.0):
+        self.chat = SimpleNamespace(completions=_MockCompletions(latency, token_delay))
+
+
+class MockOpenAIServer:
+    """
+    OpenAI 兼容的 POST /v1/chat/completions, 支持 JSON 与 SSE 流式响应以及 usage 字段。
+    rpm 限制每 window 秒 (默认 60) 的请求数, 超出时返回 429 与 Retry-After; failure_rate 为随机返回 500 的比例。
+    requests 记录每个请求的 (时刻, 是否流式, prompt 长度, 状态码), max_concurrent 为观察到的最大并发数。
+    """
+
+    def __init__(self, latency=0.0, token_delay=0.0, failure_rate=0.0, rpm=None, retry_after=1, seed=0, window=60):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.failure_rate = failure_rate
+        self.rpm = rpm
+        self.window = window
+        self.retry_after = retry_after
+        self.requests = []
+        self.max_concurrent = 0
+        self._active = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self, port=0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _admit(self, stream, prompt):
+        """返回应答的状态码: 200、429 或 500"""
+        with self._lock:
+            now = time.monotonic()
+            recent = sum(1 for t, _, _, status in self.requests if status == 200 and t > now - self.window)
+            if self.rpm is not None and recent >= self.rpm:
+                status = 429
+            elif self._random.random() < self.failure_rate:
+                status = 500
+            else:
+                status = 200
+                self._active += 1
+                self.max_concurrent = max(self.max_concurrent, self._active)
+            self.requests.append((now, stream, len(prompt), status))
+            return status
+
+    def _finish(self):
+        with self._lock:
+            self._active -= 1
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_event(self, payload):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                messages = request.get("messages") or [{"content": ""}]
+                prompt = messages[-1].get("content") or ""
+                stream = bool(request.get("stream"))
+                status = mock._admit(stream, prompt)
+                if status == 429:
+                    self._send_json(429, {"error": {"message": "rate limit exceeded", "type": "rate_limit"}},
+                                    {"Retry-After": str(mock.retry_after)})
+                    return
+                if status == 500:
+                    self._send_json(500, {"error": {"message": "injected server error", "type": "server_error"}})
+                    return
+                try:
+                    time.sleep(mock.latency)
+                    self._respond(request, prompt, stream)
+                finally:
+                    mock._finish()
+
+            def _respond(self, request, prompt, stream):
+                model = request.get("model", "mock")
+                content = _MockCompletions.content(prompt, request.get("response_format"))
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                         "total_tokens": (len(prompt) + len(content)) // 4}
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                created = int(time.time())
+                if not stream:
+                    self._send_json(200, {
+                        "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}],
+                        "usage": usage
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def chunk(delta, finish_reason=None):
+                    return json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                       "model": model, "choices": [{"index": 0, "delta": delta,
+                                                                    "finish_reason": finish_reason}]},
+                                      ensure_ascii=False)
+
+                try:
+                    self._send_event(chunk({"role": "assistant", "content": ""}))
+                    for token in re.findall(r'.{1,4}', content, re.S):
+                        time.sleep(mock.token_delay)
+                        self._send_event(chunk({"content": token}))
+                    self._send_event(chunk({}, "stop"))
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        self._send_event(json.dumps({"id": completion_id, "object": "chat.completion.chunk",
+                                                     "created": created, "model": model, "choices": [],
+                                                     "usage": usage}))
+                    self._send_event("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # 客户端提前断开
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rpm', type=int, default=None)
+    args = parser.parse_args()
+    server = MockOpenAIServer(latency=args.latency, token_delay=args.token_delay, failure_rate=args.failure_rate,
+                              rpm=args.rpm)
+    print(f"Mock LLM API listening on {server.start(args.port)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -5,12 +5,16 @@ from datetime import datetime
 # 多對多關係的關聯表
 article_author_association = db.Table('article_author_association',
     db.Column('article_id', db.Integer, db.ForeignKey('article.id'), primary_key=True),
-    db.Column('author_id', db.Integer, db.ForeignKey('author.id'), primary_key=True)
+    db.Column('author_id', db.Integer, db.ForeignKey('author.id'), primary_key=True),
+    db.Index('ix_article_author_author_id', 'author_id')
 )
 
 class Keyword(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     keyword = db.Column(db.String(100), unique=True, nullable=False)
+    # 增量抓取的高水位: 已处理的最新论文的提交时间与 entry_id (见 harvest.py)
+    last_submitted = db.Column(db.DateTime)
+    last_entry_id = db.Column(db.String(100))
 
 class Author(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -29,7 +33,30 @@ class Article(db.Model):
     authors = db.relationship('Author', secondary=article_author_association, back_populates='articles')
     analyses = db.relationship('Analysis', backref='article', lazy=True, cascade="all, delete-orphan")
     qna_history = db.relationship('QnaHistory', backref='article', lazy=True, cascade="all, delete-orphan")
+    # 只读关系: 列表页只需要简易分析, 配合 selectinload 一次取回, 避免逐篇查询
+    summary_analysis = db.relationship(
+        'Analysis',
+        primaryjoin="and_(Article.id == Analysis.article_id, Analysis.analysis_type == 'summary')",
+        uselist=False,
+        viewonly=True
+    )
     is_favorited = db.Column(db.Boolean, default=False, nullable=False)
+    # PDF 下载状态: pending / ok / failed, 旧数据为 NULL (未知); 失败的由 services.retry_failed_downloads 重试
+    pdf_status = db.Column(db.String(20))
+    pdf_bytes = db.Column(db.Integer)
+    pdf_seconds = db.Column(db.Float)
+    pdf_attempts = db.Column(db.Integer, default=0, nullable=False)
+    pdf_error = db.Column(db.Text)
+    # LLM 分析状态: ok / failed, 旧数据为 NULL; 失败的由 services.retry_failed_analyses 重试
+    analysis_status = db.Column(db.String(20))
+    analysis_attempts = db.Column(db.Integer, default=0, nullable=False)
+    analysis_error = db.Column(db.Text)
+
+    # 索引与 migrations.py 中的迁移保持一致: 列表按 (published, id) 倒序键集分页, 收藏页先按 is_favorited 过滤
+    __table_args__ = (
+        db.Index('ix_article_published_id', 'published', 'id'),
+        db.Index('ix_article_favorited_published_id', 'is_favorited', 'published', 'id'),
+    )
 
     
 class Analysis(db.Model):
@@ -39,6 +66,9 @@ class Analysis(db.Model):
     content = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # 每篇文章每种分析只有一条
+    __table_args__ = (db.Index('ix_analysis_article_type', 'article_id', 'analysis_type', unique=True),)
+
 # *** 新增模型 ***: 用於存儲問答記錄
 class QnaHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -47,8 +77,98 @@ class QnaHistory(db.Model):
     answer = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_qna_history_article_created', 'article_id', 'created_at'),)
+
 
 class Setting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(50), unique=True, nullable=False)
-    value = db.Column(db.String(255), nullable=False)
\ No newline at end of file
+    value = db.Column(db.String(255), nullable=False)
+
+class Job(db.Model):
+    """后台任务队列的持久化记录"""
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # 'fetch', 'batch_import', 'regenerate'
+    params = db.Column(db.JSON, default=dict)
+    dedupe_key = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued/running/succeeded/failed/cancelled
+    progress = db.Column(db.JSON, default=dict)  # entry_id -> 单篇论文的状态、错误与各阶段耗时
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # 运行该任务的进程 (coordination.process_id) 与其最近一次心跳; 心跳过期的任务由其他进程重新排队
+    owner = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+
+    # 多个进程同时提交相同的任务时, 由部分唯一索引保证只有一个处于排队或运行状态
+    __table_args__ = (
+        db.Index('ix_job_active_dedupe', 'dedupe_key', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    def to_dict(self):
+        duration = None
+        if self.started_at and self.finished_at:
+            duration = (self.finished_at - self.started_at).total_seconds()
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress or {},
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'owner': self.owner,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration': duration
+        }
+
+
+class Lease(db.Model):
+    """跨进程的租约 (例如调度器的领导者), 持有者须在到期前续约; 见 coordination.py"""
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class PaperClaim(db.Model):
+    """正在导入的论文: 同一 entry_id 同时只由一个流水线处理, 入库或失败后删除, 进程退出留下的认领到期作废"""
+    entry_id = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class CacheInvalidation(db.Model):
+    """响应缓存的失效记录, 各进程据此同步缓存版本; 见 response_cache.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    scopes = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class StorageFolder(db.Model):
+    """SAVE_PATH 下一个文章目录的扫描结果 (见 storage.py); 目录的修改时间未变时下次扫描跳过"""
+    name = db.Column(db.String(255), primary_key=True)  # 相对 SAVE_PATH 的目录名
+    # 不设外键: 文章删除后记录保留到目录被回收为止
+    article_id = db.Column(db.Integer, index=True)
+    files = db.Column(db.Integer, default=0, nullable=False)
+    bytes = db.Column(db.BigInteger, default=0, nullable=False)
+    # 尚未过期的临时文件与 .part 文件数; 大于 0 时下次扫描即使目录未变化也会重新检查
+    pending_files = db.Column(db.Integer, default=0, nullable=False)
+    stamp = db.Column(db.String(100))  # 目录及 images/、images/thumbs/ 的修改时间
+    orphan_since = db.Column(db.DateTime)  # 首次发现没有文章引用的时间
+    scanned_at = db.Column(db.DateTime)
+    seen_at = db.Column(db.DateTime)
+
+
+class StorageFile(db.Model):
+    """文章目录中的一个文件; sha256 只为大小与其他文件相同的文件计算, 用于去重"""
+    path = db.Column(db.String(500), primary_key=True)  # 相对 SAVE_PATH
+    folder = db.Column(db.String(255), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False, index=True)
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+    inode = db.Column(db.BigInteger, nullable=False, index=True)
+    sha256 = db.Column(db.String(64))
@@ -0,0 +1,293 @@
+# pipeline.py - 并发的抓取与分析流水线
+import time
+import itertools
+import queue
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from models import db, Article
+import figures
+import services
+import metrics
+from services import AnalysisService, ArxivService
+from coordination import PaperClaims
+from logs import get_logger
+
+log = get_logger(__name__)
+
+
+class _PaperJob:
+    """一篇论文在流水线中的状态, 所有阶段完成后被放入写入队列"""
+
+    def __init__(self, paper, folder, done_queue, stages, progress=None):
+        self.paper = paper
+        self.folder = folder
+        self.results = {}
+        self.errors = {}
+        self.futures = []
+        self.started = time.monotonic()
+        self.progress = progress
+        self._pending = len(stages)
+        self._lock = threading.Lock()
+        self._done_queue = done_queue
+
+    def track(self, stage, future, extract=None):
+        """extract 用于从多篇论文共享的 future 结果中取出本篇的部分"""
+        self.futures.append(future)
+        future.add_done_callback(lambda f: self._on_stage_done(stage, f, extract))
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
+    def analyses(self):
+        """返回 (summary, detailed), 兼容单独请求与合并请求两种阶段划分"""
+        if 'analysis' in self.results:
+            return self.results['analysis'] or (None, None)
+        return self.results.get('summary'), self.results.get('detailed')
+
+    def analysis_error(self):
+        for stage in ('analysis', 'summary', 'detailed'):
+            if self.errors.get(stage) is not None:
+                return self.errors[stage]
+        return None
+
+    def _on_stage_done(self, stage, future, extract):
+        try:
+            result = future.result()
+            self.results[stage] = extract(result) if extract else result
+        except Exception as e:
+            self.errors[stage] = e
+            self.results[stage] = None
+        if self.progress:
+            elapsed = round(time.monotonic() - self.started, 3)
+            self.progress.paper_update(self.paper.entry_id, timing={stage: elapsed})
+        with self._lock:
+            self._pending -= 1
+            finished = self._pending == 0
+        if finished:
+            self._done_queue.put(self)
+
+
+class IngestionPipeline:
+    """
+    分阶段处理一批 arXiv 论文:
+    PDF 下载、源码图片提取与 LLM 分析在各自有界的线程池中跨论文并行,
+    只有调用线程(持有 app context)写数据库, 已完成的论文按批写入, 每批提交一次。
+    处理前先认领论文 (coordination.PaperClaims), 其他进程或任务正在处理的论文直接跳过。
+    progress 可选, 需提供 paper_update(entry_id, ...) 与 cancelled 属性(见 jobs.JobContext)。
+    """
+
+    def __init__(self, download_workers=None, analysis_workers=None, analysis_mode=None, group_size=None,
+                 figure_workers=None, batch_size=None, analysis_source=None):
+        self.download_workers = download_workers or services.DOWNLOAD_WORKERS
+        self.figure_workers = figure_workers or services.FIGURE_WORKERS
+        self.analysis_workers = analysis_workers or services.ANALYSIS_WORKERS
+        self.analysis_mode = analysis_mode or services.ANALYSIS_MODE
+        self.group_size = group_size or services.ANALYSIS_GROUP_SIZE
+        self.batch_size = batch_size or services.INGEST_BATCH_SIZE
+        self.analysis_source = analysis_source or services.ANALYSIS_SOURCE
+        if self.analysis_source == 'fulltext':
+            analysis_stages = ('analysis',)
+        else:
+            analysis_stages = ('summary', 'detailed') if self.analysis_mode == 'separate' else ('analysis',)
+        self.stages = ('pdf', 'figures') + analysis_stages
+
+    def run(self, papers, progress=None):
+        """papers 为 arxiv.Result 的可迭代对象, 返回新保存的 Article 列表"""
+        claims = PaperClaims()
+        try:
+            return self._process(papers, claims, progress)
+        except BaseException:
+            db.session.rollback()
+            raise
+        finally:
+            # 取消或出错时未写入的论文同样释放, 让其他任务可以立即重新导入
+            claims.release_all()
+
+    def _process(self, papers, claims, progress):
+        done = queue.Queue()
+        saved = []
+        jobs = []
+        group = []
+        written = 0
+        seen = set()
+
+        with ThreadPoolExecutor(self.download_workers, thread_name_prefix='download') as downloader, \
+                ThreadPoolExecutor(self.figure_workers, thread_name_prefix='figures') as extractor, \
+                ThreadPoolExecutor(self.analysis_workers, thread_name_prefix='analysis') as analyzer:
+            # 逐段读取输入, 每段只用一次 IN 查询判断哪些论文已经导入
+            for chunk in _batched(papers, self.batch_size):
+                if progress and progress.cancelled:
+                    break
+                # 先认领再检查是否已导入: 其他流水线总是先入库再释放认领, 因此不会重复处理
+                entry_ids = [paper.entry_id for paper in chunk if paper.entry_id not in seen]
+                claimed = claims.claim(entry_ids)
+                existing = ArxivService.existing_entry_ids(entry_ids)
+                claims.release(claimed & existing)
+                claims.renew()
+                for paper in chunk:
+                    if paper.entry_id in seen or paper.entry_id in existing:
+                        log.info("Skipping existing article", entry_id=paper.entry_id)
+                        if progress:
+                            progress.paper_update(paper.entry_id, state='skipped', title=paper.title)
+                        continue
+                    if paper.entry_id not in claimed:
+                        log.info("Skipping article claimed by another job", entry_id=paper.entry_id)
+                        if progress:
+                            progress.paper_update(paper.entry_id, state='skipped', title=paper.title)
+                        continue
+                    seen.add(paper.entry_id)
+                    if progress:
+                        progress.paper_update(paper.entry_id, state='processing', title=paper.title)
+
+                    folder = ArxivService.paper_folder_path(paper)
+                    job = _PaperJob(paper, folder, done, self.stages, progress)
+                    pdf_future = downloader.submit(ArxivService.download_paper_pdf, paper, folder)
+                    job.track('pdf', pdf_future)
+                    job.track('figures', extractor.submit(figures.extract_paper_figures, paper, folder))
+                    if self.analysis_source == 'fulltext':
+                        # 全文分析要等 PDF 下载完成 (或失败, 此时退回摘要) 后才能开始
+                        pdf_path = ArxivService.pdf_path(folder, paper.title)
+                        pdf_future.add_done_callback(
+                            lambda f, job=job, pdf_path=pdf_path: self._submit_fulltext_analysis(analyzer, job, f, pdf_path)
+                        )
+                    else:
+                        self._submit_analysis(analyzer, job, group)
+                    jobs.append(job)
+
+                    # 边提交边写入已完成的论文
+                    finished = self._drain(done, block=False)
+                    written += len(finished)
+                    self._write_batch(finished, saved, progress)
+                    claims.release(job.paper.entry_id for job in finished)
+
+            self._flush_group(analyzer, group)
+
+            while written < len(jobs):
+                if progress and progress.cancelled:
+                    # 尚未开始的阶段直接取消, 已完成的论文照常写入
+                    for job in jobs:
+                        job.cancel()
+                finished = self._drain(done, block=True)
+                written += len(finished)
+                self._write_batch(finished, saved, progress)
+                claims.release(job.paper.entry_id for job in finished)
+                claims.renew()
+
+        return saved
+
+    def _drain(self, done, block):
+        """取出已完成的论文, 最多 batch_size 篇; block=True 时最多等待 0.5 秒以便检查取消"""
+        finished = []
+        try:
+            if block:
+                finished.append(done.get(timeout=0.5))
+            while len(finished) < self.batch_size:
+                finished.append(done.get_nowait())
+        except queue.Empty:
+            pass
+        return finished
+
+    def _submit_analysis(self, analyzer, job, group):
+        abstract = job.paper.summary
+        if self.analysis_mode == 'separate':
+            job.track('summary', analyzer.submit(AnalysisService.get_summary_analysis, abstract))
+            job.track('detailed', analyzer.submit(AnalysisService.get_detailed_analysis, abstract))
+        elif self.analysis_mode == 'grouped' and len(abstract or '') <= services.GROUPED_ABSTRACT_MAX_CHARS:
+            group.append(job)
+            if len(group) >= self.group_size:
+                self._flush_group(analyzer, group)
+        else:
+            job.track('analysis', analyzer.submit(AnalysisService.get_combined_analysis, abstract))
+
+    @staticmethod
+    def _submit_fulltext_analysis(analyzer, job, pdf_future, pdf_path):
+        if pdf_future.cancelled():
+            future = Future()
+            future.cancel()
+        else:
+            future = analyzer.submit(AnalysisService.analyze_paper, job.paper.summary, pdf_path)
+        job.track('analysis', future)
+
+    @staticmethod
+    def _flush_group(analyzer, group):
+        """把缓冲的若干篇短摘要合并为一次请求, 各篇从共享结果中取出自己的部分"""
+        if not group:
+            return
+        abstracts = {job.paper.entry_id: job.paper.summary for job in group}
+        future = analyzer.submit(AnalysisService.get_grouped_analyses, abstracts)
+        for job in group:
+            job.track('analysis', future, extract=lambda result, entry_id=job.paper.entry_id: result[entry_id])
+        group.clear()
+
+    @classmethod
+    def _write_batch(cls, jobs, saved, progress=None):
+        """一批已完成的论文一次提交; 提交失败时逐篇重试, 只让出错的那篇失败"""
+        ready = []
+        for job in jobs:
+            if isinstance(job.errors.get('pdf'), CancelledError):
+                if progress:
+                    progress.paper_update(job.paper.entry_id, state='cancelled')
+                continue
+            # PDF 下载失败的文章照常入库, 记录为 failed, 由 services.retry_failed_downloads 重试
+            ready.append(job)
+        if not ready:
+            return
+
+        write_started = time.monotonic()
+        stored = []
+        try:
+            # 图片提取失败不影响文章入库
+            articles = ArxivService.save_paper_records([
+                (job.paper, {'local_path': job.folder, 'image_paths': job.results.get('figures') or [],
+                             'pdf': job.results.get('pdf') or _failed_pdf(job.errors.get('pdf'))})
+                for job in ready
+            ], commit=False)
+            articles_by_entry = {article.entry_id: article for article in articles}
+            for job in ready:
+                article = articles_by_entry.get(job.paper.entry_id)
+                if article is None:
+                    # 其他任务已在此期间导入了同一篇论文
+                    if progress:
+                        progress.paper_update(job.paper.entry_id, state='skipped')
+                    continue
+                stored.append((job, article, services.add_analyses(article, *job.analyses(), qna=[],
+                                                                       error=job.analysis_error())))
+            with metrics.timed('db_commit'):
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(ready) > 1:
+                for job in ready:
+                    cls._write_batch([job], saved, progress)
+                return
+            paper = ready[0].paper
+            log.error("Failed to save article", entry_id=paper.entry_id, error=str(e))
+            if progress:
+                progress.paper_update(paper.entry_id, state='failed', error=e)
+            return
+
+        if stored:
+            # 提交会使对象过期, 一次查询重新加载, 避免后续访问属性时逐篇刷新
+            Article.query.filter(Article.id.in_([article.id for _, article, _ in stored])).all()
+        write_elapsed = round(time.monotonic() - write_started, 3)
+        for job, article, analyses in stored:
+            services.update_embeddings(article, analyses)
+            log.info("Saved article", entry_id=article.entry_id, pdf=article.pdf_status,
+                     analysis=article.analysis_status)
+            if progress:
+                progress.paper_update(job.paper.entry_id, state='saved', timing={'write': write_elapsed})
+            saved.append(article)
+
+
+def _failed_pdf(error):
+    return {'pdf_status': 'failed', 'pdf_bytes': None, 'pdf_seconds': None, 'pdf_error': f"{type(error).__name__}: {error}"}
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
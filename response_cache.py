@@ -0,0 +1,252 @@
+# response_cache.py - 只读接口的 JSON 响应缓存与条件请求 (ETag / 304)
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import Response, current_app, request
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from models import Article, Analysis, QnaHistory, CacheInvalidation, Setting
+from logs import get_logger
+
+log = get_logger(__name__)
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+# 其他进程提交的写入最多延迟这么多秒才会使本进程的缓存失效; 0 表示每个请求都检查
+RESPONSE_CACHE_SYNC_SECONDS = float(os.getenv("RESPONSE_CACHE_SYNC_SECONDS", "1"))
+# 失效记录的保留时间, 由调度器的领导者定期清理
+RESPONSE_CACHE_LOG_RETENTION_HOURS = float(os.getenv("RESPONSE_CACHE_LOG_RETENTION_HOURS", "24"))
+EPOCH_SETTING_KEY = 'response_cache_epoch'
+# 文章列表 (最新/收藏): 任何文章的增删、收藏状态或摘要分析变化都会使其失效
+LIBRARY = 'library'
+# 所有缓存项都依赖该范围: 无法确定影响了哪些文章的批量 UPDATE/DELETE 会使全部缓存失效
+EVERYTHING = 'all'
+# 按内容哈希命名的图片及其缩略图 (见 figures.py) 内容永不改变, 可被浏览器长期缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_CONTENT_ADDRESSED_RE = re.compile(r'(^|/)images/(thumbs/)?[0-9a-f]{16}\.(png|jpe?g|gif)$')
+
+
+def article_scope(article_id):
+    return f"article:{article_id}"
+
+
+def is_content_addressed(subpath):
+    return bool(_CONTENT_ADDRESSED_RE.search(subpath))
+
+
+class ResponseCache:
+    """
+    每个失效范围 (scope) 有一个版本号, ETag 由缓存键与相关范围的版本号算出,
+    因此协商缓存 (If-None-Match) 命中时无需查询数据库或序列化。
+    写入事务提交时在同一事务中追加一条 CacheInvalidation 记录, 记录的 id 就是所涉范围的新版本号:
+    本进程在提交后立即生效, 其他进程 (gunicorn 的其他 worker) 最多每 RESPONSE_CACHE_SYNC_SECONDS 秒读取一次新记录。
+    各进程的版本号因此一致, 同一个 ETag 在任何 worker 上都能命中 304。
+    JSON 响应不带 Last-Modified: 它只精确到秒, 同一秒内的第二次写入会让 If-Modified-Since 命中过期的 304;
+    /media 的文件响应仍由 send_from_directory 按文件修改时间给出 Last-Modified。
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, sync_seconds=RESPONSE_CACHE_SYNC_SECONDS):
+        self.max_entries = max_entries
+        self.sync_seconds = sync_seconds
+        self.db = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        # 本进程启动时已有的最大记录 id: 启动前的变化都视为发生在这一版本
+        self._floor = None
+        self._last_seen = None
+        self._next_sync = 0.0
+        # 数据库的随机标识, 数据库重建后记录 id 从头开始, 避免与浏览器中旧的 ETag 冲突
+        self._epoch = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def init_app(self, app, db):
+        self.db = db
+        event.listen(db.session, 'after_flush', self._collect_scopes)
+        event.listen(db.session, 'before_commit', self._record_scopes)
+        event.listen(db.session, 'after_commit', self._on_commit)
+        event.listen(db.session, 'do_orm_execute', self._collect_bulk_scopes)
+
+    def _apply(self, version, scopes):
+        with self._lock:
+            floor = self._floor or 0
+            changed = {scope for scope in scopes if version > self._versions.get(scope, floor)}
+            for scope in changed:
+                self._versions[scope] = version
+            if EVERYTHING in changed:
+                self._entries.clear()
+            for key in [key for key, entry in self._entries.items() if set(entry['scopes']) & changed]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'not_modified': self.not_modified, 'synced_version': self._last_seen}
+
+    # --- 跨进程同步 ---
+    def _load_epoch(self, conn):
+        conn.execute(sqlite_insert(Setting).values(key=EPOCH_SETTING_KEY, value=uuid.uuid4().hex[:8])
+                     .on_conflict_do_nothing(index_elements=['key']))
+        return conn.execute(select(Setting.value).where(Setting.key == EPOCH_SETTING_KEY)).scalar()
+
+    def _sync(self):
+        """读取其他进程提交的失效记录; 同一时刻只有一个线程查询, 其余线程沿用当前版本"""
+        if time.monotonic() < self._next_sync or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time.monotonic() + self.sync_seconds
+            table = CacheInvalidation.__table__
+            # 使用独立的连接, 不影响请求会话中的事务
+            with self.db.engine.begin() as conn:
+                if self._epoch is None:
+                    self._epoch = self._load_epoch(conn)
+                if self._last_seen is None:
+                    self._start_versions(conn.execute(select(func.max(table.c.id))).scalar() or 0)
+                    return
+                rows = conn.execute(select(table.c.id, table.c.scopes)
+                                    .where(table.c.id > self._last_seen).order_by(table.c.id)).all()
+            if rows and rows[0].id > self._last_seen + 1:
+                # 本进程长时间未同步, 中间的记录已被清理, 无法知道哪些范围变化过
+                self._apply(rows[0].id - 1, (EVERYTHING,))
+            for row in rows:
+                self._apply(row.id, row.scopes)
+            if rows:
+                self._last_seen = rows[-1].id
+        except SQLAlchemyError as e:
+            log.warning("Response cache sync failed", error=str(e))
+        finally:
+            self._sync_lock.release()
+
+    def _start_versions(self, floor):
+        # 首次同步之前本进程提交的版本号可能落后于其他进程, 全部从 floor 重新开始
+        with self._lock:
+            self._floor = self._last_seen = floor
+            self._versions = {scope: version for scope, version in self._versions.items() if version > floor}
+            self._entries.clear()
+
+    def prune(self, retention_hours=RESPONSE_CACHE_LOG_RETENTION_HOURS):
+        """删除过期的失效记录, 保留最新一条, 使记录 id 不会被复用"""
+        latest = self.db.session.query(func.max(CacheInvalidation.id)).scalar()
+        if latest is None:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+        removed = CacheInvalidation.query.filter(CacheInvalidation.created_at < cutoff,
+                                                 CacheInvalidation.id < latest).delete()
+        self.db.session.commit()
+        return removed
+
+    def _state(self, key, scopes):
+        self._sync()
+        scopes = (EVERYTHING,) + tuple(scopes)
+        with self._lock:
+            floor = self._floor or 0
+            versions = [self._versions.get(scope, floor) for scope in scopes]
+        raw = f"{self._epoch}|{key!r}|{versions}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def respond(self, key, scopes, build):
+        """返回缓存的 JSON 响应; build() 返回可序列化的数据, 只在缓存未命中时调用"""
+        etag = self._state(key, scopes)
+        if request.if_none_match.contains(etag):
+            with self._lock:
+                self.not_modified += 1
+            return self._finish(Response(status=304), etag)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['etag'] == etag:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                body = entry['body']
+            else:
+                entry = None
+                self.misses += 1
+        if entry is None:
+            # 先取版本号再构建: 构建期间发生的写入只会让缓存内容比 ETag 更新, 不会相反
+            body = current_app.json.response(build()).get_data()
+            with self._lock:
+                self._entries[key] = {'etag': etag, 'body': body, 'scopes': scopes}
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return self._finish(Response(body, mimetype=current_app.json.mimetype), etag)
+
+    @staticmethod
+    def _finish(response, etag):
+        response.set_etag(etag)
+        # 浏览器可以保存响应, 但每次使用前都要带上验证器重新确认
+        response.cache_control.no_cache = True
+        return response
+
+    @staticmethod
+    def _collect_scopes(session, flush_context):
+        scopes = session.info.setdefault('response_cache_scopes', set())
+        for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(instance, Article):
+                scopes.update((LIBRARY, article_scope(instance.id)))
+            elif isinstance(instance, Analysis):
+                # 卡片中包含摘要分析, 详细分析只出现在详情中
+                scopes.add(article_scope(instance.article_id))
+                if instance.analysis_type == 'summary':
+                    scopes.add(LIBRARY)
+            elif isinstance(instance, QnaHistory):
+                scopes.add(article_scope(instance.article_id))
+
+    @staticmethod
+    def _collect_bulk_scopes(orm_execute_state):
+        """批量 INSERT/UPDATE/DELETE 不经过 flush, 按语句作用的模型记录范围"""
+        if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is None or mapper.class_ not in (Article, Analysis, QnaHistory):
+            return
+        scopes = orm_execute_state.session.info.setdefault('response_cache_scopes', set())
+        if orm_execute_state.is_insert and mapper.class_ is Article:
+            # 新文章此前不可能被缓存过详情, 只影响列表
+            scopes.add(LIBRARY)
+        else:
+            scopes.add(EVERYTHING)
+
+    @staticmethod
+    def _record_scopes(session):
+        """在提交的事务中写入失效记录: 写入与记录要么都生效, 要么都不生效"""
+        session.flush()
+        scopes = session.info.get('response_cache_scopes')
+        if not scopes:
+            return
+        result = session.connection().execute(
+            CacheInvalidation.__table__.insert().values(scopes=sorted(scopes), created_at=datetime.utcnow()))
+        session.info['response_cache_version'] = result.inserted_primary_key[0]
+
+    # 回滚的事务留下的范围会在下一次提交时一并失效, 多失效一次是安全的
+    def _on_commit(self, session):
+        scopes = session.info.pop('response_cache_scopes', None)
+        version = session.info.pop('response_cache_version', None)
+        if scopes and version:
+            self._apply(version, scopes)
+
+
+def media_cache_headers(response, subpath):
+    if is_content_addressed(subpath):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+response_cache = ResponseCache()
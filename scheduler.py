@@ -1,22 +1,103 @@
 # scheduler.py
+import os
+import atexit
+import logging
+from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
+from coordination import LeaderElection, prune_expired
+import metrics
+from logs import get_logger
+
+log = get_logger(__name__)
+# 租约每隔几秒续约一次, 不逐次记录 APScheduler 的执行日志
+logging.getLogger('apscheduler.executors.default').setLevel(logging.WARNING)
+
+# 失败 PDF 的重试间隔 (分钟)
+PDF_RETRY_INTERVAL_MINUTES = int(os.getenv("PDF_RETRY_INTERVAL_MINUTES", "60"))
+# 失败 LLM 分析的重试间隔 (分钟)
+ANALYSIS_RETRY_INTERVAL_MINUTES = int(os.getenv("ANALYSIS_RETRY_INTERVAL_MINUTES", "30"))
+# 清理过期租约、论文认领与缓存失效记录的间隔 (分钟)
+MAINTENANCE_INTERVAL_MINUTES = int(os.getenv("MAINTENANCE_INTERVAL_MINUTES", "60"))
+# 文库目录对账、孤立目录回收与去重的间隔 (小时), 增量扫描, 未变化的目录只比较修改时间
+STORAGE_SCAN_INTERVAL_HOURS = float(os.getenv("STORAGE_SCAN_INTERVAL_HOURS", "24"))
+# 设为 0 时本进程不参与调度 (例如只处理网页请求的实例)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+
+# 每个进程都运行调度器, 但只有持有 'scheduler' 租约的进程提交定时任务;
+# 领导者退出后, 其他进程在租约过期后的下一次续约时接管
+leader = LeaderElection('scheduler')
+metrics.registry.gauge('scheduler_leader', 'Whether this process currently holds the scheduler lease.',
+                       collect=lambda: {(): int(leader.is_leader)})
+
 
 def start_scheduler(app):
-    from services import run_fetch_and_process_job # 延遲導入
-    
+    if not SCHEDULER_ENABLED:
+        log.info("Scheduler disabled in this process")
+        return None
     scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(
+        lambda: renew_leadership(app),
+        'interval',
+        seconds=leader.renew_seconds,
+        next_run_time=datetime.now()
+    )
     # 每天早上 7:30 運行
     scheduler.add_job(
-        lambda: run_job_with_context(app), 
-        'cron', 
-        day_of_week='mon-fri', 
-        hour=10, 
+        lambda: run_job_with_context(app),
+        'cron',
+        day_of_week='mon-fri',
+        hour=10,
         minute=15
     )
+    scheduler.add_job(
+        lambda: run_job_with_context(app, 'retry_downloads'),
+        'interval',
+        minutes=PDF_RETRY_INTERVAL_MINUTES
+    )
+    scheduler.add_job(
+        lambda: run_job_with_context(app, 'retry_analyses'),
+        'interval',
+        minutes=ANALYSIS_RETRY_INTERVAL_MINUTES
+    )
+    scheduler.add_job(
+        lambda: run_maintenance(app),
+        'interval',
+        minutes=MAINTENANCE_INTERVAL_MINUTES
+    )
+    scheduler.add_job(
+        lambda: run_job_with_context(app, 'storage_scan'),
+        'interval',
+        hours=STORAGE_SCAN_INTERVAL_HOURS
+    )
     scheduler.start()
+    atexit.register(release_leadership, app, scheduler)
+    return scheduler
 
-def run_job_with_context(app):
+def renew_leadership(app):
     with app.app_context():
-        from services import run_fetch_and_process_job
-        run_fetch_and_process_job()
+        leader.renew()
 
+def release_leadership(app, scheduler):
+    scheduler.shutdown(wait=False)
+    try:
+        with app.app_context():
+            leader.release()
+    except Exception as e:
+        log.warning("Failed to release leadership", error=str(e))
+
+def run_job_with_context(app, job_type='fetch'):
+    if not leader.is_leader:
+        return
+    with app.app_context():
+        from jobs import job_queue # 延遲導入
+        # 通过任务队列提交, 与手动触发的抓取共享去重
+        job_queue.submit(job_type)
+
+def run_maintenance(app):
+    if not leader.is_leader:
+        return
+    with app.app_context():
+        from response_cache import response_cache # 延遲導入
+        removed = prune_expired()
+        removed['cache_invalidations'] = response_cache.prune()
+        log.info("Pruned coordination records", **removed)
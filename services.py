@@ -3,22 +3,65 @@ import os
 import re
 import arxiv
 import json
-import shutil # *** 新增匯入 ***
-from datetime import datetime
+import time
+import itertools
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
 from openai import OpenAI
-from models import db, Keyword, Author, Article, Analysis
+from sqlalchemy import insert, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
+from models import db, Keyword, Author, Article, Analysis, article_author_association
 from dotenv import load_dotenv
-import tarfile
+from llm_cache import llm_cache
+import search_index
+from embeddings import vector_index
+import fulltext
+from fulltext import fulltext_store
+import arxiv_client
+from downloads import pdf_downloader
+from llm_scheduler import llm_scheduler, LLMUnavailable, INTERACTIVE, BACKGROUND, LLM_TIMEOUT
+from harvest import KeywordHarvest
+import metrics
+from logs import get_logger, error_text
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+log = get_logger(__name__)
+
 # --- 配置 ---
 # 从环境变量中读取 API Key，如果找不到则为空字符串
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+LLM_MODEL = "deepseek-chat"
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.deepseek.com/v1")
+# deepseek: 真实 API; mock: 使用 mock_llm 中的离线替身, 便于本地开发和测试
+LLM_BACKEND = os.getenv("LLM_BACKEND", "deepseek")
 SAVE_PATH = "path/to/your/folder"
-MAX_RESULTS = 5
+# 应用创建的文章目录中的标记文件 (内容为 entry_id); 文库维护只会回收带有该标记的孤立目录
+FOLDER_MARKER = ".paper"
 SEARCH_MAX_RESULTS = 20 # 搜索时返回更多结果供选择
+# 导入流水线各阶段的并发度
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+FIGURE_WORKERS = int(os.getenv("FIGURE_WORKERS", "2"))
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+# 分析模式: separate(两次请求) / combined(每篇一次请求) / grouped(多篇短摘要合并为一次请求)
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "combined")
+ANALYSIS_GROUP_SIZE = int(os.getenv("ANALYSIS_GROUP_SIZE", "4"))
+GROUPED_ABSTRACT_MAX_CHARS = 1500 # 超过该长度的摘要单独请求
+# 分析依据: abstract(只用摘要, 按 ANALYSIS_MODE 请求) / fulltext(已下载 PDF 的全文, 取不到时退回摘要)。
+# fulltext 需显式开启: 每篇论文按 map-reduce 分析 (最多约 FULLTEXT_TOKEN_BUDGET 个输入 token、数次请求), 不再使用 ANALYSIS_MODE
+ANALYSIS_SOURCE = os.getenv("ANALYSIS_SOURCE", "abstract")
+# 全文分析: map 阶段全部输入的 token 上限, 以及每次 map 请求的输入上限
+FULLTEXT_TOKEN_BUDGET = int(os.getenv("FULLTEXT_TOKEN_BUDGET", "24000"))
+FULLTEXT_MAP_TOKENS = int(os.getenv("FULLTEXT_MAP_TOKENS", "6000"))
+# 单篇问答从全文中选取的片段的 token 上限
+QNA_EXCERPT_TOKENS = int(os.getenv("QNA_EXCERPT_TOKENS", "3000"))
+# 批量入库: 每批论文的 IN 查询按该大小分段, 避免超出 SQLite 的参数个数上限
+IN_QUERY_CHUNK_SIZE = 500
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50"))
+# PDF 下载失败后由重试任务再次尝试, 累计达到该次数后放弃 (可手动把 pdf_attempts 清零)
+PDF_MAX_ATTEMPTS = int(os.getenv("PDF_MAX_ATTEMPTS", "5"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "5"))
 
 # --- Prompt 设计 ---
 SUMMARY_PROMPT = """
@@ -40,6 +83,65 @@ The JSON object must contain these keys:
 Abstract:
 """
 
+COMBINED_PROMPT = """
+Please analyze the following academic paper abstract and return one JSON object with exactly two keys.
+"summary" must be an object with these keys:
+- "simplified_summary_zh": A summary in simple Chinese, about 300 characters.
+- "keywords_en": An array of 3 to 5 most relevant English keywords.
+- "innovation_rating": A rating from 1 to 5 (integer) on the potential novelty.
+"detailed" must be an object written in simple Chinese with these keys:
+- "background": A brief introduction to the research area and the problem it addresses.
+- "methodology": A description of the methods or techniques used in the paper.
+- "key_innovations": A bullet-point list (array of strings) of the core innovations or contributions.
+- "potential_impact": A discussion on the potential impact or future implications of this research.
+Abstract:
+"""
+
+GROUPED_PROMPT = """
+Below are several academic paper abstracts, each preceded by a line "[ID: <id>]".
+Analyze every paper independently and return one JSON object of the form
+{"papers": [{"id": "<id>", "summary": {...}, "detailed": {...}}, ...]} with one entry per ID.
+"summary" must be an object with these keys:
+- "simplified_summary_zh": A summary in simple Chinese, about 300 characters.
+- "keywords_en": An array of 3 to 5 most relevant English keywords.
+- "innovation_rating": A rating from 1 to 5 (integer) on the potential novelty.
+"detailed" must be an object written in simple Chinese with these keys:
+- "background": A brief introduction to the research area and the problem it addresses.
+- "methodology": A description of the methods or techniques used in the paper.
+- "key_innovations": A bullet-point list (array of strings) of the core innovations or contributions.
+- "potential_impact": A discussion on the potential impact or future implications of this research.
+Abstracts:
+"""
+
+FULLTEXT_MAP_PROMPT = """
+Below are consecutive excerpts from an academic paper, each preceded by its section name in brackets.
+Extract the facts needed to analyze the paper: the problem, the method and its key design choices,
+datasets and experimental setup, main quantitative results, and stated limitations.
+Return one JSON object with a single key "notes": an array of short English strings, at most 12, each one fact.
+Excerpts:
+"""
+
+FULLTEXT_REDUCE_PROMPT = """
+Below are the abstract of an academic paper and notes extracted from its full text.
+Using both, return one JSON object with exactly two keys.
+"summary" must be an object with these keys:
+- "simplified_summary_zh": A summary in simple Chinese, about 300 characters.
+- "keywords_en": An array of 3 to 5 most relevant English keywords.
+- "innovation_rating": A rating from 1 to 5 (integer) on the potential novelty.
+"detailed" must be an object written in simple Chinese with these keys:
+- "background": A brief introduction to the research area and the problem it addresses.
+- "methodology": A description of the methods or techniques used in the paper.
+- "key_innovations": A bullet-point list (array of strings) of the core innovations or contributions.
+- "potential_impact": A discussion on the potential impact or future implications of this research.
+"""
+
+SUMMARY_KEYS = ("simplified_summary_zh", "keywords_en", "innovation_rating")
+DETAILED_KEYS = ("background", "methodology", "key_innovations", "potential_impact")
+
+LIBRARY_QNA_CONTEXT_TEMPLATE = """[{index}] {title} ({published})
+{text}
+"""
+
 QNA_PROMPT_TEMPLATE = """
 Based on the following context, please answer the user's question. Be concise and helpful.
 Context:
@@ -51,50 +153,235 @@ Answer:
 """
 
 class AnalysisService:
-    # 检查 API Key 是否已配置
-    if not DEEPSEEK_API_KEY:
-        raise ValueError("DEEPSEEK_API_KEY not found in .env file. Please configure it.")
-    
-    client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com/v1")
+    if LLM_BACKEND == "mock":
+        from mock_llm import MockLLMClient
+        client = MockLLMClient(token_delay=0.02)
+    else:
+        # 检查 API Key 是否已配置
+        if not DEEPSEEK_API_KEY:
+            raise ValueError("DEEPSEEK_API_KEY not found in .env file. Please configure it.")
+
+        # 重试与限速由 llm_scheduler 统一负责, 关闭 SDK 自带的重试
+        client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=LLM_BASE_URL, max_retries=0, timeout=LLM_TIMEOUT)
 
     @classmethod
-    def _get_json_analysis(cls, prompt_template, abstract):
+    def _request_json(cls, prompt, kind):
+        """经调度器发出 JSON 请求; 返回内容无法解析或不是 JSON 对象时返回 None, 重试用尽时抛出 LLMUnavailable"""
+        response = llm_scheduler.chat(
+            cls.client, kind,
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+            priority=BACKGROUND
+        )
         try:
-            response = cls.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
-                    {"role": "user", "content": prompt_template + abstract}
-                ],
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Error calling LLM API: {e}")
+            result = json.loads(response.choices[0].message.content)
+        except (TypeError, ValueError, IndexError) as e:
+            log.warning("Invalid JSON from LLM API", kind=kind, error=str(e))
+            return None
+        if not isinstance(result, dict):
+            log.warning("Invalid JSON from LLM API", kind=kind, error="not a JSON object")
             return None
+        return result
+
+    @classmethod
+    def _get_json_analysis(cls, prompt_template, abstract, bypass_cache=False, kind="analysis"):
+        cache_key = llm_cache.make_key(LLM_MODEL, prompt_template, abstract)
+        if not bypass_cache:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        result = cls._request_json(prompt_template + abstract, kind)
+        if result is not None:
+            llm_cache.set(cache_key, result, model=LLM_MODEL)
+        return result
+
+    @staticmethod
+    def _valid(content, keys):
+        return isinstance(content, dict) and all(key in content for key in keys)
+
+    @classmethod
+    def _cached_pair(cls, abstract):
+        """两种分析都已缓存时直接返回, 否则返回 None"""
+        summary = llm_cache.get(llm_cache.make_key(LLM_MODEL, SUMMARY_PROMPT, abstract))
+        detailed = llm_cache.get(llm_cache.make_key(LLM_MODEL, DETAILED_PROMPT, abstract)) if summary is not None else None
+        if summary is not None and detailed is not None:
+            return summary, detailed
+        return None
+
+    @classmethod
+    def _store_pair(cls, abstract, summary, detailed):
+        """合并请求的结果按单独请求的键写入缓存, 各模式之间可以互相命中"""
+        llm_cache.set(llm_cache.make_key(LLM_MODEL, SUMMARY_PROMPT, abstract), summary, model=LLM_MODEL)
+        llm_cache.set(llm_cache.make_key(LLM_MODEL, DETAILED_PROMPT, abstract), detailed, model=LLM_MODEL)
 
     @classmethod
-    def get_summary_analysis(cls, abstract):
-        return cls._get_json_analysis(SUMMARY_PROMPT, abstract)
+    def get_combined_analysis(cls, abstract, bypass_cache=False):
+        """一次请求同时获取简易分析与详细分析, 返回 (summary, detailed); 不合格的部分回退到单独请求"""
+        if not bypass_cache:
+            cached = cls._cached_pair(abstract)
+            if cached:
+                return cached
+        result = cls._request_json(COMBINED_PROMPT + abstract, "combined") or {}
+        summary, detailed = result.get("summary"), result.get("detailed")
+        if cls._valid(summary, SUMMARY_KEYS) and cls._valid(detailed, DETAILED_KEYS):
+            cls._store_pair(abstract, summary, detailed)
+            return summary, detailed
+        log.info("Combined analysis response incomplete, falling back to separate requests")
+        if not cls._valid(summary, SUMMARY_KEYS):
+            summary = cls.get_summary_analysis(abstract, bypass_cache)
+        if not cls._valid(detailed, DETAILED_KEYS):
+            detailed = cls.get_detailed_analysis(abstract, bypass_cache)
+        return summary, detailed
 
     @classmethod
-    def get_detailed_analysis(cls, abstract):
-        return cls._get_json_analysis(DETAILED_PROMPT, abstract)
+    def get_grouped_analyses(cls, abstracts, bypass_cache=False):
+        """
+        abstracts 为 {key: abstract}, 多篇摘要合并为一次请求, 返回 {key: (summary, detailed)}。
+        未返回或校验失败的论文逐篇回退到 get_combined_analysis。
+        """
+        results = {}
+        pending = {}
+        for key, abstract in abstracts.items():
+            cached = None if bypass_cache else cls._cached_pair(abstract)
+            if cached:
+                results[key] = cached
+            else:
+                pending[str(len(pending) + 1)] = (key, abstract)
+
+        if len(pending) > 1:
+            prompt = GROUPED_PROMPT + "".join(f"[ID: {short_id}]\n{abstract}\n\n" for short_id, (_, abstract) in pending.items())
+            response = cls._request_json(prompt, "grouped") or {}
+            papers = response.get("papers") if isinstance(response.get("papers"), list) else []
+            for item in papers:
+                if not isinstance(item, dict) or str(item.get("id")) not in pending:
+                    continue
+                summary, detailed = item.get("summary"), item.get("detailed")
+                if cls._valid(summary, SUMMARY_KEYS) and cls._valid(detailed, DETAILED_KEYS):
+                    key, abstract = pending.pop(str(item.get("id")))
+                    cls._store_pair(abstract, summary, detailed)
+                    results[key] = (summary, detailed)
+
+        for key, abstract in pending.values():
+            results[key] = cls.get_combined_analysis(abstract, bypass_cache)
+        return results
+
+    @classmethod
+    def analyze_abstract(cls, abstract, bypass_cache=False):
+        """按 ANALYSIS_MODE 对单篇摘要进行分析, 返回 (summary, detailed)"""
+        if ANALYSIS_MODE == "separate":
+            return cls.get_summary_analysis(abstract, bypass_cache), cls.get_detailed_analysis(abstract, bypass_cache)
+        return cls.get_combined_analysis(abstract, bypass_cache)
+
+    @classmethod
+    def analyze_fulltext(cls, abstract, chunks, bypass_cache=False):
+        """
+        map-reduce 全文分析, 返回 (summary, detailed):
+        按章节优先级选出预算内的片段, 每组片段提取要点 (map), 再把摘要与全部要点合成两种分析 (reduce)。
+        每一步单独缓存; 全文没有产出可用结果时退回摘要分析。
+        """
+        selected = fulltext.select_within_budget(chunks, FULLTEXT_TOKEN_BUDGET)
+        notes = []
+        for group in fulltext.group_by_tokens(selected, FULLTEXT_MAP_TOKENS):
+            result = cls._get_json_analysis(FULLTEXT_MAP_PROMPT, fulltext.format_chunks(group), bypass_cache,
+                                            kind="fulltext_map") or {}
+            notes.extend(note for note in result.get("notes") or [] if isinstance(note, str))
+        if notes:
+            payload = f"Abstract:\n{abstract}\n\nNotes from the full text:\n" + "\n".join(f"- {note}" for note in notes)
+            result = cls._get_json_analysis(FULLTEXT_REDUCE_PROMPT, payload, bypass_cache, kind="fulltext_reduce") or {}
+            summary, detailed = result.get("summary"), result.get("detailed")
+            if cls._valid(summary, SUMMARY_KEYS) and cls._valid(detailed, DETAILED_KEYS):
+                return summary, detailed
+        log.info("Full-text analysis produced no usable result, falling back to the abstract")
+        return cls.analyze_abstract(abstract, bypass_cache)
+
+    @classmethod
+    def analyze_paper(cls, abstract, pdf_path, bypass_cache=False):
+        """按 ANALYSIS_SOURCE 分析单篇论文; 全文在进程池中提取并缓存, PDF 不存在或无法解析时只用摘要"""
+        if ANALYSIS_SOURCE == "fulltext":
+            chunks = fulltext_store.chunks(pdf_path)
+            if chunks:
+                return cls.analyze_fulltext(abstract, chunks, bypass_cache)
+        return cls.analyze_abstract(abstract, bypass_cache)
+
+    @classmethod
+    def get_summary_analysis(cls, abstract, bypass_cache=False):
+        return cls._get_json_analysis(SUMMARY_PROMPT, abstract, bypass_cache, kind="summary")
+
+    @classmethod
+    def get_detailed_analysis(cls, abstract, bypass_cache=False):
+        return cls._get_json_analysis(DETAILED_PROMPT, abstract, bypass_cache, kind="detailed")
     
     @classmethod
-    def ask_question_with_context(cls, question, context):
+    def ask_question_with_context(cls, question, context, bypass_cache=False):
+        prompt = QNA_PROMPT_TEMPLATE.format(context=context, question=question)
+        cache_key = llm_cache.make_key(LLM_MODEL, QNA_PROMPT_TEMPLATE, prompt)
+        if not bypass_cache:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
         try:
-            prompt = QNA_PROMPT_TEMPLATE.format(context=context, question=question)
-            response = cls.client.chat.completions.create(
-                model="deepseek-chat",
+            # 用户正在等待, 排在后台分析之前
+            response = llm_scheduler.chat(
+                cls.client, "qna",
+                model=LLM_MODEL,
                 messages=[
                     {"role": "user", "content": prompt}
-                ]
+                ],
+                priority=INTERACTIVE
             )
-            return response.choices[0].message.content
+            answer = response.choices[0].message.content
         except Exception as e:
-            print(f"Error in Q&A call: {e}")
+            log.error("Q&A call failed", error=error_text(e))
             return "抱歉，我无法处理您的问题。"
+        llm_cache.set(cache_key, answer, model=LLM_MODEL)
+        return answer
+
+    @classmethod
+    def stream_question_with_context(cls, question, context, bypass_cache=False):
+        """
+        逐段产出回答文本; 只有完整结束的回答才写入缓存, 调用方提前关闭时会同时关闭上游连接。
+        请求失败时 (包括已产出部分内容之后) 抛出异常, 由调用方告知客户端回答不完整。
+        """
+        prompt = QNA_PROMPT_TEMPLATE.format(context=context, question=question)
+        cache_key = llm_cache.make_key(LLM_MODEL, QNA_PROMPT_TEMPLATE, prompt)
+        if not bypass_cache:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        # 调度器在收到第一个块之前处理排队与重试, 出错时在迭代中抛出
+        stream = llm_scheduler.stream_chat(
+            cls.client, "qna_stream",
+            model=LLM_MODEL,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            stream_options={"include_usage": True},
+            priority=INTERACTIVE
+        )
+
+        parts = []
+        completed = False
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            completed = True
+        except Exception as e:
+            log.error("Streaming Q&A call failed", error=error_text(e), streamed_parts=len(parts))
+            raise
+        finally:
+            # 客户端断开时 (GeneratorExit) 也会走到这里, 及时关闭上游流以停止生成
+            if not completed and hasattr(stream, "close"):
+                stream.close()
+        if parts:
+            llm_cache.set(cache_key, "".join(parts), model=LLM_MODEL)
 
 class ArxivService:
     @staticmethod
@@ -104,144 +391,405 @@ class ArxivService:
     @staticmethod
     def search_raw(query):
         """只搜索并返回原始结果，不存入数据库"""
-        print(f"Searching arXiv with query: {query}")
+        log.info("Searching arXiv", query=query)
         search = arxiv.Search(query=query, max_results=SEARCH_MAX_RESULTS, sort_by=arxiv.SortCriterion.Relevance)
-        client = arxiv.Client()
-        results = []
-        for r in client.results(search):
-            exists = Article.query.filter_by(entry_id=r.entry_id).first()
-            results.append({
-                "entry_id": r.entry_id,
-                "title": r.title,
-                "summary": r.summary,
-                "authors": [a.name for a in r.authors],
-                "published": r.published.strftime('%Y-%m-%d'),
-                "pdf_url": r.pdf_url,
-                "is_imported": exists is not None
-            })
-        return results
+        papers = list(arxiv_client.client.results(search))
+        existing = ArxivService.existing_entry_ids([r.entry_id for r in papers])
+        return [{
+            "entry_id": r.entry_id,
+            "title": r.title,
+            "summary": r.summary,
+            "authors": [a.name for a in r.authors],
+            "published": r.published.strftime('%Y-%m-%d'),
+            "pdf_url": r.pdf_url,
+            "is_imported": r.entry_id in existing
+        } for r in papers]
 
     @staticmethod
-    def process_and_save_paper(paper):
-        """处理单个 paper 对象并存入数据库，如果已存在则跳过"""
-        if Article.query.filter_by(entry_id=paper.entry_id).first():
-            print(f"Skipping existing article: {paper.title}")
-            return None
+    def existing_entry_ids(entry_ids):
+        """用 IN 查询批量判断哪些 entry_id 已经导入"""
+        existing = set()
+        for chunk in _chunks(list(set(entry_ids)), IN_QUERY_CHUNK_SIZE):
+            existing.update(row[0] for row in db.session.query(Article.entry_id).filter(Article.entry_id.in_(chunk)))
+        return existing
 
-        # 创建或获取作者
-        authors_in_db = []
-        for author_name in [a.name for a in paper.authors]:
-            author = Author.query.filter_by(name=author_name).first()
-            if not author:
-                author = Author(name=author_name)
-                db.session.add(author)
-            authors_in_db.append(author)
-        
-        # 下载文件
+    @staticmethod
+    def paper_folder_path(paper):
         date_str = paper.published.strftime('%Y-%m-%d')
         sanitized_title = ArxivService.sanitize_filename(paper.title)[:80]
-        paper_folder_name = f"{date_str} - {sanitized_title}"
-        paper_folder_path = os.path.join(SAVE_PATH, paper_folder_name)
+        # 加上 arXiv 编号, 同一天发布的同名论文 (或同一论文的不同版本) 不会共用目录
+        short_id = ArxivService.sanitize_filename(paper.get_short_id())
+        paper_folder_path = os.path.join(SAVE_PATH, f"{date_str} - {sanitized_title} - {short_id}")
         os.makedirs(paper_folder_path, exist_ok=True)
-        pdf_filename = f"{sanitized_title}.pdf"
-        try:
-            paper.download_pdf(dirpath=paper_folder_path, filename=pdf_filename)
-        except Exception as e:
-            print(f"Failed to download PDF for {paper.title}: {e}")
+        marker = os.path.join(paper_folder_path, FOLDER_MARKER)
+        if not os.path.exists(marker):
+            with open(marker, 'w', encoding='utf-8') as f:
+                f.write(paper.entry_id)
+        return paper_folder_path
 
-         # *** 新增功能: 提取图片 ***
-        image_paths = []
-        try:
-            source_path = paper.download_source(dirpath=paper_folder_path)
-            images_dir = os.path.join(paper_folder_path, "images")
-            os.makedirs(images_dir, exist_ok=True)
-            
-            with tarfile.open(source_path, 'r:gz') as tar:
-                for member in tar.getmembers():
-                    if member.isfile() and member.name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                        filename = os.path.basename(member.name)
-                        target_path = os.path.join(images_dir, filename)
-                        with tar.extractfile(member) as source, open(target_path, 'wb') as target:
-                            shutil.copyfileobj(source, target)
-                        # 存储相对路径以便前端访问
-                        relative_path  = f"{os.path.basename(paper_folder_path)}/images/{filename}"
-                        image_paths.append(relative_path)
-            os.remove(source_path) # 清理源码压缩包
-        except Exception as e:
-            print(f"Could not download or extract source for images: {e}")
-
-        # 创建文章记录
-        new_article = Article(
-            entry_id=paper.entry_id,
-            title=paper.title,
-            published=paper.published.replace(tzinfo=None),
-            pdf_url=paper.pdf_url,
-            original_summary=paper.summary,
-            local_path=paper_folder_path,
-            authors=authors_in_db,
-            image_paths=image_paths
-        )
-        db.session.add(new_article)
+    @staticmethod
+    def pdf_path(paper_folder_path, title):
+        return os.path.join(paper_folder_path, f"{ArxivService.sanitize_filename(title)[:80]}.pdf")
+
+    @staticmethod
+    def article_pdf_path(article):
+        return ArxivService.pdf_path(article.local_path, article.title) if article.local_path else None
+
+    @staticmethod
+    def download_paper_pdf(paper, paper_folder_path):
+        """只做文件 I/O, 不访问数据库, 可在工作线程中运行; 返回 Article 的 pdf_* 字段"""
+        return download_pdf(paper.pdf_url, ArxivService.pdf_path(paper_folder_path, paper.title))
+
+    @staticmethod
+    def save_paper_records(papers_and_assets, commit=True):
+        """
+        批量创建作者与文章记录, 必须在持有 app context 的线程中调用。
+        语句数与论文篇数和作者人数无关 (IN 查询只按 IN_QUERY_CHUNK_SIZE 分段)。
+        commit=False 时由调用方统一提交。返回新建的 Article 列表 (已存在的跳过)。
+        """
+        existing = ArxivService.existing_entry_ids([paper.entry_id for paper, _ in papers_and_assets])
+        new_items = []
+        for paper, assets in papers_and_assets:
+            if paper.entry_id in existing:
+                log.info("Skipping existing article", entry_id=paper.entry_id)
+                continue
+            existing.add(paper.entry_id)
+            new_items.append((paper, assets, list(dict.fromkeys(a.name for a in paper.authors))))
+        if not new_items:
+            return []
+
+        # 作者、文章和关联各用一条批量 INSERT (executemany), 再用 IN 查询取回 id 和对象
+        author_ids = _resolve_author_ids(name for _, _, names in new_items for name in names)
+        db.session.execute(insert(Article), [{
+            'entry_id': paper.entry_id,
+            'title': paper.title,
+            'published': paper.published.replace(tzinfo=None),
+            'pdf_url': paper.pdf_url,
+            'original_summary': paper.summary,
+            'local_path': assets['local_path'],
+            'image_paths': assets['image_paths'],
+            'pdf_attempts': 1 if assets.get('pdf') else 0,
+            **(assets.get('pdf') or {})
+        } for paper, assets, _ in new_items])
+        entry_ids = [paper.entry_id for paper, _, _ in new_items]
+        article_ids = {}
+        for chunk in _chunks(entry_ids, IN_QUERY_CHUNK_SIZE):
+            article_ids.update(db.session.query(Article.entry_id, Article.id).filter(Article.entry_id.in_(chunk)))
+        associations = [{'article_id': article_ids[paper.entry_id], 'author_id': author_ids[name]}
+                        for paper, _, names in new_items for name in names]
+        if associations:
+            db.session.execute(article_author_association.insert(), associations)
+        loaded = {}
+        for chunk in _chunks(list(article_ids.values()), IN_QUERY_CHUNK_SIZE):
+            loaded.update((article.entry_id, article) for article in
+                          Article.query.options(selectinload(Article.authors)).filter(Article.id.in_(chunk)))
+        new_articles = [loaded[entry_id] for entry_id in entry_ids]
+        if not commit:
+            return new_articles
         db.session.commit()
-        print(f"Saved new article to DB: {new_article.title}")
-        return new_article
-
-def analyze_and_store_article(article):
-    """对单个文章进行 AI 分析并存入数据库"""
-    print(f"Analyzing article: {article.title}")
-    # 获取简易分析
-    summary_json = AnalysisService.get_summary_analysis(article.original_summary)
+        log.info("Saved new articles", count=len(new_articles))
+        return new_articles
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def relevant_excerpts(article, question):
+    """
+    从已缓存的全文中选出与问题最相关的片段 (总长不超过 QNA_EXCERPT_TOKENS), 没有全文时返回空字符串。
+    在请求线程中调用, 因此从不提取 PDF; PDF 存在但全文尚未提取时返回 None, 由调用方决定是否在后台提取。
+    """
+    selected = fulltext_store.select_relevant(ArxivService.article_pdf_path(article), question, QNA_EXCERPT_TOKENS,
+                                              vector_index.embedder, extract=False)
+    return None if selected is None else fulltext.format_chunks(selected)
+
+def extract_fulltext(article):
+    """提取并缓存文章的全文片段 (在任务队列中执行), 返回片段数"""
+    return len(fulltext_store.chunks(ArxivService.article_pdf_path(article)))
+
+def download_pdf(url, path):
+    """下载单个 PDF, 返回 pdf_status / pdf_bytes / pdf_seconds / pdf_error; 失败不抛出, 记为 failed 以便重试"""
+    started = time.monotonic()
+    try:
+        if not url:
+            raise ValueError("article has no PDF URL")
+        with metrics.timed('pdf_download'):
+            result = pdf_downloader.download(url, path)
+    except Exception as e:
+        log.warning("Failed to download PDF", url=url, error=error_text(e))
+        return {'pdf_status': 'failed', 'pdf_bytes': None, 'pdf_seconds': round(time.monotonic() - started, 3),
+                'pdf_error': error_text(e)}
+    if result['resumed_from']:
+        log.info("Resumed PDF download", url=url, offset=result['resumed_from'])
+    return {'pdf_status': 'ok', 'pdf_bytes': result['bytes'], 'pdf_seconds': result['seconds'], 'pdf_error': None}
+
+def retry_failed_downloads(progress=None, limit=None):
+    """
+    重新下载失败、中断 (pending) 和状态未知 (迁移前导入) 的 PDF, 已存在且完整的文件不会重新下载。
+    下载在线程池中并行, 结果按批提交。返回下载成功的篇数。
+    """
+    query = Article.query.filter(
+        or_(Article.pdf_status.is_(None), Article.pdf_status.in_(('failed', 'pending'))),
+        Article.pdf_attempts < PDF_MAX_ATTEMPTS
+    ).order_by(Article.id)
+    if limit:
+        query = query.limit(limit)
+    articles = query.all()
+    if not articles:
+        log.info("No PDF downloads to retry")
+        return 0
+
+    # 先标记为 pending: 进程中途退出时, 下次重试仍会包含这些文章
+    targets = {}
+    for article in articles:
+        article.pdf_status = 'pending'
+        targets[article.id] = (article.entry_id, article.title, article.pdf_url,
+                               ArxivService.pdf_path(article.local_path, article.title))
+    db.session.commit()
+    log.info("Retrying PDF downloads", count=len(targets))
+
+    succeeded = 0
+    with ThreadPoolExecutor(DOWNLOAD_WORKERS, thread_name_prefix='download') as pool:
+        futures = {pool.submit(download_pdf, url, path): article_id
+                   for article_id, (_, _, url, path) in targets.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            if progress and progress.cancelled:
+                for pending in futures:
+                    pending.cancel()
+            try:
+                fields = future.result()
+            except CancelledError:
+                continue # 保持 pending, 下次重试
+            article_id = futures[future]
+            entry_id, title, _, _ = targets[article_id]
+            article = db.session.get(Article, article_id)
+            if article is None:
+                continue
+            for key, value in fields.items():
+                setattr(article, key, value)
+            article.pdf_attempts = (article.pdf_attempts or 0) + 1
+            succeeded += fields['pdf_status'] == 'ok'
+            if progress:
+                state = 'saved' if fields['pdf_status'] == 'ok' else 'failed'
+                progress.paper_update(entry_id, state=state, title=title, error=fields['pdf_error'],
+                                      timing={'pdf': fields['pdf_seconds']})
+            if done % INGEST_BATCH_SIZE == 0:
+                db.session.commit()
+    db.session.commit()
+    log.info("PDF retry finished", downloaded=succeeded, total=len(targets))
+    return succeeded
+
+def download_stats():
+    """按状态统计 PDF 下载情况"""
+    rows = db.session.query(
+        Article.pdf_status, db.func.count(Article.id), db.func.sum(Article.pdf_bytes)
+    ).group_by(Article.pdf_status).all()
+    exhausted = Article.query.filter(Article.pdf_status == 'failed', Article.pdf_attempts >= PDF_MAX_ATTEMPTS).count()
+    return {
+        'by_status': {status or 'unknown': {'articles': count, 'bytes': total or 0} for status, count, total in rows},
+        'failed_exhausted': exhausted,
+        'max_attempts': PDF_MAX_ATTEMPTS
+    }
+
+def _resolve_author_ids(names):
+    """返回 name -> author.id; 已有作者用 IN 查询取回, 缺少的作者一次批量插入 (并发导入时忽略已存在的)"""
+    names = list(dict.fromkeys(names))
+    author_ids = {}
+
+    def load(chunk):
+        author_ids.update(db.session.query(Author.name, Author.id).filter(Author.name.in_(chunk)))
+
+    for chunk in _chunks(names, IN_QUERY_CHUNK_SIZE):
+        load(chunk)
+    missing = [name for name in names if name not in author_ids]
+    if missing:
+        db.session.execute(sqlite_insert(Author).on_conflict_do_nothing(index_elements=['name']),
+                           [{'name': name} for name in missing])
+        for chunk in _chunks(missing, IN_QUERY_CHUNK_SIZE):
+            load(chunk)
+    return author_ids
+
+def add_analyses(article, summary_json, detailed_json, qna=None, error=None):
+    """
+    把分析结果加入会话并更新全文索引, 不提交; 新文章可传 qna=[] 省去查询。返回供向量索引使用的分析内容。
+    两种分析缺少任一种时文章记为 failed, 由 retry_failed_analyses 重试。
+    """
+    analyses = {}
     if summary_json:
-        summary_analysis = Analysis(article_id=article.id, analysis_type='summary', content=summary_json)
-        db.session.add(summary_analysis)
-    
-    # 获取详细分析
-    detailed_json = AnalysisService.get_detailed_analysis(article.original_summary)
+        db.session.add(Analysis(article_id=article.id, analysis_type='summary', content=summary_json))
+        analyses['summary'] = summary_json
     if detailed_json:
-        detailed_analysis = Analysis(article_id=article.id, analysis_type='detailed', content=detailed_json)
-        db.session.add(detailed_analysis)
-    
+        db.session.add(Analysis(article_id=article.id, analysis_type='detailed', content=detailed_json))
+        analyses['detailed'] = detailed_json
+    _set_analysis_status(article, analyses, error)
+    search_index.index_article(article, analyses=analyses, qna=qna)
+    return analyses
+
+def replace_analyses(article, summary_json, detailed_json, error=None):
+    """
+    用新的结果替换已有的分析, 不提交; 只替换得到了新结果的类型, LLM 不可用时已有的分析保持不变。
+    返回替换后的全部分析内容, 供向量索引使用。
+    """
+    current = {analysis.analysis_type: analysis for analysis in Analysis.query.filter_by(article_id=article.id)}
+    for analysis_type, content in (('summary', summary_json), ('detailed', detailed_json)):
+        if not content:
+            continue
+        if analysis_type in current:
+            current[analysis_type].content = content
+        else:
+            current[analysis_type] = Analysis(article_id=article.id, analysis_type=analysis_type, content=content)
+            db.session.add(current[analysis_type])
+    analyses = {analysis_type: analysis.content for analysis_type, analysis in current.items()}
+    _set_analysis_status(article, analyses, error)
+    search_index.index_article(article, analyses=analyses)
+    return analyses
+
+def _set_analysis_status(article, analyses, error):
+    article.analysis_attempts = (article.analysis_attempts or 0) + 1
+    if analyses.get('summary') and analyses.get('detailed'):
+        article.analysis_status, article.analysis_error = 'ok', None
+    else:
+        article.analysis_status = 'failed'
+        article.analysis_error = error_text(error) if error else "LLM returned no usable analysis"
+
+def update_embeddings(article, analyses=None):
+    """在提交之后调用, 向量索引不参与数据库事务"""
+    try:
+        vector_index.add_article(article, analyses)
+    except Exception as e:
+        log.warning("Failed to update embeddings", article_id=article.id, error=error_text(e))
+
+def store_analyses(article, summary_json, detailed_json, error=None):
+    """把已经得到的分析结果写入数据库, 替换已有的同类分析"""
+    analyses = replace_analyses(article, summary_json, detailed_json, error=error)
     db.session.commit()
-    print(f"Finished analysis for: {article.title}")
+    update_embeddings(article, analyses)
+
+def _analyze(abstract, pdf_path, bypass_cache=False):
+    """返回 (summary, detailed, error); LLM 不可用时不抛出, 由调用方记为 failed"""
+    try:
+        return (*AnalysisService.analyze_paper(abstract, pdf_path, bypass_cache), None)
+    except LLMUnavailable as e:
+        log.warning("Analysis failed", error=str(e))
+        return None, None, e
+
+def analyze_and_store_article(article, bypass_cache=False):
+    """对单个文章进行 AI 分析并存入数据库; 返回 LLM 不可用时的异常, 成功时返回 None"""
+    log.info("Analyzing article", article_id=article.id)
+    summary_json, detailed_json, error = _analyze(
+        article.original_summary, ArxivService.article_pdf_path(article), bypass_cache
+    )
+    store_analyses(article, summary_json, detailed_json, error=error)
+    log.info("Finished analysis", article_id=article.id, status=article.analysis_status)
+    return error
+
+def retry_failed_analyses(progress=None, limit=None):
+    """
+    重新分析失败的文章, 以及迁移前导入、缺少分析结果的文章。只替换得到了新结果的分析类型,
+    LLM 仍不可用时已有的分析保持不变。
+    LLM 请求在线程池中并行 (速率由 llm_scheduler 控制), 结果按批提交。返回分析成功的篇数。
+    """
+    missing = or_(~Article.analyses.any(Analysis.analysis_type == 'summary'),
+                  ~Article.analyses.any(Analysis.analysis_type == 'detailed'))
+    query = Article.query.filter(
+        or_(Article.analysis_status == 'failed', db.and_(Article.analysis_status.is_(None), missing)),
+        Article.analysis_attempts < ANALYSIS_MAX_ATTEMPTS
+    ).order_by(Article.id)
+    if limit:
+        query = query.limit(limit)
+    targets = {article.id: (article.entry_id, article.title, article.original_summary,
+                            ArxivService.article_pdf_path(article)) for article in query.all()}
+    if not targets:
+        log.info("No analyses to retry")
+        return 0
+    log.info("Retrying analyses", count=len(targets))
 
-def regenerate_analysis_for_article(article):
-    """删除现有分析并重新生成"""
-    # 刪除舊的分析
-    Analysis.query.filter_by(article_id=article.id).delete()
+    succeeded = 0
+    pending_embeddings = []
+    with ThreadPoolExecutor(ANALYSIS_WORKERS, thread_name_prefix='analysis') as pool:
+        futures = {pool.submit(_analyze, abstract, pdf_path): article_id
+                   for article_id, (_, _, abstract, pdf_path) in targets.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            if progress and progress.cancelled:
+                for pending in futures:
+                    pending.cancel()
+            try:
+                summary_json, detailed_json, error = future.result()
+            except CancelledError:
+                continue
+            article = db.session.get(Article, futures[future])
+            if article is None:
+                continue
+            analyses = replace_analyses(article, summary_json, detailed_json, error=error)
+            pending_embeddings.append((article, analyses))
+            succeeded += article.analysis_status == 'ok'
+            if progress:
+                entry_id, title, _, _ = targets[article.id]
+                progress.paper_update(entry_id, state='saved' if article.analysis_status == 'ok' else 'failed',
+                                      title=title, error=article.analysis_error)
+            if done % INGEST_BATCH_SIZE == 0:
+                db.session.commit()
+                for item in pending_embeddings:
+                    update_embeddings(*item)
+                pending_embeddings.clear()
     db.session.commit()
-    print(f"Deleted existing analyses for article: {article.title}")
-    # 重新分析
-    analyze_and_store_article(article)
+    for item in pending_embeddings:
+        update_embeddings(*item)
+    log.info("Analysis retry finished", analyzed=succeeded, total=len(targets))
+    return succeeded
 
-def run_fetch_and_process_job():
-    print("Running scheduled job: Fetching and processing papers...")
-    keywords = [k.keyword for k in Keyword.query.all()]
+def analysis_stats():
+    """按状态统计 LLM 分析情况"""
+    rows = db.session.query(Article.analysis_status, db.func.count(Article.id)).group_by(Article.analysis_status).all()
+    exhausted = Article.query.filter(Article.analysis_status == 'failed',
+                                     Article.analysis_attempts >= ANALYSIS_MAX_ATTEMPTS).count()
+    return {
+        'by_status': {status or 'unknown': count for status, count in rows},
+        'failed_exhausted': exhausted,
+        'max_attempts': ANALYSIS_MAX_ATTEMPTS
+    }
+
+def regenerate_analysis_for_article(article, force=False):
+    """重新生成分析并替换现有结果, 生成失败的类型保留原有分析; force=True 时跳过 LLM 缓存, 强制请求新的结果"""
+    error = analyze_and_store_article(article, bypass_cache=force)
+    if error:
+        # 原有分析没有被覆盖, 但这次重新生成没有完成, 任务应记为失败
+        raise error
+
+def run_fetch_and_process_job(progress=None):
+    """按关键词增量抓取上次以来提交的全部论文, 流水线完整跑完 (未取消) 后才推进各关键词的高水位"""
+    log.info("Fetching and processing papers")
+    keywords = Keyword.query.all()
     if not keywords:
-        print("No keywords configured. Skipping fetch.")
+        log.info("No keywords configured, skipping fetch")
         return
-    
-    search_query = " OR ".join(f'all:"{kw}"' for kw in keywords)
-    search = arxiv.Search(query=search_query, max_results=MAX_RESULTS, sort_by=arxiv.SortCriterion.SubmittedDate)
-    client = arxiv.Client()
-    
-    for paper in client.results(search):
-        article_in_db = ArxivService.process_and_save_paper(paper)
-        if article_in_db:
-            analyze_and_store_article(article_in_db)
-    print("Job finished.")
-
-def batch_import_and_process(entry_ids):
-    print(f"Starting batch import for {len(entry_ids)} articles.")
+
+    harvests = [KeywordHarvest(keyword) for keyword in keywords]
+    from pipeline import IngestionPipeline # 延遲導入
+    IngestionPipeline().run(itertools.chain.from_iterable(h.papers() for h in harvests), progress=progress)
+    if progress and progress.cancelled:
+        log.info("Fetch cancelled, high-water marks unchanged")
+        return
+    # 只把已入库 (本次新增或早已导入) 的论文计入高水位, 入库失败或被其他任务认领的论文下次重新查询
+    stored = ArxivService.existing_entry_ids([entry_id for harvest in harvests for entry_id in harvest.entry_ids])
+    for harvest in harvests:
+        harvest.save_mark(stored)
+        log.info("Keyword harvested", keyword=harvest.keyword, papers=harvest.fetched, unstored=harvest.unstored,
+                 since=f"{harvest.since:%Y-%m-%d %H:%M}")
+    db.session.commit()
+    log.info("Fetch finished")
+
+def batch_import_and_process(entry_ids, progress=None):
+    log.info("Starting batch import", count=len(entry_ids))
     # *** 再次修復 ***: 提取 /abs/ 後面的所有部分作為完整 ID
     # 這樣可以同時處理 'astro-ph/0004127v2' 和 '2401.12345' 這類格式
     paper_ids = [eid.split('/abs/')[-1] for eid in entry_ids if '/abs/' in eid]
     
-    client = arxiv.Client()
-    # 使用清理過的 paper_ids 進行搜索
-    search = arxiv.Search(id_list=paper_ids)
-    
-    for paper in client.results(search):
-        article_in_db = ArxivService.process_and_save_paper(paper)
-        if article_in_db:
-            analyze_and_store_article(article_in_db)
-    print("Batch import finished.")
\ No newline at end of file
+    # 使用清理過的 paper_ids 進行搜索; 按页大小分段, 避免 URL 过长 (Search 默认最多只返回 100 条)
+    searches = [arxiv.Search(id_list=chunk, max_results=len(chunk))
+                for chunk in _chunks(paper_ids, arxiv_client.ARXIV_PAGE_SIZE)]
+
+    from pipeline import IngestionPipeline # 延遲導入
+    IngestionPipeline().run(itertools.chain.from_iterable(arxiv_client.client.results(s) for s in searches),
+                            progress=progress)
+    log.info("Batch import finished")
\ No newline at end of file
@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentView = 'home';
     let currentArticleId = null;
     let currentTab = 'summary';
+    let nextCursor = null; // 列表分页游标
     const API_BASE_URL = 'http://127.0.0.1:5006';
 
     // --- DOM Element Cache ---
@@ -25,8 +26,9 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     const api = {
-        getLatest: () => fetchApi(`${API_BASE_URL}/api/articles/latest`),
-        getFavorites: () => fetchApi(`${API_BASE_URL}/api/articles/favorites`),
+        getLatest: (cursor) => fetchApi(`${API_BASE_URL}/api/articles/latest${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''}`),
+        getFavorites: (cursor) => fetchApi(`${API_BASE_URL}/api/articles/favorites${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''}`),
+        getRelated: (id) => fetchApi(`${API_BASE_URL}/api/articles/${id}/related`),
         getArticleDetails: (id) => fetchApi(`${API_BASE_URL}/api/articles/${id}`),
         toggleFavorite: (id) => fetchApi(`${API_BASE_URL}/api/articles/${id}/favorite`, { method: 'POST' }),
         postQuestion: (id, question) => fetchApi(`${API_BASE_URL}/api/articles/${id}/ask`, { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({question}) }),
@@ -34,9 +36,11 @@ document.addEventListener('DOMContentLoaded', () => {
         getKeywords: () => fetchApi(`${API_BASE_URL}/api/keywords`),
         addKeyword: (keyword) => fetchApi(`${API_BASE_URL}/api/keywords`, { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({keyword}) }),
         deleteKeyword: (keyword) => fetchApi(`${API_BASE_URL}/api/keywords/${keyword}`, { method: 'DELETE' }),
+        searchLibrary: (query) => fetchApi(`${API_BASE_URL}/api/library/search?query=${encodeURIComponent(query)}`),
         searchArticles: (query) => fetchApi(`${API_BASE_URL}/api/articles/search?query=${encodeURIComponent(query)}`),
         batchImport: (entry_ids) => fetchApi(`${API_BASE_URL}/api/articles/batch-import`, { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({entry_ids}) }),
         fetchOnDemand: () => fetchApi(`${API_BASE_URL}/api/articles/fetch`, { method: 'POST' }),
+        getJob: (id) => fetchApi(`${API_BASE_URL}/api/jobs/${id}`),
         getSettings: () => fetchApi(`${API_BASE_URL}/api/settings`),
         saveSettings: (settings) => fetchApi(`${API_BASE_URL}/api/settings`, { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(settings) }),
     };
@@ -69,10 +73,27 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // 轮询后台任务直到结束
+    async function waitForJob(jobId, onProgress) {
+        while (true) {
+            const job = await api.getJob(jobId);
+            if (onProgress) onProgress(job);
+            if (!['queued', 'running'].includes(job.status)) return job;
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+    }
+    const describeJobProgress = (job) => {
+        const papers = Object.values(job.progress || {});
+        const finished = papers.filter(p => ['saved', 'skipped', 'failed', 'cancelled'].includes(p.state)).length;
+        return papers.length ? `(${finished}/${papers.length})` : '';
+    };
+
     // --- Render Functions ---
     const renderers = {
         home: async () => {
-            const articles = await api.getLatest();
+            const page = await api.getLatest();
+            const articles = page.articles;
+            nextCursor = page.next_cursor;
             mainContentEl.innerHTML = `
                 <header class="flex justify-between items-center mb-6">
                     <h1 class="text-3xl font-bold text-slate-100">最新论文速递</h1>
@@ -83,10 +104,13 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div id="article-list-container" class="space-y-4">
                     ${articles.map(createArticleCard).join('') || '<p class="text-slate-500">暂无最新文章。请先在“设置”中添加关键词，然后点击右上角按钮抓取。</p>'}
                 </div>
+                ${createLoadMoreButton()}
             `;
         },
         favorites: async () => {
-            const articles = await api.getFavorites();
+            const page = await api.getFavorites();
+            const articles = page.articles;
+            nextCursor = page.next_cursor;
             mainContentEl.innerHTML = `
                 <header class="flex justify-between items-center mb-6">
                     <h1 class="text-3xl font-bold text-slate-100">我的收藏</h1>
@@ -95,6 +119,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div id="article-list-container" class="space-y-4">
                     ${articles.map(createArticleCard).join('') || '<p class="text-slate-500">您还没有收藏任何文章。</p>'}
                 </div>
+                ${createLoadMoreButton()}
             `;
         },
         search: async () => {
@@ -106,6 +131,11 @@ document.addEventListener('DOMContentLoaded', () => {
                     <input type="search" id="search-input" placeholder="输入关键词搜索 arXiv 上的文章..." class="w-full bg-slate-900 border border-slate-700 rounded-md p-3 pl-10 focus:outline-none focus:ring-2 focus:ring-sky-500">
                     <svg class="absolute left-3 top-1/2 -translate-y-1/2 w-5 h-5 text-slate-400" xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="11" cy="11" r="8"/><path d="m21 21-4.3-4.3"/></svg>
                 </div>
+                <div class="relative max-w-2xl mt-4">
+                    <input type="search" id="library-search-input" placeholder="在已导入的文章中搜索..." class="w-full bg-slate-900 border border-slate-700 rounded-md p-3 pl-10 focus:outline-none focus:ring-2 focus:ring-sky-500">
+                    <svg class="absolute left-3 top-1/2 -translate-y-1/2 w-5 h-5 text-slate-400" xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="11" cy="11" r="8"/><path d="m21 21-4.3-4.3"/></svg>
+                </div>
+                <div id="article-list-container" class="space-y-4 mt-6"></div>
             `;
         },
         detail: async (id) => {
@@ -126,6 +156,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         <button data-tab="detailed" class="tab-item py-3 px-1 border-b-2 font-medium text-sm text-slate-400 border-transparent">深度解析</button>
                         <button data-tab="images" class="tab-item py-3 px-1 border-b-2 font-medium text-sm text-slate-400 border-transparent">插图</button>
                         <button data-tab="qna" class="tab-item py-3 px-1 border-b-2 font-medium text-sm text-slate-400 border-transparent">论文问答</button>
+                        <button data-tab="related" class="tab-item py-3 px-1 border-b-2 font-medium text-sm text-slate-400 border-transparent">相关论文</button>
                     </nav>
                 </div>
                 <div id="detail-tab-content"></div>
@@ -140,8 +171,9 @@ document.addEventListener('DOMContentLoaded', () => {
         return `
             <div class="article-card bg-slate-900 border border-slate-800 rounded-lg p-4 flex justify-between items-start transition hover:border-slate-700 cursor-pointer" data-id="${article.id}">
                 <div class="flex-grow pointer-events-none pr-4">
-                    <h3 class="font-semibold text-slate-200">${article.title}</h3>
+                    <h3 class="font-semibold text-slate-200">${article.title_highlight || article.title}</h3>
                     <p class="text-sm text-slate-400 mt-1">${article.authors.join(', ')}</p>
+                    ${article.snippet ? `<p class="text-sm text-slate-500 mt-2">${article.snippet}</p>` : ''}
                 </div>
                 <button class="favorite-btn flex-shrink-0 ml-4 p-2 rounded-full hover:bg-slate-800" data-id="${article.id}" title="收藏">
                     <svg class="${isFavorited ? 'text-yellow-400 fill-current' : 'text-slate-500'}" xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polygon points="12 2 15.09 8.26 22 9.27 17 14.14 18.18 21.02 12 17.77 5.82 21.02 7 14.14 2 9.27 8.91 8.26 12 2"/></svg>
@@ -150,6 +182,11 @@ document.addEventListener('DOMContentLoaded', () => {
         `;
     }
 
+    function createLoadMoreButton() {
+        if (!nextCursor) return '';
+        return `<div class="mt-6 text-center"><button id="load-more-btn" class="text-slate-400 hover:text-sky-400 text-sm px-4 py-2 border border-slate-700 rounded-md">加载更多</button></div>`;
+    }
+
     function renderDetailTabContent(article) {
         document.querySelectorAll('.tab-item').forEach(t => t.classList.toggle('active', t.dataset.tab === currentTab));
         const contentEl = document.getElementById('detail-tab-content');
@@ -183,7 +220,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 html = `<div class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
                     ${imagePaths.map(path => `
                         <div class="bg-slate-900 border border-slate-800 rounded-lg p-2">
-                            <img src="${API_BASE_URL}/media/${path}" alt="Article illustration" class="w-full h-auto rounded-md">
+                            <a href="${API_BASE_URL}/media/${path}" target="_blank" rel="noopener"><img src="${API_BASE_URL}/media/thumbs/${path}" alt="Article illustration" loading="lazy" class="w-full h-auto rounded-md"></a>
                         </div>
                     `).join('')}
                 </div>`;
@@ -192,6 +229,12 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         } else if (currentTab === 'qna') {
             html = `<div id="qna-history" class="mb-4 space-y-4">${qnaHistory.map(q => `<div class="text-right"><span class="bg-sky-600 text-white p-2 rounded-lg inline-block">${q.question}</span></div><div><span class="bg-slate-700 text-slate-200 p-2 rounded-lg inline-block">${q.answer}</span></div>`).join('')}</div><div class="flex"><input type="text" id="qna-input" placeholder="针对这篇文章提问..." class="flex-grow bg-slate-900 border border-slate-600 rounded-l-md p-2 focus:outline-none focus:ring-2 focus:ring-sky-500"><button id="qna-submit-btn" class="bg-sky-600 text-white font-semibold px-4 rounded-r-md hover:bg-sky-500">发送</button></div>`;
+        } else if (currentTab === 'related') {
+            html = '<p class="text-slate-500">加载中...</p>';
+            api.getRelated(article.id).then(related => {
+                if (currentTab !== 'related') return;
+                contentEl.innerHTML = `<div class="space-y-4">${related.map(createArticleCard).join('') || '<p class="text-slate-500">暂无相关论文。</p>'}</div>`;
+            });
         }
         contentEl.innerHTML = html;
         renderMathInElement(contentEl);
@@ -237,11 +280,24 @@ document.addEventListener('DOMContentLoaded', () => {
         await renderers[view]();
     }
 
+    async function handleLoadMore(button) {
+        button.disabled = true;
+        const page = currentView === 'favorites' ? await api.getFavorites(nextCursor) : await api.getLatest(nextCursor);
+        nextCursor = page.next_cursor;
+        document.getElementById('article-list-container').insertAdjacentHTML('beforeend', page.articles.map(createArticleCard).join(''));
+        if (nextCursor) {
+            button.disabled = false;
+        } else {
+            button.parentElement.remove();
+        }
+    }
+
     async function handleFetchNow() {
         showLoading('已开始在后台获取最新文章...');
-        await api.fetchOnDemand();
+        const { job_id } = await api.fetchOnDemand();
+        const job = await waitForJob(job_id, (j) => showLoading(`已开始在后台获取最新文章... ${describeJobProgress(j)}`));
         hideLoading();
-        showToast('获取完成！正在刷新列表...');
+        showToast(job.status === 'succeeded' ? '获取完成！正在刷新列表...' : `任务结束: ${job.status}`);
         await navigate(currentView);
     }
     
@@ -279,6 +335,14 @@ document.addEventListener('DOMContentLoaded', () => {
         renderSearchResults(results);
     }
 
+    async function handleLibrarySearch(query) {
+        if (!query) return;
+        const container = document.getElementById('article-list-container');
+        container.innerHTML = '<p class="text-slate-500">正在搜索...</p>';
+        const page = await api.searchLibrary(query);
+        container.innerHTML = page.results.map(createArticleCard).join('') || '<p class="text-slate-500">文库中没有匹配的文章。</p>';
+    }
+
     async function handleBatchImport() {
         const selectedIds = Array.from(searchResultsModal.querySelectorAll('input[type="checkbox"]:checked')).map(cb => cb.dataset.id);
         if (selectedIds.length === 0) return;
@@ -288,14 +352,15 @@ document.addEventListener('DOMContentLoaded', () => {
         batchImportBtn.textContent = '正在导入...';
         
         showLoading(`正在导入 ${selectedIds.length} 篇文章...`);
-        await api.batchImport(selectedIds);
+        const { job_id } = await api.batchImport(selectedIds);
+        const job = await waitForJob(job_id, (j) => showLoading(`正在导入 ${selectedIds.length} 篇文章... ${describeJobProgress(j)}`));
         hideLoading();
         
         searchResultsModal.classList.add('hidden');
         batchImportBtn.disabled = false;
         batchImportBtn.textContent = '导入并分析';
         
-        showToast('导入成功！');
+        showToast(job.status === 'succeeded' ? '导入成功！' : `导入任务结束: ${job.status}`);
         await navigate('home');
     }
 
@@ -306,13 +371,70 @@ document.addEventListener('DOMContentLoaded', () => {
         
         const historyEl = document.getElementById('qna-history');
         historyEl.innerHTML += `<div class="text-right"><span class="bg-sky-600 text-white p-2 rounded-lg inline-block">${question}</span></div>`;
+        historyEl.insertAdjacentHTML('beforeend', '<div><span class="qna-streaming bg-slate-700 text-slate-200 p-2 rounded-lg inline-block whitespace-pre-wrap"></span></div>');
+        const answerEl = historyEl.querySelector('.qna-streaming:last-of-type');
         input.value = '';
         input.disabled = true;
-        
-        await api.postQuestion(currentArticleId, question);
+
+        try {
+            await streamQuestion(currentArticleId, question, (token) => { answerEl.textContent += token; });
+        } catch (error) {
+            if (!error.streamUnavailable) {
+                // 服务器已开始回答后失败: 不再重复调用 LLM, 回答也不会被保存
+                console.error('Streaming Q&A failed:', error);
+                answerEl.insertAdjacentHTML('beforeend', '<div class="text-red-400 text-sm mt-1">回答未能完成，本次问答未保存。</div>');
+                input.disabled = false;
+                return;
+            }
+            console.warn('Streaming Q&A unavailable, falling back:', error);
+            await api.postQuestion(currentArticleId, question);
+        }
         const article = await api.getArticleDetails(currentArticleId);
         renderDetailTabContent(article);
     }
+
+    // 流式接口不可用 (网络错误或收到任何事件之前的非 2xx 响应) 时, 调用方可以改用普通接口
+    function streamUnavailable(message) {
+        const error = new Error(message);
+        error.streamUnavailable = true;
+        return error;
+    }
+
+    // 通过 SSE 逐段接收回答 (EventSource 不支持 POST, 因此用 fetch 读取流)
+    async function streamQuestion(id, question, onToken) {
+        let response;
+        try {
+            response = await fetch(`${API_BASE_URL}/api/articles/${id}/ask/stream`, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
+                body: JSON.stringify({question})
+            });
+        } catch (error) {
+            throw streamUnavailable(error.message);
+        }
+        if (!response.ok || !response.body) throw streamUnavailable(`HTTP error! status: ${response.status}`);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            for (const raw of events) {
+                const event = (raw.match(/^event: (.*)$/m) || [])[1];
+                const data = (raw.match(/^data: (.*)$/m) || [])[1];
+                if (!data) continue;
+                const payload = JSON.parse(data);
+                if (event === 'token') onToken(payload.token);
+                if (event === 'done') return payload.answer;
+                if (event === 'error') throw new Error(payload.error);
+            }
+        }
+        throw new Error('Stream ended before completion');
+    }
     
     async function handleSaveSettings() {
         const settings = {
@@ -371,9 +493,12 @@ document.addEventListener('DOMContentLoaded', () => {
             const backBtn = e.target.closest('#back-btn');
             const fetchNowBtn = e.target.closest('#fetch-now-btn');
             const deleteBtn = e.target.closest('#delete-article-btn'); // *** 新增 ***
+            const loadMoreBtn = e.target.closest('#load-more-btn');
 
             if (deleteBtn) { // *** 新增 ***
                 handleArticleDelete(deleteBtn.dataset.id);
+            } else if (loadMoreBtn) {
+                handleLoadMore(loadMoreBtn);
             } else if (fetchNowBtn) {
                 handleFetchNow();
             } else if (favoriteButton) {
@@ -394,6 +519,9 @@ document.addEventListener('DOMContentLoaded', () => {
             if (e.target.id === 'search-input' && e.key === 'Enter') {
                 handleSearch(e.target.value);
             }
+            if (e.target.id === 'library-search-input' && e.key === 'Enter') {
+                handleLibrarySearch(e.target.value.trim());
+            }
             if (e.target.id === 'qna-input' && e.key === 'Enter') {
                 handleQnaSubmit();
             }
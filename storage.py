@@ -0,0 +1,489 @@
+# storage.py - SAVE_PATH 文库目录的维护: 与数据库对账、回收孤立目录、清理中断写入的残留、按内容硬链接去重、统计磁盘占用
+#
+# 扫描逐个读取顶层目录 (os.scandir, 不构建完整的文件列表), 每 STORAGE_BATCH_SIZE 个目录查询一次数据库,
+# 目录内的遍历、清理与哈希在线程池中并行。每个目录记录其自身及 images/、images/thumbs/ 的修改时间,
+# 未变化的目录下次扫描直接跳过, 因此在数百 GB 的文库上也可以定期增量运行。
+#
+# 硬链接去重的前提是文库中的文件只会被整体替换 (os.replace), 不会被原地修改:
+# downloads.py、figures.py 与本模块都遵守这一点, 因此共享同一个 inode 的文件不会互相影响。
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import itertools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+import services
+from models import db, Article, StorageFolder, StorageFile
+from coordination import PaperClaims
+from downloads import PARTIAL_SUFFIX
+from fulltext import fulltext_store
+from logs import get_logger
+
+log = get_logger(__name__)
+
+STORAGE_SCAN_WORKERS = int(os.getenv("STORAGE_SCAN_WORKERS", "4"))
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", "200"))
+# 设为 1 时定期扫描删除孤立目录 (没有文章引用、且带有 services.FOLDER_MARKER 标记的目录); 默认只统计。
+# 删除文章时对其目录的回收 (storage_gc 任务) 不受此开关影响
+STORAGE_ORPHAN_GC = os.getenv("STORAGE_ORPHAN_GC", "0") == "1"
+# 没有文章引用的目录超过该时长 (且期间没有新的写入) 才回收: 导入中的论文先建目录, 入库后才有文章记录
+ORPHAN_GRACE_HOURS = float(os.getenv("ORPHAN_GRACE_HOURS", "24"))
+# 中断的写入留下的临时文件, 以及长期没有续传的 .part 文件的保留时间
+TEMP_FILE_MAX_AGE_HOURS = float(os.getenv("TEMP_FILE_MAX_AGE_HOURS", "6"))
+PART_FILE_MAX_AGE_DAYS = float(os.getenv("PART_FILE_MAX_AGE_DAYS", "7"))
+# 小于该大小的文件 (缩略图等) 不参与去重, 节省的空间不值得哈希的开销
+DEDUPE_MIN_BYTES = int(os.getenv("DEDUPE_MIN_BYTES", str(64 * 1024)))
+DEDUPE_PAGE_SIZE = 500
+HASH_CHUNK_SIZE = 1024 * 1024
+IN_QUERY_CHUNK_SIZE = 500
+
+# figures.py、fulltext.py 的临时文件与本模块建立硬链接时的临时文件
+TEMP_SUFFIXES = ('.tmp', '.link')
+_STAMP_DIRS = ("", "images", os.path.join("images", "thumbs"))
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _stamp(path):
+    """目录自身及 images/、images/thumbs/ 的修改时间; 其中的文件被创建、删除或替换时会变化。目录已不存在时返回 None"""
+    try:
+        parts = [str(os.stat(path).st_mtime_ns)]
+    except FileNotFoundError:
+        return None
+    for sub in _STAMP_DIRS[1:]:
+        try:
+            parts.append(str(os.stat(os.path.join(path, sub)).st_mtime_ns))
+        except FileNotFoundError:
+            parts.append("-")
+    return ":".join(parts)
+
+
+def _stamp_time(stamp):
+    return datetime.utcfromtimestamp(max(int(part) for part in stamp.split(":") if part != "-") / 1e9)
+
+
+def _folder_name(local_path):
+    return os.path.basename(os.path.normpath(local_path))
+
+
+def _referenced(name):
+    """是否仍有文章的 local_path 指向名为 name 的目录; 按目录名比较, 与 SAVE_PATH 的写法 (相对/绝对路径、符号链接) 无关"""
+    pattern = '%' + name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return any(_folder_name(local_path) == name for (local_path,) in
+               db.session.query(Article.local_path).filter(Article.local_path.like(pattern, escape='\\')))
+
+
+def _inside(root, path):
+    root = os.path.realpath(root)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root and os.path.realpath(path) != root
+
+
+def _remove_tree(root, path):
+    if not _inside(root, path):
+        raise ValueError(f"Refusing to remove {path}: not inside {root}")
+    shutil.rmtree(path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _expired_leftover(path, name, age_seconds):
+    if name.endswith(PARTIAL_SUFFIX):
+        # 正式文件已存在说明下载已完成, 残留的 .part 不会再被续传
+        return os.path.exists(path[:-len(PARTIAL_SUFFIX)]) or age_seconds > PART_FILE_MAX_AGE_DAYS * 86400
+    return age_seconds > TEMP_FILE_MAX_AGE_HOURS * 3600
+
+
+def scan_folder(root, name, previous=None, dry_run=False):
+    """
+    遍历一个文章目录并删除过期的残留文件; 在线程池中运行, 不访问数据库。
+    previous 为上次扫描的 {相对路径: (size, mtime_ns, inode, sha256)}, 文件未变化时沿用其哈希。
+    """
+    previous = previous or {}
+    now = time.time()
+    result = {'name': name, 'files': [], 'bytes': 0, 'shared_bytes': 0, 'pending': 0,
+              'removed': 0, 'removed_bytes': 0}
+    stack = [os.path.join(root, name)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(TEMP_SUFFIXES + (PARTIAL_SUFFIX,)):
+                    if not _expired_leftover(entry.path, entry.name, now - stat.st_mtime):
+                        result['pending'] += 1
+                        continue
+                    if not dry_run:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            continue
+                    result['removed'] += 1
+                    result['removed_bytes'] += stat.st_size
+                    continue
+                path = os.path.relpath(entry.path, root)
+                known = previous.get(path)
+                unchanged = known is not None and known[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                result['files'].append({
+                    'path': path, 'folder': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                    'inode': stat.st_ino, 'sha256': known[3] if unchanged else None
+                })
+                result['bytes'] += stat.st_size
+                if stat.st_nlink > 1:
+                    result['shared_bytes'] += stat.st_size
+    return result
+
+
+class StorageScanner:
+    """
+    把 SAVE_PATH 与 Article.local_path 对账, 结果保存在 StorageFolder / StorageFile 表中:
+    - 内容有变化 (修改时间不同) 或仍有未过期残留文件的目录重新遍历, 其余只更新 seen_at;
+    - 目录按目录名与 Article.local_path 对应; 没有文章引用的目录先记录 orphan_since,
+      collect_orphans 为真时, 带有 FOLDER_MARKER 标记且超过 ORPHAN_GRACE_HOURS 无写入的才删除;
+    - 没有标记的目录 (用户自己放入的) 不属于文库, 不记录也不遍历;
+    - 完整扫描结束后, 已从磁盘上消失的目录的记录一并删除;
+    - 大小相同的文件才计算哈希, 内容相同而 inode 不同的文件替换为同一 inode 的硬链接。
+    必须在持有 app context 的线程中调用; progress 可选 (见 jobs.JobContext), 只用于检查取消。
+    """
+
+    def __init__(self, root=None, workers=STORAGE_SCAN_WORKERS, batch_size=STORAGE_BATCH_SIZE, dry_run=False,
+                 collect_orphans=STORAGE_ORPHAN_GC, progress=None):
+        self.root = root or services.SAVE_PATH
+        self.workers = workers
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.collect_orphans = collect_orphans
+        self.progress = progress
+        self.report = defaultdict(int)
+        self._owners = {}
+
+    def run(self, limit=None, dedupe=True):
+        """limit 限制本次重新遍历的目录数, 其余的留给下一次扫描; 返回统计"""
+        started = datetime.utcnow()
+        complete = True
+        if os.path.isdir(self.root):
+            self._owners = self._load_owners()
+            with ThreadPoolExecutor(self.workers, thread_name_prefix='storage') as pool:
+                with os.scandir(self.root) as entries:
+                    names = (entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+                    for batch in _batched(names, self.batch_size):
+                        if self.progress and self.progress.cancelled:
+                            complete = False
+                            break
+                        self._scan_batch(pool, batch, started)
+                        if limit and self.report['rescanned'] >= limit:
+                            complete = False
+                            break
+                if complete:
+                    self._forget_missing(started)
+                if dedupe and not (self.progress and self.progress.cancelled):
+                    self._dedupe(pool)
+        self.report['fulltext_cache_removed'] = fulltext_store.prune(dry_run=self.dry_run)
+        self.report['complete'] = complete
+        self.report['seconds'] = round((datetime.utcnow() - started).total_seconds(), 3)
+        return dict(self.report)
+
+    # --- 对账 ---
+    @staticmethod
+    def _load_owners():
+        """目录名 -> 文章 id; 内存占用与文章数成正比, 与文件数无关"""
+        return {_folder_name(local_path): article_id for article_id, local_path in
+                db.session.query(Article.id, Article.local_path).filter(Article.local_path.isnot(None))
+                .yield_per(1000)}
+
+    def _scan_batch(self, pool, names, started):
+        now = datetime.utcnow()
+        known = {row.name: row for row in StorageFolder.query.filter(StorageFolder.name.in_(names))}
+        changed = []
+        for name in names:
+            path = os.path.join(self.root, name)
+            stamp = _stamp(path)
+            if stamp is None: # 扫描期间已被删除 (例如并行的 storage_gc 任务)
+                self.report['vanished'] += 1
+                continue
+            article_id = self._owners.get(name)
+            if article_id is None and not os.path.isfile(os.path.join(path, services.FOLDER_MARKER)):
+                self.report['unmanaged'] += 1
+                continue
+            self.report['folders'] += 1
+            row = known.get(name)
+            if row is None:
+                row = known[name] = StorageFolder(name=name, files=0, bytes=0, pending_files=0)
+                db.session.add(row)
+            row.article_id = article_id
+            row.seen_at = started
+            if row.article_id is None and self._collect_orphan(row, path, stamp, now):
+                continue
+            if row.article_id is not None:
+                row.orphan_since = None
+            if row.stamp != stamp or row.pending_files:
+                changed.append((row, stamp))
+            else:
+                self.report['unchanged'] += 1
+
+        previous = defaultdict(dict)
+        for chunk in _chunks([row.name for row, _ in changed], IN_QUERY_CHUNK_SIZE):
+            for file in StorageFile.query.filter(StorageFile.folder.in_(chunk)):
+                previous[file.folder][file.path] = (file.size, file.mtime_ns, file.inode, file.sha256)
+        futures = [(row, stamp, pool.submit(scan_folder, self.root, row.name, previous[row.name], self.dry_run))
+                   for row, stamp in changed]
+        scanned = []
+        for row, stamp, future in futures:
+            try:
+                result = future.result()
+            except OSError as e:
+                self.report['errors'] += 1
+                log.warning("Failed to scan folder", folder=row.name, error=str(e))
+                continue
+            row.files = len(result['files'])
+            row.bytes = result['bytes']
+            row.pending_files = result['pending']
+            row.stamp = stamp
+            row.scanned_at = now
+            scanned.append(result)
+            self.report['rescanned'] += 1
+            self.report['leftovers_removed'] += result['removed']
+            self.report['leftover_bytes_removed'] += result['removed_bytes']
+
+        # 重新遍历的目录整体替换其文件记录
+        for chunk in _chunks([result['name'] for result in scanned], IN_QUERY_CHUNK_SIZE):
+            StorageFile.query.filter(StorageFile.folder.in_(chunk)).delete(synchronize_session=False)
+        files = [file for result in scanned for file in result['files']]
+        if files:
+            db.session.execute(insert(StorageFile), files)
+        db.session.commit()
+
+    def _collect_orphan(self, row, path, stamp, now):
+        """没有文章引用的目录: 首次发现时记录时间, 超过宽限期且期间没有新写入才删除; 返回是否已删除"""
+        if row.orphan_since is None:
+            row.orphan_since = now
+        grace = timedelta(hours=ORPHAN_GRACE_HOURS)
+        if (not self.collect_orphans or now - row.orphan_since < grace or now - _stamp_time(stamp) < grace
+                or _referenced(row.name)): # 扫描开始后才导入的文章
+            self.report['orphans_pending'] += 1
+            return False
+        self.report['orphans_removed'] += 1
+        self.report['orphan_bytes_removed'] += row.bytes or 0
+        if self.dry_run:
+            return True
+        try:
+            _remove_tree(self.root, path)
+        except OSError as e:
+            self.report['errors'] += 1
+            log.warning("Failed to remove orphaned folder", folder=row.name, error=str(e))
+            return False
+        log.info("Removed orphaned folder", folder=row.name, bytes=row.bytes)
+        _forget_folder(row.name)
+        return True
+
+    def _forget_missing(self, started):
+        """完整扫描后仍未见到的目录已在磁盘上被删除, 删除其记录"""
+        missing = db.session.query(StorageFolder.name).filter(
+            (StorageFolder.seen_at < started) | StorageFolder.seen_at.is_(None))
+        StorageFile.query.filter(StorageFile.folder.in_(missing.scalar_subquery())).delete(synchronize_session=False)
+        self.report['forgotten'] = StorageFolder.query.filter(
+            (StorageFolder.seen_at < started) | StorageFolder.seen_at.is_(None)).delete(synchronize_session=False)
+        db.session.commit()
+
+    # --- 去重 ---
+    def _hash(self, path):
+        try:
+            return file_sha256(os.path.join(self.root, path))
+        except OSError:
+            return None
+
+    def _dedupe(self, pool):
+        """
+        按文件大小分页: 只有大小与其他 inode 相同的文件才需要计算哈希。
+        孤立目录不参与, 建立链接会更新目录的修改时间, 推迟其回收。
+        """
+        owned = db.session.query(StorageFolder.name).filter(StorageFolder.article_id.isnot(None)).scalar_subquery()
+        last_size = DEDUPE_MIN_BYTES - 1
+        while True:
+            sizes = [size for (size,) in db.session.query(StorageFile.size)
+                     .filter(StorageFile.size > last_size, StorageFile.folder.in_(owned))
+                     .group_by(StorageFile.size)
+                     .having(func.count(func.distinct(StorageFile.inode)) > 1)
+                     .order_by(StorageFile.size)
+                     .limit(DEDUPE_PAGE_SIZE)]
+            if not sizes:
+                return
+            last_size = sizes[-1]
+            files = StorageFile.query.filter(StorageFile.size.in_(sizes), StorageFile.folder.in_(owned)).all()
+            missing = [file for file in files if file.sha256 is None]
+            for file, digest in zip(missing, pool.map(self._hash, [file.path for file in missing])):
+                file.sha256 = digest
+                self.report['hashed_bytes'] += file.size if digest else 0
+            groups = defaultdict(list)
+            for file in files:
+                if file.sha256:
+                    groups[(file.size, file.sha256)].append(file)
+            for group in groups.values():
+                self._link_group(group)
+            db.session.commit()
+
+    def _matches(self, file):
+        """文件在扫描之后没有被替换或修改"""
+        stat = os.stat(os.path.join(self.root, file.path))
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino) == (file.size, file.mtime_ns, file.inode), stat
+
+    def _link_group(self, group):
+        inodes = {}
+        for file in sorted(group, key=lambda file: file.path):
+            inodes.setdefault(file.inode, file)
+        if len(inodes) < 2:
+            return
+        canonical, *duplicates = inodes.values()
+        try:
+            matches, source_stat = self._matches(canonical)
+        except OSError:
+            return
+        if not matches:
+            return
+        source = os.path.join(self.root, canonical.path)
+        linked = set()
+        folders = {}
+        for file in group:
+            if file.inode == canonical.inode:
+                continue
+            target = os.path.join(self.root, file.path)
+            try:
+                matches, stat = self._matches(file)
+                if not matches or stat.st_dev != source_stat.st_dev:
+                    continue
+                if not self.dry_run:
+                    if file.folder not in folders:
+                        folders[file.folder] = self._current_folder(file.folder)
+                    # 先在旁边建立链接再原子替换, 任何时刻目标路径都是完整的文件
+                    tmp_path = f"{target}.{uuid.uuid4().hex[:8]}.link"
+                    os.link(source, tmp_path)
+                    os.replace(tmp_path, target)
+                    inode = file.inode
+                    file.inode, file.mtime_ns = canonical.inode, canonical.mtime_ns
+                else:
+                    inode = file.inode
+            except OSError as e:
+                self.report['errors'] += 1
+                log.warning("Failed to deduplicate file", path=file.path, error=str(e))
+                continue
+            self.report['deduplicated_files'] += 1
+            # 原来彼此已是硬链接的文件只释放一份空间
+            if inode not in linked:
+                linked.add(inode)
+                self.report['deduplicated_bytes'] += file.size
+        # 建立链接改变了目录的修改时间; 链接前与记录一致的目录更新记录, 下次扫描不必重新遍历
+        for row in folders.values():
+            if row is not None:
+                row.stamp = _stamp(os.path.join(self.root, row.name))
+
+    def _current_folder(self, name):
+        """目录记录, 仅当磁盘上的目录自上次扫描后没有变化时返回"""
+        row = db.session.get(StorageFolder, name)
+        return row if row is not None and row.stamp == _stamp(os.path.join(self.root, name)) else None
+
+
+def _forget_folder(name):
+    StorageFile.query.filter_by(folder=name).delete(synchronize_session=False)
+    StorageFolder.query.filter_by(name=name).delete(synchronize_session=False)
+
+
+def remove_article_files(local_path, entry_id=None):
+    """
+    删除文章后回收其目录 (由任务队列异步执行), 返回是否已删除。
+    目录仍被其他文章引用, 或同一篇论文正在被重新导入 (认领失败) 时保留。
+    """
+    root = services.SAVE_PATH
+    if not local_path or not os.path.isdir(local_path):
+        return False
+    if not _inside(root, local_path):
+        log.warning("Refusing to remove folder outside SAVE_PATH", path=local_path)
+        return False
+    if _referenced(_folder_name(local_path)):
+        log.info("Folder still referenced by another article, keeping it", path=local_path)
+        return False
+    claims = PaperClaims()
+    try:
+        if entry_id and entry_id not in claims.claim([entry_id]):
+            log.info("Paper is being imported again, keeping its folder", entry_id=entry_id, path=local_path)
+            return False
+        _remove_tree(root, local_path)
+        _forget_folder(_folder_name(local_path))
+        db.session.commit()
+    finally:
+        claims.release_all()
+    log.info("Removed article folder", path=local_path)
+    return True
+
+
+def folder_usage(local_path):
+    """实时统计一个文章目录的占用 (不写数据库), 目录不存在时返回 None"""
+    if not local_path or not os.path.isdir(local_path):
+        return None
+    root, name = os.path.split(os.path.normpath(local_path))
+    result = scan_folder(root, name, dry_run=True)
+    return {
+        'folder': name, 'files': len(result['files']), 'bytes': result['bytes'],
+        # 与其他文件共享 inode (硬链接) 的部分, 删除本文章不会释放这部分空间
+        'shared_bytes': result['shared_bytes'],
+        'pending_files': result['pending'] + result['removed']
+    }
+
+
+def usage_report(limit=20):
+    """最近一次扫描的汇总与占用最大的文章"""
+    folders, total_bytes, files, orphans, pending, last_scan = db.session.query(
+        func.count(StorageFolder.name), func.coalesce(func.sum(StorageFolder.bytes), 0),
+        func.coalesce(func.sum(StorageFolder.files), 0), func.count(StorageFolder.orphan_since),
+        func.coalesce(func.sum(StorageFolder.pending_files), 0), func.max(StorageFolder.seen_at)
+    ).one()
+    # 硬链接的文件只计一次
+    per_inode = db.session.query(func.max(StorageFile.size).label('size')).group_by(StorageFile.inode).subquery()
+    physical_bytes = db.session.query(func.coalesce(func.sum(per_inode.c.size), 0)).scalar()
+    largest = (db.session.query(StorageFolder, Article.title)
+               .join(Article, Article.id == StorageFolder.article_id)
+               .order_by(StorageFolder.bytes.desc())
+               .limit(limit).all())
+    shared_inodes = (db.session.query(StorageFile.inode).group_by(StorageFile.inode)
+                     .having(func.count() > 1).scalar_subquery())
+    shared = dict(db.session.query(StorageFile.folder, func.sum(StorageFile.size))
+                  .filter(StorageFile.folder.in_([row.name for row, _ in largest]),
+                          StorageFile.inode.in_(shared_inodes))
+                  .group_by(StorageFile.folder))
+    return {
+        'folders': folders, 'files': files, 'bytes': total_bytes, 'physical_bytes': physical_bytes,
+        'orphaned_folders': orphans, 'pending_files': pending,
+        'last_scan': last_scan.isoformat() if last_scan else None,
+        'largest': [{
+            'article_id': row.article_id, 'title': title, 'folder': row.name, 'files': row.files,
+            'bytes': row.bytes, 'shared_bytes': shared.get(row.name, 0),
+            'scanned_at': row.scanned_at.isoformat() if row.scanned_at else None
+        } for row, title in largest]
+    }
@@ -0,0 +1,75 @@
+# tests/conftest.py - 测试共用的配置: 临时数据库与缓存目录, 每个测试前清空所有表
+# 应用在导入时读取环境变量, 因此必须在导入 app 之前设置
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+from sqlalchemy import text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix='research-assistant-tests-')
+os.environ.setdefault('DEEPSEEK_API_KEY', 'test')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ['LLM_CACHE_PATH'] = os.path.join(_tmp, 'llm_cache.db')
+os.environ['EMBEDDINGS_DIR'] = os.path.join(_tmp, 'embeddings')
+os.environ['FULLTEXT_DIR'] = os.path.join(_tmp, 'fulltext_cache')
+
+from app import app as flask_app  # noqa: E402
+from database import db, init_database  # noqa: E402
+from search_index import FTS_TABLE  # noqa: E402
+from models import CacheInvalidation  # noqa: E402
+import services  # noqa: E402
+
+with flask_app.app_context():
+    init_database()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            # 失效记录的 id 就是响应缓存的版本号, 与 prune() 一样不能让 id 被复用
+            if table is not CacheInvalidation.__table__:
+                db.session.execute(table.delete())
+        db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        db.session.commit()
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """临时的 SAVE_PATH"""
+    path = tmp_path / 'library'
+    path.mkdir()
+    monkeypatch.setattr(services, 'SAVE_PATH', str(path))
+    return path
+
+
+@pytest.fixture
+def llm_server():
+    """本地的 OpenAI 兼容服务 (mock_llm.MockOpenAIServer); 测试可修改其 failure_rate 等属性"""
+    from mock_llm import MockOpenAIServer
+    server = MockOpenAIServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def llm_client(llm_server):
+    from openai import OpenAI
+    return OpenAI(api_key='test', base_url=llm_server.base_url, max_retries=0)
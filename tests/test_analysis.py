@@ -0,0 +1,164 @@
+import re
+import json
+import uuid
+from types import SimpleNamespace
+import pytest
+import services
+from llm_scheduler import llm_scheduler
+from models import db, Article, Analysis
+from mock_llm import MOCK_SUMMARY, MOCK_DETAILED
+
+OLD_SUMMARY = {'simplified_summary_zh': '旧的摘要'}
+OLD_DETAILED = {'background': '旧的背景'}
+SUMMARY = {'simplified_summary_zh': '摘要', 'keywords_en': ['analysis'], 'innovation_rating': 3}
+DETAILED = {'background': '背景', 'methodology': '方法', 'key_innovations': ['创新'], 'potential_impact': '影响'}
+
+
+@pytest.fixture
+def analysis_llm(llm_server, llm_client, monkeypatch):
+    monkeypatch.setattr(services.AnalysisService, 'client', llm_client)
+    monkeypatch.setattr(services, 'ANALYSIS_SOURCE', 'abstract')
+    monkeypatch.setattr(llm_scheduler, 'max_retries', 0)
+    return llm_server
+
+
+def make_article(name, analyses, status):
+    # 摘要各不相同, 避免命中其他测试写入的 LLM 缓存
+    article = Article(entry_id=f'http://arxiv.org/abs/{name}', title=name, original_summary=f'abstract of {name}',
+                      analysis_status=status)
+    db.session.add(article)
+    db.session.flush()
+    for analysis_type, content in analyses.items():
+        db.session.add(Analysis(article_id=article.id, analysis_type=analysis_type, content=content))
+    db.session.commit()
+    return article
+
+
+def contents(article):
+    return {a.analysis_type: a.content for a in Analysis.query.filter_by(article_id=article.id)}
+
+
+def test_retry_keeps_existing_analyses_when_llm_unavailable(app, analysis_llm):
+    analysis_llm.failure_rate = 1.0
+    article = make_article('retry-down', {'summary': OLD_SUMMARY}, 'failed')
+    assert services.retry_failed_analyses() == 0
+    db.session.expire_all()
+    assert contents(article) == {'summary': OLD_SUMMARY}
+    assert article.analysis_status == 'failed'
+    assert article.analysis_attempts == 1
+
+
+def test_retry_replaces_analyses_when_llm_answers(app, analysis_llm):
+    article = make_article('retry-up', {'summary': OLD_SUMMARY}, 'failed')
+    assert services.retry_failed_analyses() == 1
+    db.session.expire_all()
+    assert contents(article) == {'summary': MOCK_SUMMARY, 'detailed': MOCK_DETAILED}
+    assert article.analysis_status == 'ok'
+
+
+def test_regenerate_failure_keeps_analyses_and_raises(app, analysis_llm):
+    analysis_llm.failure_rate = 1.0
+    article = make_article('regenerate-down', {'summary': OLD_SUMMARY, 'detailed': OLD_DETAILED}, 'ok')
+    with pytest.raises(services.LLMUnavailable):
+        services.regenerate_analysis_for_article(article, force=True)
+    db.session.expire_all()
+    assert contents(article) == {'summary': OLD_SUMMARY, 'detailed': OLD_DETAILED}
+
+
+class ScriptedClient:
+    """只实现 chat.completions.create: 按 prompt 判断请求类型并记录; replies 可按类型替换返回的 JSON"""
+
+    def __init__(self):
+        self.calls = []
+        self.replies = {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @staticmethod
+    def kind(prompt):
+        if '"papers"' in prompt:
+            return 'grouped'
+        if '"summary"' in prompt and '"detailed"' in prompt:
+            return 'combined'
+        return 'summary' if 'simplified_summary_zh' in prompt else 'detailed'
+
+    @staticmethod
+    def default(kind, prompt):
+        if kind == 'grouped':
+            ids = re.findall(r'\[ID: ([^\]]+)\]', prompt)
+            return {'papers': [{'id': i, 'summary': SUMMARY, 'detailed': DETAILED} for i in ids]}
+        if kind == 'combined':
+            return {'summary': SUMMARY, 'detailed': DETAILED}
+        return SUMMARY if kind == 'summary' else DETAILED
+
+    def create(self, model, messages, **kwargs):
+        prompt = messages[-1]['content']
+        kind = self.kind(prompt)
+        self.calls.append(kind)
+        reply = self.replies[kind](prompt) if kind in self.replies else self.default(kind, prompt)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(reply)), finish_reason='stop')],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=10, total_tokens=20), model=model)
+
+
+@pytest.fixture
+def scripted_llm(monkeypatch):
+    client = ScriptedClient()
+    monkeypatch.setattr(services.AnalysisService, 'client', client)
+    return client
+
+
+def unique_abstracts(count):
+    # LLM 缓存在测试之间共享
+    return {f'paper-{i}': f'abstract {uuid.uuid4().hex}' for i in range(count)}
+
+
+def test_grouped_falls_back_per_paper_for_missing_ids(scripted_llm):
+    scripted_llm.replies['grouped'] = lambda prompt: {'papers': [{'id': '1', 'summary': SUMMARY, 'detailed': DETAILED}]}
+    results = services.AnalysisService.get_grouped_analyses(unique_abstracts(3))
+    assert results == {key: (SUMMARY, DETAILED) for key in ('paper-0', 'paper-1', 'paper-2')}
+    assert scripted_llm.calls == ['grouped', 'combined', 'combined']
+
+
+def test_grouped_falls_back_per_paper_for_invalid_items(scripted_llm):
+    scripted_llm.replies['grouped'] = lambda prompt: {'papers': [
+        'not an object',
+        {'id': '1', 'summary': SUMMARY, 'detailed': DETAILED},
+        {'id': '2', 'summary': {'simplified_summary_zh': '缺少其他字段'}, 'detailed': DETAILED},
+        {'id': '9', 'summary': SUMMARY, 'detailed': DETAILED},
+    ]}
+    results = services.AnalysisService.get_grouped_analyses(unique_abstracts(2))
+    assert results == {'paper-0': (SUMMARY, DETAILED), 'paper-1': (SUMMARY, DETAILED)}
+    assert scripted_llm.calls == ['grouped', 'combined']
+
+
+def test_grouped_response_that_is_not_an_object_falls_back_per_paper(scripted_llm):
+    scripted_llm.replies['grouped'] = lambda prompt: [{'id': '1'}]
+    results = services.AnalysisService.get_grouped_analyses(unique_abstracts(2))
+    assert results == {'paper-0': (SUMMARY, DETAILED), 'paper-1': (SUMMARY, DETAILED)}
+    assert scripted_llm.calls == ['grouped', 'combined', 'combined']
+
+
+def test_grouped_results_are_written_through_to_the_cache(scripted_llm):
+    abstracts = unique_abstracts(2)
+    services.AnalysisService.get_grouped_analyses(abstracts)
+    assert scripted_llm.calls == ['grouped']
+    # 按单独请求的键写入缓存, 其他分析模式也能命中
+    for abstract in abstracts.values():
+        assert services.AnalysisService.get_combined_analysis(abstract) == (SUMMARY, DETAILED)
+        assert services.AnalysisService.get_summary_analysis(abstract) == SUMMARY
+        assert services.AnalysisService.get_detailed_analysis(abstract) == DETAILED
+    assert scripted_llm.calls == ['grouped']
+
+
+def test_incomplete_combined_response_requests_only_the_missing_part(scripted_llm):
+    scripted_llm.replies['combined'] = lambda prompt: {'summary': SUMMARY, 'detailed': {'background': '只有背景'}}
+    abstract = unique_abstracts(1)['paper-0']
+    assert services.AnalysisService.get_combined_analysis(abstract) == (SUMMARY, DETAILED)
+    assert scripted_llm.calls == ['combined', 'detailed']
+
+
+def test_combined_response_that_is_not_an_object_falls_back_to_separate_requests(scripted_llm):
+    scripted_llm.replies['combined'] = lambda prompt: ['not', 'an', 'object']
+    abstract = unique_abstracts(1)['paper-0']
+    assert services.AnalysisService.get_combined_analysis(abstract) == (SUMMARY, DETAILED)
+    assert sorted(scripted_llm.calls) == ['combined', 'detailed', 'summary']
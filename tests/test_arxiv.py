@@ -0,0 +1,123 @@
+import time
+import threading
+from datetime import datetime
+import pytest
+import arxiv
+import arxiv_client
+import harvest
+from arxiv_client import ArxivSession, RateLimiter
+from fake_arxiv import FakeArxiv
+from harvest import KeywordHarvest
+from models import db, Keyword
+
+
+@pytest.fixture
+def fake_arxiv():
+    fake = FakeArxiv(papers=30)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def fake_client(fake_arxiv):
+    """不限速、每页 5 篇, 用于观察分页"""
+    session = ArxivSession(rate_limits={'127.0.0.1': RateLimiter(0)})
+    return arxiv_client.make_client(session, api_url=fake_arxiv.api_url, page_size=5)
+
+
+@pytest.fixture
+def keyword(app):
+    keyword = Keyword(keyword='quantum computing', last_submitted=datetime(2023, 12, 31))
+    db.session.add(keyword)
+    db.session.commit()
+    return keyword
+
+
+def test_default_limits_cover_api_and_download_hosts():
+    limits = arxiv_client.default_rate_limits()
+    assert set(limits) == {'export.arxiv.org', 'arxiv.org'}
+
+
+def test_parallel_downloads_share_the_host_interval(fake_arxiv):
+    session = ArxivSession(rate_limits={'127.0.0.1': RateLimiter(0.2)})
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda i=i: session.get(f"{fake_arxiv.base_url}/pdf/2401.{i:05d}v1").content)
+               for i in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(fake_arxiv.downloads) == 4
+    assert time.monotonic() - started >= 0.6
+
+
+def test_rate_limited_api_request_is_retried_after_retry_after(fake_arxiv):
+    fake_arxiv.min_interval = 0.5
+    session = ArxivSession(rate_limits={'127.0.0.1': RateLimiter(0)})
+    assert session.get(fake_arxiv.api_url, params={'search_query': 'all:"quantum computing"'}).status_code == 200
+    started = time.monotonic()
+    assert session.get(fake_arxiv.api_url, params={'search_query': 'all:"quantum computing"'}).status_code == 200
+    assert fake_arxiv.rejected == 1
+    assert time.monotonic() - started >= 0.9
+
+
+def test_harvest_reads_every_page_of_the_window(fake_arxiv, fake_client, keyword):
+    fake_arxiv.add_papers(12, 'quantum computing')
+    requests_before = len(fake_arxiv.api_requests)
+    run = KeywordHarvest(keyword)
+    entry_ids = [paper.entry_id for paper in run.papers(fake_client)]
+    # 初始的 30 篇中每 5 篇有一篇属于该关键词
+    assert len(entry_ids) == len(set(entry_ids)) == 18 == run.fetched
+    assert len(fake_arxiv.api_requests) - requests_before == 4
+
+
+def test_mark_stops_before_the_first_unstored_paper(fake_arxiv, fake_client, keyword, monkeypatch):
+    monkeypatch.setattr(harvest, 'HARVEST_OVERLAP_HOURS', 0)
+    run = KeywordHarvest(keyword)
+    papers = sorted(run.papers(fake_client), key=lambda paper: paper.published)
+    failed = papers[3]
+    run.save_mark({paper.entry_id for paper in papers} - {failed.entry_id})
+    db.session.commit()
+    assert run.unstored == 1
+    assert keyword.last_entry_id == papers[2].entry_id
+    # 下一次抓取从高水位开始, 入库失败的论文仍在窗口内
+    retry = [paper.entry_id for paper in KeywordHarvest(keyword).papers(fake_client)]
+    assert failed.entry_id in retry
+    assert papers[1].entry_id not in retry
+
+
+def test_mark_advances_past_stored_papers_and_new_papers_are_fetched(fake_arxiv, fake_client, keyword, monkeypatch):
+    monkeypatch.setattr(harvest, 'HARVEST_OVERLAP_HOURS', 0)
+    run = KeywordHarvest(keyword)
+    first = {paper.entry_id for paper in run.papers(fake_client)}
+    run.save_mark(first)
+    db.session.commit()
+    fake_arxiv.add_papers(3, 'quantum computing')
+    second = {paper.entry_id for paper in KeywordHarvest(keyword).papers(fake_client)}
+    # 查询窗口包含高水位本身 (按分钟取整), 其余只是新论文
+    assert len(second - first) == 3
+    assert second & first == {keyword.last_entry_id}
+
+
+def test_mark_never_moves_backwards(fake_client, keyword):
+    # 重叠窗口内只有早于高水位的论文
+    keyword.last_submitted = datetime(2024, 1, 2, 6)
+    run = KeywordHarvest(keyword)
+    assert len(list(run.papers(fake_client))) == 6
+    run.save_mark(set(run.entry_ids))
+    assert keyword.last_submitted == datetime(2024, 1, 2, 6)
+
+
+def test_client_requests_go_through_the_shared_session(fake_arxiv, fake_client, monkeypatch):
+    session = fake_client._session
+    calls = []
+    original = session.get
+
+    def get(url, **kwargs):
+        calls.append(url)
+        return original(url, **kwargs)
+
+    monkeypatch.setattr(session, 'get', get)
+    list(fake_client.results(arxiv.Search(query='all:"quantum computing"', max_results=3)))
+    assert calls and all(url.startswith(fake_arxiv.api_url) for url in calls)
@@ -0,0 +1,117 @@
+import time
+import threading
+from datetime import datetime, timedelta
+import coordination
+from coordination import LeaderElection, PaperClaims, acquire_lease, release_lease
+from models import db, Lease, PaperClaim
+
+
+def in_threads(app, count, target):
+    """每个线程在自己的 app context (即自己的数据库会话) 中同时执行 target(i), 返回各自的结果"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        with app.app_context():
+            barrier.wait()
+            results[i] = target(i)
+            db.session.remove()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    return results
+
+
+def test_lease_is_held_by_one_holder_until_it_expires(app):
+    assert acquire_lease('leader', 'a', 60)
+    assert not acquire_lease('leader', 'b', 60)
+    assert acquire_lease('leader', 'a', 60)
+    Lease.query.filter_by(name='leader').update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert acquire_lease('leader', 'b', 60)
+    assert not acquire_lease('leader', 'a', 60)
+
+
+def test_released_lease_is_taken_over_immediately(app):
+    acquire_lease('leader', 'a', 60)
+    release_lease('leader', 'b')
+    assert not acquire_lease('leader', 'b', 60)
+    release_lease('leader', 'a')
+    assert acquire_lease('leader', 'b', 60)
+
+
+def test_concurrent_acquire_has_a_single_winner(app):
+    results = in_threads(app, 6, lambda i: acquire_lease('leader', f'holder-{i}', 60))
+    assert results.count(True) == 1
+    assert db.session.get(Lease, 'leader').holder == f'holder-{results.index(True)}'
+
+
+def test_leader_election_follows_the_lease(app, monkeypatch):
+    monkeypatch.setattr(coordination, 'process_id', lambda: 'worker-1')
+    first = LeaderElection('scheduler')
+    assert first.renew() and first.is_leader
+    monkeypatch.setattr(coordination, 'process_id', lambda: 'worker-2')
+    second = LeaderElection('scheduler')
+    assert not second.renew() and not second.is_leader
+    monkeypatch.setattr(coordination, 'process_id', lambda: 'worker-1')
+    first.release()
+    monkeypatch.setattr(coordination, 'process_id', lambda: 'worker-2')
+    assert second.renew()
+
+
+def test_leader_keeps_acting_only_until_its_local_expiry(app, monkeypatch):
+    election = LeaderElection('scheduler', lease_seconds=1)
+    assert election.renew()
+
+    def unavailable(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(coordination, 'acquire_lease', unavailable)
+    assert election.renew()
+    time.sleep(1.1)
+    assert not election.renew()
+
+
+def test_overlapping_claims_are_disjoint(app):
+    entry_ids = [f'http://arxiv.org/abs/{i}' for i in range(40)]
+    claims = [PaperClaims() for _ in range(4)]
+    results = in_threads(app, 4, lambda i: claims[i].claim(entry_ids[i * 5:i * 5 + 25]))
+    assert sum(len(claimed) for claimed in results) == len(set().union(*results)) == 40
+
+
+def test_claim_is_exclusive_until_released_or_expired(app):
+    first, second = PaperClaims(), PaperClaims(seconds=60)
+    assert first.claim(['a', 'b']) == {'a', 'b'}
+    assert second.claim(['b', 'c']) == {'c'}
+    first.release(['b'])
+    assert second.claim(['b']) == {'b'}
+    PaperClaim.query.filter_by(holder=first.holder).update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert second.claim(['a']) == {'a'}
+    assert first.claim(['a', 'b', 'c']) == set()
+
+
+def test_renew_extends_only_own_claims(app, monkeypatch):
+    mine, other = PaperClaims(seconds=3), PaperClaims(seconds=3)
+    mine.claim(['a'])
+    other.claim(['b'])
+    before = {claim.entry_id: claim.expires_at for claim in PaperClaim.query}
+    monkeypatch.setattr(mine, '_renewed', time.monotonic() - 2)
+    time.sleep(0.01)
+    mine.renew()
+    after = {claim.entry_id: claim.expires_at for claim in PaperClaim.query}
+    assert after['a'] > before['a']
+    assert after['b'] == before['b']
+
+
+def test_prune_expired_removes_only_expired_rows(app):
+    acquire_lease('old', 'a', -1)
+    acquire_lease('current', 'a', 60)
+    PaperClaims(seconds=-1).claim(['x'])
+    PaperClaims().claim(['y'])
+    assert coordination.prune_expired() == {'leases': 1, 'claims': 1}
+    assert [lease.name for lease in Lease.query] == ['current']
+    assert [claim.entry_id for claim in PaperClaim.query] == ['y']
@@ -0,0 +1,75 @@
+import pytest
+import downloads
+from arxiv_client import ArxivSession, RateLimiter
+from downloads import PdfDownloader, InvalidPdf, PARTIAL_SUFFIX
+from fake_arxiv import FakeArxiv
+
+PAPER = '2401.00001v1'
+
+
+@pytest.fixture
+def fake_arxiv():
+    fake = FakeArxiv(papers=3)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def downloader():
+    return PdfDownloader(session=ArxivSession(rate_limits={'127.0.0.1': RateLimiter(0)}))
+
+
+@pytest.fixture
+def target(tmp_path):
+    return tmp_path / 'paper.pdf'
+
+
+def download(downloader, fake_arxiv, target):
+    return downloader.download(f"{fake_arxiv.base_url}/pdf/{PAPER}", str(target))
+
+
+def test_interrupted_transfer_resumes_with_range(fake_arxiv, downloader, target, monkeypatch):
+    # 只有完整读到的块才会写入 .part; 块要小于断开前发送的字节数
+    monkeypatch.setattr(downloads, 'CHUNK_SIZE', 1024)
+    fake_arxiv.interrupt_pdf_after = 5000
+    result = download(downloader, fake_arxiv, target)
+    assert target.read_bytes() == fake_arxiv.pdf(PAPER)
+    assert result['bytes'] == len(fake_arxiv.pdf(PAPER))
+    first, resumed = [byte_range for _, byte_range in fake_arxiv.downloads]
+    assert first is None
+    assert 0 < int(resumed[len('bytes='):-1]) <= 5000
+    assert not (target.parent / (target.name + PARTIAL_SUFFIX)).exists()
+
+
+def test_partial_file_left_by_a_crash_is_resumed(fake_arxiv, downloader, target):
+    (target.parent / (target.name + PARTIAL_SUFFIX)).write_bytes(fake_arxiv.pdf(PAPER)[:3000])
+    result = download(downloader, fake_arxiv, target)
+    assert result['resumed_from'] == 3000
+    assert fake_arxiv.downloads[0][1] == 'bytes=3000-'
+    assert target.read_bytes() == fake_arxiv.pdf(PAPER)
+
+
+def test_complete_partial_file_is_validated_and_renamed(fake_arxiv, downloader, target):
+    (target.parent / (target.name + PARTIAL_SUFFIX)).write_bytes(fake_arxiv.pdf(PAPER))
+    download(downloader, fake_arxiv, target)
+    assert target.read_bytes() == fake_arxiv.pdf(PAPER)
+
+
+def test_html_error_page_is_rejected(fake_arxiv, downloader, target):
+    fake_arxiv.broken_pdfs.add(PAPER.split('v')[0])
+    with pytest.raises(InvalidPdf):
+        download(downloader, fake_arxiv, target)
+    assert list(target.parent.iterdir()) == []
+
+
+def test_invalid_existing_file_is_replaced(fake_arxiv, downloader, target):
+    target.write_bytes(b'<html>not a pdf</html>' * 100)
+    download(downloader, fake_arxiv, target)
+    assert target.read_bytes() == fake_arxiv.pdf(PAPER)
+
+
+def test_valid_existing_file_is_not_downloaded_again(fake_arxiv, downloader, target):
+    target.write_bytes(fake_arxiv.pdf(PAPER))
+    assert download(downloader, fake_arxiv, target)['seconds'] == 0.0
+    assert fake_arxiv.downloads == []
@@ -0,0 +1,73 @@
+import io
+import os
+import gzip
+import tarfile
+from PIL import Image
+import figures
+from figures import FigureExtractor
+
+
+def png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def tar_gz(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return io.BytesIO(buffer.getvalue())
+
+
+def extract(tmp_path, stream):
+    folder = tmp_path / '2401.00001v1'
+    return folder, FigureExtractor(str(folder)).extract_from_stream(stream)
+
+
+def test_same_basename_in_subdirectories_does_not_overwrite(tmp_path):
+    red, blue = png_bytes('red'), png_bytes('blue')
+    folder, paths = extract(tmp_path, tar_gz([('a/fig.png', red), ('b/fig.png', blue), ('main.tex', b'\\begin{document}')]))
+    assert len(paths) == 2
+    assert all(path.startswith('2401.00001v1/images/') for path in paths)
+    contents = {(tmp_path / path).read_bytes() for path in paths}
+    assert contents == {red, blue}
+
+
+def test_identical_images_are_stored_once(tmp_path):
+    red = png_bytes('red')
+    folder, paths = extract(tmp_path, tar_gz([('a/fig.png', red), ('b/copy.png', red)]))
+    assert len(paths) == 1
+    assert [name for name in os.listdir(folder / 'images') if name != 'thumbs'] == [os.path.basename(paths[0])]
+
+
+def test_thumbnails_are_written_under_images_thumbs(tmp_path):
+    folder, paths = extract(tmp_path, tar_gz([('fig.png', png_bytes('red'))]))
+    thumb = folder / 'images' / 'thumbs' / (os.path.splitext(os.path.basename(paths[0]))[0] + '.jpg')
+    assert thumb.exists()
+    with Image.open(thumb) as image:
+        assert image.format == 'JPEG'
+
+
+def test_single_gzipped_tex_has_no_images(tmp_path):
+    folder, paths = extract(tmp_path, io.BytesIO(gzip.compress(b'\\documentclass{article}\n' * 100)))
+    assert paths == []
+    assert not (folder / 'images').exists()
+
+
+def test_bare_image_source(tmp_path):
+    red = png_bytes('red')
+    folder, paths = extract(tmp_path, io.BytesIO(red))
+    assert len(paths) == 1 and paths[0].endswith('.png')
+    assert (tmp_path / paths[0]).read_bytes() == red
+
+
+def test_oversized_member_is_skipped(tmp_path, monkeypatch):
+    small, large = png_bytes('red'), png_bytes('blue') + b'\0' * 4096
+    monkeypatch.setattr(figures, 'MAX_IMAGE_BYTES', len(small) + 100)
+    folder, paths = extract(tmp_path, tar_gz([('big.png', large), ('small.png', small)]))
+    assert len(paths) == 1
+    assert (tmp_path / paths[0]).read_bytes() == small
@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import event
+from models import db, Article, Author
+from services import ArxivService
+
+ASSETS = {'local_path': None, 'image_paths': [], 'pdf': None}
+
+
+def paper(number, authors):
+    return SimpleNamespace(entry_id=f'http://arxiv.org/abs/2401.{number:05d}v1', title=f'Paper {number}',
+                           published=datetime(2024, 1, 1, tzinfo=timezone.utc), pdf_url=None, summary='abstract',
+                           authors=[SimpleNamespace(name=name) for name in authors])
+
+
+@pytest.fixture
+def statements(app):
+    executed = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def test_large_collaboration_takes_a_fixed_number_of_statements(statements):
+    names = [f'Author {i}' for i in range(1000)]
+    [article] = ArxivService.save_paper_records([(paper(1, names), ASSETS)], commit=False)
+    # 作者、文章与关联各一条批量 INSERT, 其余为分段的 IN 查询; 与作者人数成正比的语句一条也没有
+    assert len(statements) <= 12
+    assert len(article.authors) == 1000
+
+    statements.clear()
+    ArxivService.save_paper_records([(paper(2, names + ['New author']), ASSETS)], commit=False)
+    assert len(statements) <= 12
+    assert Author.query.count() == 1001
+
+
+def test_existing_and_duplicate_papers_are_skipped(statements):
+    ArxivService.save_paper_records([(paper(1, ['A']), ASSETS)])
+    created = ArxivService.save_paper_records([(paper(1, ['A']), ASSETS), (paper(2, ['A', 'A']), ASSETS),
+                                               (paper(2, ['A']), ASSETS)])
+    assert [article.entry_id for article in created] == ['http://arxiv.org/abs/2401.00002v1']
+    assert [author.name for author in created[0].authors] == ['A']
+    assert Article.query.count() == 2
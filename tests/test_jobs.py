@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy.exc import IntegrityError
+from jobs import JobQueue, make_dedupe_key
+from models import db, Job
+
+
+@pytest.fixture
+def jobs(app, monkeypatch):
+    """不启动工作线程的队列, 测试中用 _run() 同步执行任务"""
+    job_queue = JobQueue(app)
+    monkeypatch.setattr(job_queue, 'start', lambda: None)
+    job_queue.calls = []
+    job_queue.register('record', lambda params, context: job_queue.calls.append(params))
+    return job_queue
+
+
+def test_identical_active_jobs_are_deduplicated(jobs):
+    first = jobs.submit('record', {'ids': [1, 2]})
+    assert jobs.submit('record', {'ids': [1, 2]}).id == first.id
+    assert jobs.submit('record', {'ids': [2, 1]}).id != first.id
+    jobs._run(first.id)
+    assert db.session.get(Job, first.id).status == 'succeeded'
+    # 已结束的任务不再参与去重
+    assert jobs.submit('record', {'ids': [1, 2]}).id != first.id
+
+
+def test_index_rejects_a_second_active_job_from_another_process(jobs):
+    key = make_dedupe_key('record', {})
+    db.session.add(Job(job_type='record', params={}, dedupe_key=key, status='running'))
+    db.session.commit()
+    db.session.add(Job(job_type='record', params={}, dedupe_key=key, status='queued'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_unknown_job_type_is_rejected(jobs):
+    with pytest.raises(ValueError):
+        jobs.submit('missing')
+
+
+def test_cancelled_queued_job_never_runs(jobs):
+    job = jobs.submit('record', {'n': 1})
+    assert jobs.cancel(job.id).status == 'cancelled'
+    jobs._run(job.id)
+    assert jobs.calls == []
+    assert db.session.get(Job, job.id).finished_at is not None
+
+
+def test_cancel_stops_a_running_job(jobs):
+    reached = []
+
+    def long_job(params, context):
+        # 相当于运行期间另一个请求调用了 POST /api/jobs/<id>/cancel
+        jobs.cancel(context.job_id)
+        context.raise_if_cancelled()
+        reached.append(True)
+
+    jobs.register('long', long_job)
+    job = jobs.submit('long')
+    jobs._run(job.id)
+    job = db.session.get(Job, job.id)
+    assert (job.status, job.cancel_requested, reached) == ('cancelled', True, [])
+    assert jobs.get_status(job.id)['status'] == 'cancelled'
+
+
+def test_failed_job_records_the_error(jobs):
+    def broken(params, context):
+        raise RuntimeError("boom")
+
+    jobs.register('broken', broken)
+    job = jobs.submit('broken')
+    jobs._run(job.id)
+    job = db.session.get(Job, job.id)
+    assert (job.status, job.error) == ('failed', 'RuntimeError: boom')
+
+
+def test_stale_running_job_is_requeued_and_runs_once(jobs):
+    job = Job(job_type='record', params={'n': 2}, dedupe_key=make_dedupe_key('record', {'n': 2}), status='running',
+              owner='gone:1', heartbeat_at=datetime.utcnow() - timedelta(hours=1))
+    db.session.add(job)
+    db.session.commit()
+    jobs._requeue_stale()
+    assert db.session.get(Job, job.id).status == 'queued'
+    jobs._run(job.id)
+    jobs._run(job.id)
+    assert jobs.calls == [{'n': 2}]
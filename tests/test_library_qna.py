@@ -0,0 +1,35 @@
+import pytest
+import app as app_module
+import services
+
+
+@pytest.fixture
+def searched(monkeypatch):
+    """记录传给向量检索的 k, 不调用 LLM"""
+    calls = []
+
+    def search_chunks(question, k):
+        calls.append(k)
+        return []
+
+    monkeypatch.setattr(app_module.vector_index, 'search_chunks', search_chunks)
+    monkeypatch.setattr(services.AnalysisService, 'ask_question_with_context', lambda question, context: 'answer')
+    return calls
+
+
+def ask(client, **payload):
+    return client.post('/api/library/ask', json={'question': 'What is new?', **payload})
+
+
+@pytest.mark.parametrize('k', ['many', None, [3], {'k': 3}])
+def test_invalid_k_is_rejected(client, searched, k):
+    response = ask(client, k=k)
+    assert response.status_code == 400
+    assert searched == []
+
+
+@pytest.mark.parametrize('payload, expected', [({}, 6), ({'k': '3'}, 3), ({'k': 0}, 1), ({'k': 500}, 20)])
+def test_k_is_clamped(client, searched, payload, expected):
+    response = ask(client, **payload)
+    assert response.status_code == 200
+    assert searched == [expected]
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+import listing
+from models import db, Article, Author, Analysis
+
+
+@pytest.fixture
+def articles(app):
+    """11 篇文章, 其中几篇发布时间相同, 用于检查游标在并列时既不重复也不遗漏"""
+    start = datetime(2024, 1, 1)
+    created = []
+    for number in range(11):
+        article = Article(entry_id=f'http://arxiv.org/abs/{number}', title=f'Paper {number}',
+                          published=start + timedelta(days=number // 3), is_favorited=number % 2 == 0,
+                          authors=[Author(name=f'Author {number}')])
+        article.analyses.append(Analysis(analysis_type='summary', content={'keywords_en': [str(number)]}))
+        created.append(article)
+    db.session.add_all(created)
+    db.session.commit()
+    return sorted(created, key=lambda a: (a.published, a.id), reverse=True)
+
+
+def walk(client, url, limit):
+    pages = []
+    cursor = ''
+    while cursor is not None:
+        response = client.get(f'{url}?limit={limit}&cursor={cursor}')
+        assert response.status_code == 200
+        data = response.get_json()
+        pages.append([article['id'] for article in data['articles']])
+        cursor = data['next_cursor']
+    return pages
+
+
+def test_pages_follow_published_then_id_without_gaps(client, articles):
+    pages = walk(client, '/api/articles/latest', 4)
+    assert [len(page) for page in pages] == [4, 4, 3]
+    assert sum(pages, []) == [a.id for a in articles]
+
+
+def test_favorites_are_paginated_separately(client, articles):
+    pages = walk(client, '/api/articles/favorites', 2)
+    assert sum(pages, []) == [a.id for a in articles if a.is_favorited]
+
+
+def test_cursor_survives_inserts_ahead_of_it(client, articles):
+    first = client.get('/api/articles/latest?limit=4').get_json()
+    db.session.add(Article(entry_id='http://arxiv.org/abs/new', title='New', published=datetime(2025, 1, 1)))
+    db.session.commit()
+    second = client.get(f"/api/articles/latest?limit=4&cursor={first['next_cursor']}").get_json()
+    assert [a['id'] for a in second['articles']] == [a.id for a in articles[4:8]]
+
+
+def test_invalid_cursor_is_rejected(client, articles):
+    assert client.get('/api/articles/latest?cursor=not-a-cursor').status_code == 400
+
+
+@pytest.mark.parametrize('value, expected', [(None, listing.DEFAULT_PAGE_SIZE), ('abc', listing.DEFAULT_PAGE_SIZE),
+                                             ('0', 1), ('5000', listing.MAX_PAGE_SIZE), ('7', 7)])
+def test_parse_limit(value, expected):
+    assert listing.parse_limit(value) == expected
+
+
+def test_page_query_count_does_not_grow_with_page_size(app, articles):
+    statements = []
+    engine = db.engine
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        for limit in (2, 10):
+            statements.clear()
+            db.session.expire_all()
+            page = listing.list_articles(limit=limit)
+            assert page['articles'][0]['authors'] and page['articles'][0]['summary_analysis']
+            assert len(statements) == 3
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
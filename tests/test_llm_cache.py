@@ -0,0 +1,104 @@
+import json
+from types import SimpleNamespace
+import pytest
+import llm_cache as llm_cache_module
+import services
+from llm_cache import LLMCache
+
+DAY = 86400
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache_module, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(path=str(tmp_path / 'llm_cache.db'), max_entries=3, max_age_days=1)
+
+
+def test_hits_and_misses_are_counted(cache):
+    key = LLMCache.make_key('model', 'template', 'input')
+    assert cache.get(key) is None
+    cache.set(key, {'answer': '回答'}, model='model')
+    assert cache.get(key) == {'answer': '回答'}
+    assert cache.get(LLMCache.make_key('model', 'template', 'other input')) is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 2, 0.3333)
+
+
+def test_key_depends_on_model_template_and_input():
+    keys = {LLMCache.make_key('a', 'b', 'c'), LLMCache.make_key('x', 'b', 'c'),
+            LLMCache.make_key('a', 'x', 'c'), LLMCache.make_key('a', 'b', 'x'), LLMCache.make_key('ab', '', 'c')}
+    assert len(keys) == 5
+
+
+def test_entries_expire_by_age(cache, clock):
+    cache.set('old', 1)
+    clock.now += DAY / 2
+    cache.set('new', 2)
+    assert cache.get('old') == 1
+    clock.now += DAY / 2 + 1
+    # 读取不会延长有效期
+    assert cache.get('old') is None
+    assert cache.get('new') == 2
+    clock.now += DAY
+    assert cache.evict() == 1
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted_past_max_entries(cache, clock):
+    for key in ('a', 'b', 'c', 'd', 'e'):
+        cache.set(key, key)
+        clock.now += 1
+    cache.get('a')
+    assert cache.evict() == 2
+    assert [cache.get(key) for key in ('a', 'b', 'c', 'd', 'e')] == ['a', None, None, 'd', 'e']
+
+
+def test_eviction_runs_every_n_writes(cache, monkeypatch):
+    monkeypatch.setattr(llm_cache_module, 'EVICT_EVERY', 5)
+    for i in range(5):
+        cache.set(str(i), i)
+    assert cache.stats()['entries'] == 3
+
+
+class CountingClient:
+    """只实现 chat.completions.create, 记录请求次数"""
+
+    def __init__(self, content):
+        self.calls = 0
+        self.content = content
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(self.content)), finish_reason='stop')],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=10, total_tokens=20), model=model)
+
+
+def test_bypass_cache_requests_again_and_refreshes_the_entry(cache, monkeypatch):
+    client = CountingClient({'background': '第一次'})
+    monkeypatch.setattr(services, 'llm_cache', cache)
+    monkeypatch.setattr(services.AnalysisService, 'client', client)
+    assert services.AnalysisService.get_detailed_analysis('an abstract') == {'background': '第一次'}
+    assert services.AnalysisService.get_detailed_analysis('an abstract') == {'background': '第一次'}
+    assert client.calls == 1
+
+    client.content = {'background': '第二次'}
+    assert services.AnalysisService.get_detailed_analysis('an abstract', bypass_cache=True) == {'background': '第二次'}
+    assert client.calls == 2
+    assert services.AnalysisService.get_detailed_analysis('an abstract') == {'background': '第二次'}
+    assert client.calls == 2
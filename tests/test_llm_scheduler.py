@@ -0,0 +1,123 @@
+import os
+import sys
+import subprocess
+import time
+import threading
+import pytest
+import llm_scheduler
+from llm_scheduler import LLMScheduler, LLMUnavailable, INTERACTIVE, BACKGROUND
+
+
+def ask(scheduler, client, prompt='hello', priority=BACKGROUND):
+    response = scheduler.chat(client, 'test', messages=[{'role': 'user', 'content': prompt}], model='mock',
+                              priority=priority)
+    return response.choices[0].message.content
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def run_in_threads(*targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+@pytest.fixture
+def short_window(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, 'WINDOW_SECONDS', 0.5)
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, 'BACKOFF_BASE', 0.01)
+
+
+def test_requests_per_minute_budget(llm_server, llm_client, short_window):
+    scheduler = LLMScheduler(rpm=2)
+    for _ in range(3):
+        ask(scheduler, llm_client)
+    sent = [t for t, _, _, _ in llm_server.requests]
+    assert sent[1] - sent[0] < 0.3
+    assert sent[2] - sent[0] >= 0.45
+
+
+def test_token_budget_is_corrected_by_actual_usage(llm_server, llm_client):
+    llm_server.latency = 0.3
+    # 每个请求预约约 1000 个输出 token, 两个请求不能同时进行; 第一个完成后按实际用量修正, 第二个无需等到窗口过期
+    scheduler = LLMScheduler(tpm=1500)
+    started = time.monotonic()
+    for thread in run_in_threads(lambda: ask(scheduler, llm_client), lambda: ask(scheduler, llm_client)):
+        thread.join(10)
+    assert llm_server.max_concurrent == 1
+    assert time.monotonic() - started < 5
+    assert scheduler.stats()['last_minute']['tokens'] < 100
+
+
+def test_interactive_requests_jump_the_queue(llm_server, llm_client):
+    llm_server.latency = 0.2
+    scheduler = LLMScheduler(concurrency=1)
+    threads = run_in_threads(lambda: ask(scheduler, llm_client, 'a'))
+    wait_until(lambda: scheduler._active == 1)
+    threads += run_in_threads(lambda: ask(scheduler, llm_client, 'bb', BACKGROUND))
+    wait_until(lambda: len(scheduler._waiting) == 1)
+    threads += run_in_threads(lambda: ask(scheduler, llm_client, 'ccc', INTERACTIVE))
+    wait_until(lambda: len(scheduler._waiting) == 2)
+    for thread in threads:
+        thread.join(10)
+    assert [prompt_length for _, _, prompt_length, _ in llm_server.requests] == [1, 3, 2]
+
+
+def test_retry_after_pauses_and_retries(llm_server, llm_client):
+    llm_server.rpm, llm_server.window, llm_server.retry_after = 1, 0.3, 1
+    scheduler = LLMScheduler(max_retries=2)
+    ask(scheduler, llm_client)
+    ask(scheduler, llm_client)
+    statuses = [status for _, _, _, status in llm_server.requests]
+    assert statuses == [200, 429, 200]
+    rejected, retried = llm_server.requests[1][0], llm_server.requests[2][0]
+    assert retried - rejected >= 0.9
+    assert scheduler.stats()['by_kind']['test']['retries'] == 1
+
+
+def test_gives_up_after_max_retries(llm_server, llm_client, fast_backoff):
+    llm_server.failure_rate = 1.0
+    scheduler = LLMScheduler(max_retries=2)
+    with pytest.raises(LLMUnavailable):
+        ask(scheduler, llm_client)
+    assert len(llm_server.requests) == 3
+    stats = scheduler.stats()
+    assert stats['by_kind']['test']['errors'] == 1
+    assert stats['active'] == 0
+
+
+def test_stream_chat_yields_the_whole_answer(llm_server, llm_client):
+    scheduler = LLMScheduler()
+    chunks = scheduler.stream_chat(llm_client, 'qa', messages=[{'role': 'user', 'content': 'question'}], model='mock',
+                                   stream_options={'include_usage': True})
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text.startswith("这是针对问题的模拟回答")
+    assert scheduler.stats()['active'] == 0
+
+
+def test_stream_chat_retries_before_the_first_chunk(llm_server, llm_client, fast_backoff):
+    llm_server.failure_rate = 1.0
+    scheduler = LLMScheduler(max_retries=1)
+    with pytest.raises(LLMUnavailable):
+        list(scheduler.stream_chat(llm_client, 'qa', messages=[{'role': 'user', 'content': 'q'}], model='mock'))
+    assert [stream for _, stream, _, _ in llm_server.requests] == [True, True]
+    assert scheduler.stats()['by_kind']['qa']['retries'] == 1
+
+
+def test_budgets_are_split_across_workers():
+    # 模块导入时读取环境变量, 在子进程中导入以模拟 gunicorn worker
+    env = dict(os.environ, WEB_CONCURRENCY='4', LLM_RPM='60', LLM_TPM='200000')
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import llm_scheduler as s; print(s.llm_scheduler.rpm, s.llm_scheduler.tpm)'],
+        env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), text=True)
+    assert output.split() == ['15', '50000']
@@ -0,0 +1,123 @@
+import queue
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import arxiv
+import pytest
+import figures
+from models import Article, Analysis
+from pipeline import IngestionPipeline, _PaperJob
+from services import ArxivService, AnalysisService
+
+PDF = {'pdf_status': 'ok', 'pdf_bytes': 1024, 'pdf_seconds': 0.1, 'pdf_error': None}
+SUMMARY = {'simplified_summary_zh': '摘要', 'keywords_en': ['pipeline'], 'innovation_rating': 3}
+DETAILED = {'background': '背景', 'methodology': '方法', 'key_innovations': ['创新'], 'potential_impact': '影响'}
+
+
+def paper(number):
+    return arxiv.Result(entry_id=f'http://arxiv.org/abs/2401.{number:05d}v1', title=f'Pipeline paper {number}',
+                        published=datetime(2024, 1, 1, tzinfo=timezone.utc), summary=f'abstract {number}',
+                        authors=[arxiv.Result.Author('Ada Lovelace')])
+
+
+class Progress:
+    """jobs.JobContext 的替身: 记录论文状态; cancel() 之后 cancelled 被读取两次时设置 cancel_seen"""
+
+    def __init__(self):
+        self.states = {}
+        self._cancelled = False
+        self._reads = 0
+        self._changed = threading.Condition()
+        self.cancel_seen = threading.Event()
+
+    @property
+    def cancelled(self):
+        if self._cancelled:
+            self._reads += 1
+            if self._reads >= 2:
+                self.cancel_seen.set()
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+    def paper_update(self, entry_id, state=None, **kwargs):
+        if state:
+            with self._changed:
+                self.states[entry_id] = state
+                self._changed.notify_all()
+
+    def wait_for(self, entry_id, state):
+        with self._changed:
+            return self._changed.wait_for(lambda: self.states.get(entry_id) == state, timeout=5)
+
+
+@pytest.fixture
+def stages(app, library, monkeypatch):
+    """替换下载、图片提取与分析; 测试可以把 stages.pdf 等换成自己的实现"""
+    stub = SimpleNamespace(pdf=lambda paper, folder: PDF, analysis=lambda abstract: (SUMMARY, DETAILED))
+    monkeypatch.setattr(ArxivService, 'download_paper_pdf', staticmethod(lambda *args: stub.pdf(*args)))
+    monkeypatch.setattr(figures, 'extract_paper_figures', lambda paper, folder: [])
+    monkeypatch.setattr(AnalysisService, 'get_combined_analysis', classmethod(lambda cls, abstract: stub.analysis(abstract)))
+    return stub
+
+
+def pipeline(**kwargs):
+    return IngestionPipeline(analysis_mode='combined', analysis_source='abstract', **kwargs)
+
+
+def test_stages_overlap_within_and_across_papers(stages):
+    both_downloading = threading.Barrier(2, timeout=5)
+    analysis_started = threading.Event()
+
+    def pdf(paper, folder):
+        # 两篇论文的下载同时进行, 且下载完成之前分析已经开始
+        both_downloading.wait()
+        assert analysis_started.wait(5)
+        return PDF
+
+    def analysis(abstract):
+        analysis_started.set()
+        return SUMMARY, DETAILED
+
+    stages.pdf, stages.analysis = pdf, analysis
+    saved = pipeline(download_workers=2).run([paper(1), paper(2)])
+    assert sorted(article.entry_id for article in saved) == [paper(1).entry_id, paper(2).entry_id]
+    assert [len(article.analyses) for article in saved] == [2, 2]
+
+
+def test_cancelled_pdf_stage_means_the_paper_is_not_written(stages):
+    progress = Progress()
+    first, second = paper(1), paper(2)
+
+    def pdf(paper, folder):
+        # 第二篇提交之后、开始下载之前取消任务 (只有一个下载线程)
+        assert progress.wait_for(second.entry_id, 'processing')
+        progress.cancel()
+        assert progress.cancel_seen.wait(5)
+        return PDF
+
+    stages.pdf = pdf
+    saved = pipeline(download_workers=1).run([first, second], progress)
+    assert [article.entry_id for article in saved] == [first.entry_id]
+    assert progress.states == {first.entry_id: 'saved', second.entry_id: 'cancelled'}
+    assert Article.query.filter_by(entry_id=second.entry_id).count() == 0
+
+
+def finished_job(paper, folder):
+    job = _PaperJob(paper, folder, queue.Queue(), ())
+    job.results = {'pdf': PDF, 'figures': [], 'analysis': (SUMMARY, DETAILED)}
+    return job
+
+
+def test_failed_batch_is_retried_paper_by_paper(stages, library):
+    good, bad, other = paper(1), paper(2), paper(3)
+    bad.title = None  # 违反 NOT NULL, 整批写入失败
+    jobs = [finished_job(p, str(library)) for p in (good, bad, other)]
+    saved = []
+    progress = Progress()
+    IngestionPipeline._write_batch(jobs, saved, progress)
+    assert sorted(article.entry_id for article in saved) == [good.entry_id, other.entry_id]
+    assert progress.states == {good.entry_id: 'saved', bad.entry_id: 'failed', other.entry_id: 'saved'}
+    assert Article.query.count() == 2
+    assert Analysis.query.count() == 4
@@ -0,0 +1,89 @@
+import json
+import pytest
+import app as app_module
+import services
+from models import db, Article, QnaHistory
+
+
+def events(response):
+    parsed = []
+    for raw in response.get_data(as_text=True).strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in raw.splitlines())
+        parsed.append((lines['event'], json.loads(lines['data'])))
+    return parsed
+
+
+@pytest.fixture
+def article(app):
+    article = Article(entry_id='http://arxiv.org/abs/qna', title='Q&A', original_summary='streaming abstract')
+    db.session.add(article)
+    db.session.commit()
+    return article
+
+
+def ask(client, article_id, question='What is new?'):
+    return client.post(f'/api/articles/{article_id}/ask/stream', json={'question': question})
+
+
+def test_complete_answer_is_saved(client, article, llm_client, monkeypatch):
+    monkeypatch.setattr(services.AnalysisService, 'client', llm_client)
+    received = events(ask(client, article.id, 'complete answer?'))
+    assert received[-1][0] == 'done'
+    answer = received[-1][1]['answer']
+    assert answer == "".join(data['token'] for event, data in received if event == 'token')
+    assert [q.answer for q in QnaHistory.query.filter_by(article_id=article.id)] == [answer]
+
+
+def test_failed_stream_sends_error_and_is_not_saved(client, article, monkeypatch):
+    def broken_stream(question, context):
+        yield "partial "
+        raise ConnectionError("upstream closed")
+
+    monkeypatch.setattr(services.AnalysisService, 'stream_question_with_context', broken_stream)
+    received = events(ask(client, article.id))
+    assert [event for event, _ in received] == ['token', 'error']
+    assert QnaHistory.query.count() == 0
+
+
+def test_article_deleted_during_stream(client, article, monkeypatch):
+    article_id = article.id
+
+    def stream_then_delete(question, context):
+        yield "answer"
+        db.session.delete(db.session.get(Article, article_id))
+        db.session.commit()
+
+    monkeypatch.setattr(services.AnalysisService, 'stream_question_with_context', stream_then_delete)
+    received = events(ask(client, article_id))
+    assert received[-1] == ('done', {'answer': 'answer'})
+    assert QnaHistory.query.count() == 0
+
+
+@pytest.fixture
+def uncached_pdf(article, tmp_path, monkeypatch):
+    """文章有 PDF 但全文尚未提取; 请求线程中任何提取都会让测试失败"""
+    article.local_path = str(tmp_path)
+    db.session.commit()
+    with open(services.ArxivService.article_pdf_path(article), 'wb') as f:
+        f.write(b'%PDF-1.4 not parsed here')
+
+    def no_extraction():
+        raise AssertionError("full text extracted on the request thread")
+
+    monkeypatch.setattr(services.fulltext_store, '_executor', no_extraction)
+    submitted = []
+    monkeypatch.setattr(app_module.job_queue, 'submit', lambda job_type, params=None: submitted.append((job_type, params)))
+    monkeypatch.setattr(services.AnalysisService, 'ask_question_with_context', lambda question, context: 'answer')
+    return submitted
+
+
+def test_abstract_mode_answers_without_touching_the_pdf(client, article, uncached_pdf, monkeypatch):
+    monkeypatch.setattr(services, 'ANALYSIS_SOURCE', 'abstract')
+    assert client.post(f'/api/articles/{article.id}/ask', json={'question': 'q'}).status_code == 200
+    assert uncached_pdf == []
+
+
+def test_fulltext_mode_queues_extraction_instead_of_waiting(client, article, uncached_pdf, monkeypatch):
+    monkeypatch.setattr(services, 'ANALYSIS_SOURCE', 'fulltext')
+    assert client.post(f'/api/articles/{article.id}/ask', json={'question': 'q'}).status_code == 200
+    assert uncached_pdf == [('extract_fulltext', {'article_id': article.id})]
@@ -0,0 +1,34 @@
+from datetime import datetime
+import pytest
+from models import db, Article
+
+
+@pytest.fixture
+def article(app):
+    article = Article(entry_id='http://arxiv.org/abs/cached', title='Cached', published=datetime(2024, 1, 1))
+    db.session.add(article)
+    db.session.commit()
+    return article
+
+
+def test_unchanged_article_returns_304(client, article):
+    first = client.get(f'/api/articles/{article.id}')
+    again = client.get(f'/api/articles/{article.id}', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_write_within_the_same_second_changes_the_etag(client, article):
+    first = client.get(f'/api/articles/{article.id}')
+    article.title = 'Renamed'
+    db.session.commit()
+    headers = {'If-None-Match': first.headers['ETag'], 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}
+    again = client.get(f'/api/articles/{article.id}', headers=headers)
+    assert again.status_code == 200
+    assert again.get_json()['title'] == 'Renamed'
+
+
+def test_json_responses_are_not_validated_by_date(client, article):
+    response = client.get('/api/articles/latest')
+    assert 'Last-Modified' not in response.headers
+    again = client.get('/api/articles/latest', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert again.status_code == 200
@@ -0,0 +1,71 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, text
+import migrations
+import search_index
+from models import db, Article
+
+
+def add_article(title, summary='', published=datetime(2024, 1, 1)):
+    article = Article(entry_id=f'http://arxiv.org/abs/{title}', title=title, original_summary=summary,
+                      published=published)
+    db.session.add(article)
+    db.session.flush()
+    search_index.index_article(article, analyses={}, qna=[])
+    db.session.commit()
+    return article
+
+
+def test_best_match_ranks_first_regardless_of_age(app):
+    best = add_article('Diffusion models for diffusion', 'diffusion diffusion')
+    for number in range(30):
+        add_article(f'Paper {number}', f'We mention diffusion once among many other words {number}.')
+    hits, has_more = search_index.search('diffusion', limit=5)
+    assert hits[0][0] == best.id
+    assert len(hits) == 5 and has_more
+
+
+def test_pages_cover_every_hit_once(app):
+    ids = {add_article(f'Graph study {number}', 'graph').id for number in range(7)}
+    first, has_more = search_index.search('graph', limit=4)
+    second, last_page = search_index.search('graph', limit=4, offset=4)
+    assert has_more and not last_page
+    assert {hit[0] for hit in first + second} == ids
+
+
+def test_highlights_are_escaped_except_marks(app):
+    add_article('<img src=x onerror=alert(1)> transformer')
+    add_article('Attention', 'a <script>convolution</script> & more')
+    [(_, _, title, _)] = search_index.search('transformer')[0]
+    assert title == '&lt;img src=x onerror=alert(1)&gt; <mark>transformer</mark>'
+    [(_, _, _, snippet)] = search_index.search('convolution')[0]
+    assert snippet == 'a &lt;script&gt;<mark>convolution</mark>&lt;/script&gt; &amp; more'
+
+
+@pytest.mark.parametrize('query', ['', '"', '***'])
+def test_queries_without_words_return_nothing(app, query):
+    assert search_index.search(query) == ([], False)
+
+
+def test_terms_match_whole_words_unless_marked_as_prefix(app):
+    article = add_article('Diffusion transformers')
+    assert search_index.search('diffus') == ([], False)
+    assert [hit[0] for hit in search_index.search('diffus*')[0]] == [article.id]
+    assert search_index.build_match_query('mo* 扩散*') == '"mo"* "扩 散"'
+
+
+def test_migration_adds_prefix_indexes_to_an_existing_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    columns = ", ".join(search_index.FTS_COLUMNS)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE VIRTUAL TABLE {search_index.FTS_TABLE} USING fts5({columns})"))
+        conn.execute(text(f"INSERT INTO {search_index.FTS_TABLE} (rowid, title) VALUES (7, 'graph networks')"))
+        conn.execute(text("PRAGMA user_version = 7"))
+    with engine.begin() as conn:
+        assert migrations.upgrade(conn) == [8]
+        sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = :name"),
+                           {'name': search_index.FTS_TABLE}).scalar()
+        assert "prefix='2 3'" in sql
+        rows = conn.execute(text(f"SELECT rowid FROM {search_index.FTS_TABLE} WHERE {search_index.FTS_TABLE} "
+                                 f"MATCH 'gr*'")).fetchall()
+    assert rows == [(7,)]
@@ -0,0 +1,123 @@
+import os
+import shutil
+import pytest
+import services
+import storage
+from models import db, Article, StorageFolder
+
+
+def make_folder(library, name, marker=True, content=b'pdf'):
+    path = library / name
+    (path / 'images').mkdir(parents=True)
+    (path / 'paper.pdf').write_bytes(content)
+    if marker:
+        (path / services.FOLDER_MARKER).write_text(f'http://arxiv.org/abs/{name}')
+    return path
+
+
+def add_article(name, local_path):
+    article = Article(entry_id=f'http://arxiv.org/abs/{name}', title=name, local_path=str(local_path))
+    db.session.add(article)
+    db.session.commit()
+    return article
+
+
+@pytest.fixture
+def no_grace(monkeypatch):
+    monkeypatch.setattr(storage, 'ORPHAN_GRACE_HOURS', 0)
+
+
+def test_orphans_are_only_reported_by_default(app, library, no_grace):
+    orphan = make_folder(library, 'orphan')
+    report = storage.StorageScanner().run()
+    assert orphan.exists()
+    assert report['orphans_pending'] == 1
+    assert db.session.get(StorageFolder, 'orphan').orphan_since is not None
+
+
+def test_orphan_with_marker_is_collected_when_enabled(app, library, no_grace):
+    orphan = make_folder(library, 'orphan')
+    report = storage.StorageScanner(collect_orphans=True).run()
+    assert not orphan.exists()
+    assert report['orphans_removed'] == 1
+    assert db.session.get(StorageFolder, 'orphan') is None
+
+
+def test_folder_without_marker_is_never_touched(app, library, no_grace):
+    own = make_folder(library, 'my notes', marker=False)
+    report = storage.StorageScanner(collect_orphans=True).run()
+    assert own.exists()
+    assert report['unmanaged'] == 1
+    assert db.session.get(StorageFolder, 'my notes') is None
+
+
+def test_orphan_within_grace_period_is_kept(app, library):
+    orphan = make_folder(library, 'orphan')
+    storage.StorageScanner(collect_orphans=True).run()
+    assert orphan.exists()
+
+
+def test_owner_matched_by_folder_name_not_path_spelling(app, library, tmp_path, no_grace):
+    """SAVE_PATH 改为其他写法 (这里是指向同一目录的符号链接) 后, 已有文章的目录不能被当作孤立目录"""
+    folder = make_folder(library, 'paper')
+    article = add_article('paper', folder)
+    alias = tmp_path / 'alias'
+    alias.symlink_to(library)
+    report = storage.StorageScanner(root=str(alias), collect_orphans=True).run()
+    assert folder.exists()
+    assert report.get('orphans_pending', 0) == 0
+    assert db.session.get(StorageFolder, 'paper').article_id == article.id
+
+
+def test_folder_vanishing_during_scan_is_skipped(app, library, monkeypatch):
+    make_folder(library, 'a')
+    make_folder(library, 'b')
+    original = storage._stamp
+
+    def stamp_after_delete(path):
+        if os.path.basename(path) == 'a':
+            shutil.rmtree(path)
+        return original(path)
+
+    monkeypatch.setattr(storage, '_stamp', stamp_after_delete)
+    report = storage.StorageScanner(collect_orphans=True).run()
+    assert report['vanished'] == 1
+    assert report['folders'] == 1
+
+
+def test_remove_article_files_keeps_folder_still_referenced(app, library):
+    folder = make_folder(library, 'shared')
+    add_article('other', os.path.relpath(folder))
+    assert storage.remove_article_files(str(folder)) is False
+    assert folder.exists()
+
+
+def test_remove_article_files_refuses_paths_outside_library(app, library, tmp_path):
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    assert storage.remove_article_files(str(outside)) is False
+    assert outside.exists()
+
+
+def test_remove_article_files_keeps_folder_of_paper_being_imported(app, library):
+    from coordination import PaperClaims
+    folder = make_folder(library, 'paper')
+    importer = PaperClaims()
+    importer.claim(['http://arxiv.org/abs/paper'])
+    assert storage.remove_article_files(str(folder), entry_id='http://arxiv.org/abs/paper') is False
+    importer.release_all()
+    assert storage.remove_article_files(str(folder), entry_id='http://arxiv.org/abs/paper') is True
+    assert not folder.exists()
+
+
+def test_identical_files_are_hardlinked(app, library, monkeypatch):
+    monkeypatch.setattr(storage, 'DEDUPE_MIN_BYTES', 1)
+    content = os.urandom(4096)
+    first = make_folder(library, 'first', content=content)
+    second = make_folder(library, 'second', content=content)
+    add_article('first', first)
+    add_article('second', second)
+    report = storage.StorageScanner().run()
+    assert report['deduplicated_files'] == 1
+    assert os.stat(first / 'paper.pdf').st_ino == os.stat(second / 'paper.pdf').st_ino
+    assert (second / 'paper.pdf').read_bytes() == content